@@ -0,0 +1,99 @@
+"""Benchmark the deployment orchestration without AWS or Docker.
+
+The deployment of the given configs runs several times against the plan
+backend. Calls take no time in the first series of runs, so their wall
+time is the orchestration overhead: local hashing, bundling, scheduling
+and botocore serialization. With --replay a second series of runs waits
+for the latencies recorded by a real run (main.py --record CALLS_FILE).
+The report holds the wall time, the duration of each step and the count
+and time of the calls of each operation.
+"""
+from argparse import ArgumentParser
+from typing import Any, Dict, List
+import json
+import logging
+import statistics
+import time
+
+from constants import DEFAULT_CONFIG
+from main import deploy
+from utils.aws_call_utils import AWSCallLayer
+from utils.config_utils import configure
+from utils.plan_utils import create_plan_backend
+
+LOGGER = logging.getLogger()
+
+def parse_args() -> Dict[str, Any]:
+    parser = ArgumentParser(description="Benchmark the deployment orchestration against the plan backend")
+    parser.add_argument("-c", "--config", nargs="+", default=[DEFAULT_CONFIG], help="Path to config files")
+    parser.add_argument("--runs", type=int, default=5, help="Runs of each series")
+    parser.add_argument("--replay", metavar="CALLS_FILE", help="Also run with the latencies recorded by a real run")
+    parser.add_argument("--cold", action="store_true", help="Ignore the plan deployment state on every run")
+    parser.add_argument("--output", help="Save the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Keep the logs of the deployments")
+    return vars(parser.parse_args())
+
+
+def run_once(argv: List[str], verbose: bool) -> Dict[str, Any]:
+    """Deploy once against the plan backend and return the wall time, report and call summary."""
+    configs = configure(argv)
+    if(verbose == False):
+        logging.getLogger().setLevel(logging.WARNING)
+    aws_config = configs[0]["deployment"]["aws"]
+    backend = create_plan_backend(configs[0]["args"], aws_config)
+    aws = AWSCallLayer(aws_config, backend=backend)
+
+    start = time.monotonic()
+    report = deploy(configs, aws, backend)
+    return {"wall": time.monotonic() - start, "report": report, "calls": aws.stats.summary()}
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Aggregate a series of runs, medians of the durations and of the call counts and times."""
+    walls = [run["wall"] for run in runs]
+    steps = {}
+    calls = {}
+    for run in runs:
+        for name, entry in run["report"].items():
+            for step, duration in entry["steps"].items():
+                steps.setdefault(f"{name}/{step}", []).append(duration)
+        for operation, entry in run["calls"].items():
+            calls.setdefault(operation, []).append(entry)
+    return {
+        "runs": len(runs),
+        "failures": sum(1 for run in runs for entry in run["report"].values() if entry["status"] != "succeeded"),
+        "wall": {"min": min(walls), "median": statistics.median(walls), "max": max(walls)},
+        "steps": {step: statistics.median(durations) for step, durations in sorted(steps.items())},
+        "calls": {operation: {
+            "calls": statistics.median(entry["calls"] for entry in entries),
+            "time": statistics.median(entry["total_latency"] for entry in entries)
+        } for operation, entries in sorted(calls.items())}
+    }
+
+
+def log_series(name: str, summary: Dict[str, Any]) -> None:
+    wall = summary["wall"]
+    LOGGER.info(f"{name}: {summary['runs']} runs, {summary['failures']} failures, wall "
+                f"{wall['min']:.3f}s min {wall['median']:.3f}s median {wall['max']:.3f}s max")
+    for step, duration in summary["steps"].items():
+        LOGGER.info(f"  {step:<60} {duration:8.3f}s")
+    for operation, entry in summary["calls"].items():
+        LOGGER.info(f"  {operation:<60} {entry['calls']:>5.0f} calls {entry['time']:8.3f}s")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    argv = ["--config", *args["config"], "--plan"] + (["--refresh"] if args["cold"] else [])
+    series = {"overhead": [run_once(argv, args["verbose"]) for _ in range(args["runs"])]}
+    if(args["replay"] is not None):
+        series["replay"] = [run_once(argv + ["--replay", args["replay"]], args["verbose"])
+                            for _ in range(args["runs"])]
+
+    report = {name: summarize(runs) for name, runs in series.items()}
+    logging.getLogger().setLevel(logging.INFO)
+    for name, summary in report.items():
+        log_series(name, summary)
+    if(args["output"] is not None):
+        with open(args["output"], "w") as f:
+            json.dump(report, f, indent=2)
+    if(any(summary["failures"] > 0 for summary in report.values())): exit(1)
@@ -8,4 +8,41 @@ CLOUDFORMATION_CAPABILITIES = {
     "CAPABILITY_NAMED_IAM",
     "CAPABILITY_AUTO_EXPAND",
     "CAPABILITY_RESOURCE_POLICY"
-}
\ No newline at end of file
+}
+S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+S3_DELETE_BATCH_SIZE = 1000
+S3_UPLOAD_MAX_WORKERS = 16
+CACHE_DIR=".cache"
+SQL_DIR=f"{SCRIPTS_DIR}/sql"
+BUNDLES_DIR=f"{CACHE_DIR}/bundles"
+BUNDLES_S3_PREFIX="bundles"
+# node scripts are shipped as one bundle per role, extracted under /opt/bootstrap on the nodes,
+# the scripts sourced by every node script go along in each node bundle
+BUNDLE_ROLES = {
+    "controlplane": [f"{SCRIPTS_DIR}/controlplane", f"{SCRIPTS_DIR}/common"],
+    "worker": [f"{SCRIPTS_DIR}/worker", f"{SCRIPTS_DIR}/common"],
+    "keycloak": [f"{SCRIPTS_DIR}/keycloak", f"{SCRIPTS_DIR}/common"],
+    "addons": [f"{SCRIPTS_DIR}/addons"]
+}
+BUNDLE_PARAMETERS = {
+    "controlplane": "ControlPlaneBundleS3Key",
+    "worker": "WorkerBundleS3Key",
+    "keycloak": "KeycloakBundleS3Key",
+    "addons": "AddonsBundleS3Key"
+}
+ARTIFACTS_FILE="config/artifacts.yaml"
+ARTIFACTS_CACHE_DIR=f"{CACHE_DIR}/artifacts"
+ARTIFACTS_S3_PREFIX="artifacts"
+PLAN_DIR=f"{CACHE_DIR}/plan"
+PLAN_CALLS_FILE=f"{PLAN_DIR}/calls.json"
+CONFIG_CACHE_DIR=f"{CACHE_DIR}/config"
+ECR_AUTH_CACHE_DIR=f"{CACHE_DIR}/ecr"
+# cached ECR tokens are fetched again when they expire within this many seconds
+ECR_AUTH_MIN_VALIDITY = 15 * 60
+RELEASES_S3_PREFIX="releases"
+RELEASES_CACHE_DIR=f"{CACHE_DIR}/releases"
+# templates and SQL scripts are published together under releases/<content hash>/, never overwritten
+RELEASE_DIRS = [SQL_DIR, TEMPLATES_DIR]
+# boot phase records of the nodes, under <prefix>/<role>/<instance id>.jsonl in the environment bucket
+TIMELINES_S3_PREFIX="timelines"
+TIMELINES_DIR=f"{CACHE_DIR}/timelines"
@@ -0,0 +1,27 @@
+import logging
+import time
+
+logger = logging.getLogger()
+
+class TTLCache:
+    """In-memory cache surviving across warm invocations of the Lambda container."""
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or (entry[1] is not None and time.monotonic() > entry[1]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        self.entries[key] = (value, expires_at)
+
+    def log_stats(self):
+        logger.info("Cache stats: " + str(self.hits) + " hits, " + str(self.misses) + " misses")
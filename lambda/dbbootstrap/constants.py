@@ -1,11 +1,31 @@
+import re
+
 INSTANCE_STARTED_EVENT_ID = 'RDS-EVENT-0088'
+# instance started events of the same cluster within this window are bootstrapped once
+DUPLICATE_EVENT_WINDOW = 300
+
+RECORD_BOOTSTRAPPED = 'bootstrapped'
+RECORD_DUPLICATE = 'duplicate'
+RECORD_IGNORED = 'ignored'
+RECORD_INVALID = 'invalid'
+RECORD_FAILED = 'failed'
 
 SQL_DIR='/tmp/sql'
-SQL_FILENAME='init.sql'
-SQL_FILEPATH=f'{SQL_DIR}/{SQL_FILENAME}'
+
+MIGRATION_FILENAME_REGEX = re.compile(r'^V(\d+)__(\w+)\.sql$')
+MIGRATIONS_LEDGER_TABLE = 'public.schema_migrations'
+MIGRATIONS_LOCK_ID = 727465
+UNDEFINED_TABLE_SQLSTATE = '42P01'
+# statements PostgreSQL refuses to run inside a transaction block
+NON_TRANSACTIONAL_STATEMENT_REGEX = re.compile(
+    r'^\s*(CREATE\s+DATABASE|DROP\s+DATABASE|CREATE\s+TABLESPACE|DROP\s+TABLESPACE|ALTER\s+SYSTEM|VACUUM'
+    r'|CREATE\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY|DROP\s+INDEX\s+CONCURRENTLY|REINDEX\b.*\bCONCURRENTLY)\b',
+    re.IGNORECASE | re.DOTALL)
 
 CERTS_URL = 'https://truststore.pki.rds.amazonaws.com/global/global-bundle.pem'
 CERTS_DIR='/tmp'
 CERTS_FILENAME='global-bundle.pem'
 CERTS_FILEPATH=f'{CERTS_DIR}/{CERTS_FILENAME}'
 
+SECRET_CACHE_TTL = 300
+CERTS_CACHE_TTL = 24 * 60 * 60
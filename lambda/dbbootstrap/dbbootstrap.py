@@ -1,14 +1,21 @@
-import subprocess
 import boto3
 import logging
 import os
+import ssl
 import sys
+import time
 from botocore.exceptions import ClientError
+import datetime
+import hashlib
 import json
-import requests
+import urllib.request
+import urllib.error
+import pg8000.native
 
-from dbbootstrap.constants import *
-from dbbootstrap.exceptions import *
+from constants import *
+from exceptions import *
+from cache import TTLCache
+from sqlscript import split_sql_script, CONNECT, GEXEC
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -21,76 +28,152 @@ SECRET_ARN = os.environ['Secret_ARN']
 REGION_NAME = os.environ['Region_Name'] 
 SQL_SCRIPT_S3_BUCKET = os.environ['SQLScriptS3Bucket']
 SQL_SCRIPT_S3_KEY = os.environ['SQLScriptS3Key']
+DB_SSLMODE = os.environ.get('DBSSLMode', 'verify-ca')
+
+# Clients and cache live at module scope so that warm invocations reuse them
+session = boto3.session.Session()
+secrets_client = session.client(service_name='secretsmanager', region_name=REGION_NAME)
+s3_client = session.client('s3')
+cache = TTLCache()
+connections = {}
 
 def handler(event, context):
     try:
         responseData = {}
-        if is_instance_started_event(event):
+        records = [parse_sns_record(record) for record in event.get('Records', [])]
+        to_bootstrap = select_instance_started_records(records)
+        if to_bootstrap:
             
             try:
                 DBPASS = get_secret(SECRET_ARN,REGION_NAME)
-                get_global_certificates(CERTS_URL, CERTS_FILEPATH)
-                get_sql_script_from_s3(SQL_SCRIPT_S3_BUCKET, SQL_SCRIPT_S3_KEY, SQL_FILEPATH)
-                responseData = execute_sql(SQL_FILEPATH, DBPASS, CERTS_FILEPATH, responseData)
+                if DB_SSLMODE != 'disable':
+                    get_global_certificates(CERTS_URL, CERTS_FILEPATH)
+                migrations = get_migrations_from_s3(SQL_SCRIPT_S3_BUCKET, SQL_SCRIPT_S3_KEY, SQL_DIR)
+                responseData = apply_migrations(migrations, DBPASS, CERTS_FILEPATH, responseData)
+                cache.put(('bootstrapped', DBHOST), max(record['EventTime'] for record in to_bootstrap), 
+                          DUPLICATE_EVENT_WINDOW)
+                cache.log_stats()
+                responseData['Records'] = get_record_results(records)
                 return responseData
                
             except GetSecretException as e:
                 logger.error('Exception: ' + str(e))
                 logger.error("ERROR: Unexpected error: Couldn't retrieve secret from AWS SecretManager.")
                 responseData['Data'] = "ERROR: Unexpected error: Couldn't retrieve secret from AWS SecretManager."
+                fail_records(to_bootstrap, records)
                 sys.exit()
 
             except GetGlobalCertificatesException as e:
                 logger.error('Exception: ' + str(e))
                 logger.error("ERROR: Unexpected error: Couldn't download global certificates.")
                 responseData['Data'] = "ERROR: Unexpected error: Couldn't download global certificates."
+                fail_records(to_bootstrap, records)
                 sys.exit()
  
             except GetSQLScriptException as e:
                 logger.error('Exception: ' + str(e))
-                logger.error("ERROR: Unexpected error: Couldn't download SQL script from S3.")
-                responseData['Data'] = "ERROR: Unexpected error: Couldn't download SQL script from S3."
+                logger.error("ERROR: Unexpected error: Couldn't download SQL migrations from S3.")
+                responseData['Data'] = "ERROR: Unexpected error: Couldn't download SQL migrations from S3."
+                fail_records(to_bootstrap, records)
+                sys.exit()
+
+            except MigrationChecksumException as e:
+                logger.error('Exception: ' + str(e))
+                logger.error("ERROR: Unexpected error: An applied SQL migration was modified.")
+                responseData['Data'] = "ERROR: Unexpected error: An applied SQL migration was modified."
+                fail_records(to_bootstrap, records)
                 sys.exit()
             
             except ExecuteSQLScriptException as e:
                 logger.error('Exception: ' + str(e))
                 logger.error("ERROR: Unexpected error: Failed to execute SQL script.")
                 responseData['Data'] = "ERROR: Unexpected error: Failed to execute SQL script."
+                fail_records(to_bootstrap, records)
                 sys.exit()
         else:
-            responseData['Data'] = "\n{} is unsupported event type".format(event['Records'][0]['Sns']['Message'])
+            responseData['Data'] = "\nNo instance started event to bootstrap in " + str(len(records)) + " records"
+            responseData['Records'] = get_record_results(records)
+            return responseData
     
     except Exception as e:
         logger.exception('Exception: ' + str(e))
         responseData['Data'] = "ERROR: Unexpected error: Couldn't connect to Aurora PostgreSQL instance."
         sys.exit()
 
-def is_instance_started_event(event):
-    sns_message = json.loads(event['Records'][0]['Sns'])
-    logger.info("Received SNS message: " + str(sns_message))
-    
-    # Extract the 'EventID' from the message attributes
-    message_attributes = sns_message.get('MessageAttributes', {})
-    event_id_attribute = message_attributes.get('EventID', {})
+def parse_event_time(value):
+    # RDS uses '2023-07-11 22:36:03.153', SNS uses '2023-07-11T22:36:03.222Z', both in UTC
+    try:
+        value = value.rstrip('Z').replace('T', ' ')
+        parsed = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S')
+        return parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+    except (AttributeError, ValueError):
+        return None
 
-    # Extract the value from the 'EventID' message attribute
-    event_id = event_id_attribute.get('Value', None)
+def parse_sns_record(record):
+    sns = record.get('Sns', {})
+    result = {
+        'MessageId': sns.get('MessageId'),
+        'EventID': None,
+        'SourceId': None,
+        'EventTime': parse_event_time(sns.get('Timestamp')),
+        'Status': RECORD_INVALID
+    }
 
-    if event_id == INSTANCE_STARTED_EVENT_ID:
-        logger.info("Received instance started event: " + str(event))
-        return True
-    
-    logger.info("Received event: " + str(event) + " is not an instance started event")
-    return False
+    try:
+        message = json.loads(sns.get('Message') or '{}')
+    except ValueError:
+        logger.warning("Received SNS message " + str(result['MessageId']) + " without a JSON body")
+        message = {}
+    if not isinstance(message, dict):
+        message = {}
+
+    # The subscription filter matches the EventID message attribute, the RDS message carries it as a link
+    event_id = sns.get('MessageAttributes', {}).get('EventID', {}).get('Value')
+    if event_id is None and message.get('Event ID'):
+        event_id = message['Event ID'].rsplit('#', 1)[-1]
+    result['EventID'] = event_id
+    result['SourceId'] = message.get('Source ID')
+    result['EventTime'] = parse_event_time(message.get('Event Time')) or result['EventTime'] or time.time()
+    if event_id is not None:
+        result['Status'] = RECORD_IGNORED
+    logger.info("Received SNS message " + str(result['MessageId']) + " with EventID " + str(event_id) 
+                + " from " + str(result['SourceId']))
+    return result
+
+def select_instance_started_records(records):
+    # Every instance of the cluster emits its own start event, bootstrap once per cluster and window
+    started = [record for record in records if record['EventID'] == INSTANCE_STARTED_EVENT_ID]
+    last_bootstrap = cache.get(('bootstrapped', DBHOST))
+    to_bootstrap = []
+    for record in sorted(started, key=lambda record: record['EventTime']):
+        if last_bootstrap is not None and abs(record['EventTime'] - last_bootstrap) < DUPLICATE_EVENT_WINDOW:
+            record['Status'] = RECORD_DUPLICATE
+            logger.info("Skipping duplicate instance started event from " + str(record['SourceId']))
+            continue
+        record['Status'] = RECORD_BOOTSTRAPPED
+        last_bootstrap = record['EventTime']
+        to_bootstrap.append(record)
+    return to_bootstrap
+
+def fail_records(failed, records):
+    for record in failed:
+        record['Status'] = RECORD_FAILED
+    get_record_results(records)
+
+def get_record_results(records):
+    results = [{key: record[key] for key in ('MessageId', 'EventID', 'SourceId', 'Status')} for record in records]
+    logger.info("Processed SNS records: " + json.dumps(results))
+    return results
 
 def get_secret(secret_arn,region_name):
+    cached_secret = cache.get(('secret', secret_arn))
+    if cached_secret is not None:
+        logger.info("Using cached secret from AWS SecretManager")
+        return cached_secret
 
-    # Create a Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(
-        service_name='secretsmanager',
-        region_name=region_name
-    )
+    client = secrets_client
+    if region_name != REGION_NAME:
+        client = session.client(service_name='secretsmanager', region_name=region_name)
     logger.info("Retrieving secret from AWS SecretManager")
     try:
         get_secret_value_response = client.get_secret_value(
@@ -111,75 +194,290 @@ def get_secret(secret_arn,region_name):
     else:
         # Decrypts secret using the associated KMS CMK.
         secret = json.loads(get_secret_value_response['SecretString'])['password']
+        cache.put(('secret', secret_arn), secret, SECRET_CACHE_TTL)
         logger.info("Retrieved secret from AWS SecretManager successfully")
         return secret
 
 def get_sql_script_from_s3(sql_script_s3_bucket, sql_script_s3_key, local_sql_filepath):
-    s3 = boto3.client('s3')
+    # Conditional GET: a warm container only downloads the script again when its ETag changed
+    cache_key = ('sql_etag', sql_script_s3_bucket, sql_script_s3_key, local_sql_filepath)
+    etag = cache.get(cache_key)
+    request = {'Bucket': sql_script_s3_bucket, 'Key': sql_script_s3_key}
+    if etag is not None and os.path.exists(local_sql_filepath):
+        request['IfNoneMatch'] = etag
+
     try:
-        s3.download_file(sql_script_s3_bucket, sql_script_s3_key, local_sql_filepath)
+        response = s3_client.get_object(**request)
+        os.makedirs(os.path.dirname(local_sql_filepath), exist_ok=True)
+        with open(local_sql_filepath, 'wb') as sql_file:
+            sql_file.write(response['Body'].read())
+        os.chmod(local_sql_filepath, 0o600) # Change file permissions to make it readable only by the owner
+        cache.put(cache_key, response['ETag'])
         logger.info("Downloaded SQL script successfully from S3 bucket: " + sql_script_s3_bucket + " and key: " 
                     + sql_script_s3_key)
-        os.chmod(SQL_FILEPATH, 0o600) # Change file permissions to make it readable only by the owner
     
     except ClientError as e:
+        if e.response['Error']['Code'] in ('304', 'NotModified'):
+            logger.info("SQL script not modified since last download, using cached copy")
+            return
         logger.error('Exception: ' + str(e))
         logger.error("ERROR: Unexpected error: Failed to download SQL script from S3 bucket: " 
                      + sql_script_s3_bucket + " and key: " + sql_script_s3_key)
         raise GetSQLScriptException("ERROR: Unexpected error: Failed to download SQL script from S3 bucket: " 
                                     + sql_script_s3_bucket + " and key: " + sql_script_s3_key + ". Exception: " + str(e))
 
+def get_migrations_from_s3(sql_script_s3_bucket, sql_migrations_s3_prefix, local_sql_dir):
+    # List the migration scripts under the prefix and fetch each one with a conditional GET
+    migrations = []
+    try:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=sql_script_s3_bucket, Prefix=sql_migrations_s3_prefix):
+            for obj in page.get('Contents', []):
+                filename = obj['Key'].rsplit('/', 1)[-1]
+                match = MIGRATION_FILENAME_REGEX.match(filename)
+                if match is None:
+                    logger.info("Skipping S3 object that is not a migration: " + obj['Key'])
+                    continue
+                migrations.append((int(match.group(1)), match.group(2), obj['Key'], filename))
+    except ClientError as e:
+        logger.error('Exception: ' + str(e))
+        raise GetSQLScriptException("ERROR: Unexpected error: Failed to list SQL migrations in S3 bucket: " 
+                                    + sql_script_s3_bucket + " and prefix: " + sql_migrations_s3_prefix
+                                    + ". Exception: " + str(e))
+
+    result = []
+    for version, description, key, filename in sorted(migrations):
+        local_filepath = os.path.join(local_sql_dir, filename)
+        get_sql_script_from_s3(sql_script_s3_bucket, key, local_filepath)
+        result.append((version, description, local_filepath))
+    logger.info("Found " + str(len(result)) + " SQL migrations under prefix: " + sql_migrations_s3_prefix)
+    return result
+
 def get_global_certificates(certs_url, certs_filepath):
-    
+    if cache.get(('certs', certs_url, certs_filepath)) is not None and os.path.exists(certs_filepath):
+        logger.info("Using cached global certificates")
+        return
+
     try:
         logger.info("Downloading global certificates from: " + certs_url)
-        response = requests.get(certs_url)
-        response.raise_for_status()  # Raise an error for HTTP errors
+        with urllib.request.urlopen(certs_url, timeout=10) as response:
+            content = response.read()
 
         with open(certs_filepath, 'wb') as cert_file:
-            cert_file.write(response.content)
+            cert_file.write(content)
 
         # Change file permissions to make it readable by everyone
         os.chmod(certs_filepath, 0o644)
+        cache.put(('certs', certs_url, certs_filepath), True, CERTS_CACHE_TTL)
 
         logger.info("Downloaded global certificates successfully")
-    except requests.exceptions.RequestException as e:
+    except (urllib.error.URLError, OSError) as e:
         logger.error('Exception: ' + str(e))
         logger.error("ERROR: Unexpected error: Failed to download global certificates from: " + certs_url)
         raise GetGlobalCertificatesException("ERROR: Unexpected error: Failed to download global certificates from: " 
                                              + certs_url + ". Exception: " + str(e))   
     
-def execute_sql(sql, dbpass, certs_filepath, responseData):
+def check_connections():
+    # Connections kept by a warm container may have been closed by the server, check them once per invocation
+    for database, connection in list(connections.items()):
+        try:
+            connection.run("SELECT 1")
+        except (pg8000.native.InterfaceError, pg8000.native.DatabaseError, OSError, ssl.SSLError):
+            logger.info("Connection to database " + database + " is stale, reconnecting")
+            close_connection(database)
+
+def get_connection(database, dbpass, certs_filepath):
+    # One connection per database, reused across statements and warm invocations
+    connection = connections.get(database)
+    if connection is not None:
+        return connection
+
+    # sslmode=verify-ca: verify the certificate chain against the RDS bundle but not the hostname
+    ssl_context = None
+    if DB_SSLMODE != 'disable':
+        ssl_context = ssl.create_default_context(cafile=certs_filepath)
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_REQUIRED
+
+    connection = pg8000.native.Connection(
+        user=DBUSER,
+        password=dbpass,
+        host=DBHOST,
+        port=int(DBPORT),
+        database=database,
+        ssl_context=ssl_context,
+        timeout=30
+    )
+    connections[database] = connection
+    logger.info("Connected to database: " + database)
+    return connection
+
+def close_connection(database):
+    connection = connections.pop(database, None)
+    if connection is not None:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+def is_transactional(statement):
+    return NON_TRANSACTIONAL_STATEMENT_REGEX.match(statement) is None
+
+def run_statement(connection, database, statement, output):
+    start = time.monotonic()
+    rows = connection.run(statement)
+    elapsed = (time.monotonic() - start) * 1000
+
+    while connection.notices:
+        notice = connection.notices.popleft()
+        output.append("NOTICE: " + notice.get(b'M', b'').decode('utf-8', 'replace'))
+    row_count = connection.row_count
+    logger.info("[" + database + "] " + statement.splitlines()[0] + " -> " + str(row_count)
+                + " rows in " + "{:.1f}".format(elapsed) + " ms")
+    output.append(statement.splitlines()[0] + " ({:.1f} ms)".format(elapsed))
+    return rows
+
+def run_migration(commands, ledger, version, description, checksum, dbpass, certs_filepath, output):
+    # Run split psql commands, stopping at the first error like ON_ERROR_STOP=1.
+    # The statements of the ledger database run in one transaction with the ledger INSERT. A statement
+    # PostgreSQL refuses in a transaction, e.g. CREATE DATABASE, or a switch to another database commits
+    # the statements before it, so the statements of such migrations must be idempotent.
+    database = DBNAME
+    connection = ledger
+    in_transaction = False
+    statement = None
+    try:
+        for kind, value in commands:
+            if kind == CONNECT:
+                if in_transaction:
+                    connection.run("COMMIT")
+                    in_transaction = False
+                database = value
+                connection = ledger if database == DBNAME else get_connection(database, dbpass, certs_filepath)
+                logger.info("Switching to database: " + database)
+                output.append("You are now connected to database \"" + database + "\".")
+                continue
+
+            statements = [value]
+            if kind == GEXEC:
+                statement = value
+                if not in_transaction:
+                    connection.run("BEGIN")
+                    in_transaction = True
+                rows = run_statement(connection, database, statement, output)
+                statements = [cell for row in rows or [] for cell in row if cell is not None]
+
+            for statement in statements:
+                if in_transaction and not is_transactional(statement):
+                    connection.run("COMMIT")
+                    in_transaction = False
+                elif not in_transaction and is_transactional(statement):
+                    connection.run("BEGIN")
+                    in_transaction = True
+                run_statement(connection, database, statement, output)
+
+        statement = "INSERT INTO " + MIGRATIONS_LEDGER_TABLE + " V" + str(version)
+        if connection is not ledger and in_transaction:
+            connection.run("COMMIT")
+            in_transaction = False
+        connection = ledger
+        if not in_transaction:
+            ledger.run("BEGIN")
+            in_transaction = True
+        ledger.run("INSERT INTO " + MIGRATIONS_LEDGER_TABLE + " (version, description, checksum) "
+                   "VALUES (:version, :description, :checksum)",
+                   version=version, description=description, checksum=checksum)
+        ledger.run("COMMIT")
+
+    except (pg8000.native.InterfaceError, pg8000.native.DatabaseError, OSError, ssl.SSLError) as e:
+        logger.error('Exception: ' + str(e))
+        logger.error("ERROR: Unexpected error: Failed to execute SQL statement: " + str(statement))
+        if in_transaction:
+            try:
+                connection.run("ROLLBACK")
+            except (pg8000.native.InterfaceError, pg8000.native.DatabaseError, OSError, ssl.SSLError):
+                close_connection(DBNAME if connection is ledger else database)
+        raise ExecuteSQLScriptException("ERROR: Unexpected error: Failed to execute SQL script. Exception: " + str(e))
+
+def get_applied_migrations(connection):
+    # The common case, nothing pending, costs this single query, a missing ledger means nothing applied
+    try:
+        rows = connection.run("SELECT version, checksum FROM " + MIGRATIONS_LEDGER_TABLE)
+    except pg8000.native.DatabaseError as e:
+        if e.args and isinstance(e.args[0], dict) and e.args[0].get('C') == UNDEFINED_TABLE_SQLSTATE:
+            return {}
+        raise
+    return {row[0]: row[1] for row in rows}
+
+def create_migrations_ledger(connection):
+    # Only called under the advisory lock, so concurrent invocations never race on the CREATE
+    connection.run("CREATE TABLE IF NOT EXISTS " + MIGRATIONS_LEDGER_TABLE + " ("
+                   "version integer PRIMARY KEY, "
+                   "description text NOT NULL, "
+                   "checksum text NOT NULL, "
+                   "applied_at timestamptz NOT NULL DEFAULT now())")
+
+def get_pending_migrations(migrations, applied):
+    pending = []
+    for version, description, filepath in migrations:
+        with open(filepath, 'rb') as sql_file:
+            content = sql_file.read()
+        checksum = hashlib.sha256(content).hexdigest()
+        if version in applied:
+            if applied[version] != checksum:
+                raise MigrationChecksumException("ERROR: Migration V" + str(version) + " (" + description 
+                                                 + ") was modified after being applied.")
+            continue
+        pending.append((version, description, checksum, content.decode('utf-8')))
+    return pending
+
+def unlock_migrations(ledger):
+    # Unlock through the session holding the lock, a session that failed releases it when closed
+    try:
+        ledger.run("SELECT pg_advisory_unlock(:lock_id)", lock_id=MIGRATIONS_LOCK_ID)
+    except (pg8000.native.InterfaceError, pg8000.native.DatabaseError, OSError, ssl.SSLError) as e:
+        logger.warning("Failed to release the migrations lock, closing its connection: " + str(e))
+        if connections.get(DBNAME) is ledger:
+            close_connection(DBNAME)
+        else:
+            try:
+                ledger.close()
+            except Exception:
+                pass
+
+def apply_migrations(migrations, dbpass, certs_filepath, responseData):
+    output = []
     try:
-        psql_command = [
-            '/usr/bin/psql',
-            '-h', DBHOST,
-            '-p', DBPORT,
-            '-U', DBUSER,
-            '-d', DBNAME,
-            '-f', sql,
-            '-v', 
-            'ON_ERROR_STOP=1', 
-            '--set=sslmode=verify-ca',
-            '--set=sslrootcert=' + certs_filepath
-        ]
-
-        env = {
-            'PGPASSWORD': dbpass
-        }
-
-        logger.info("Executing psql command: " + str(psql_command))
-        logger.info("with env: " + str(env))
-
-        result = subprocess.run(psql_command, env=env, check=True, capture_output=True, text=True)
-        
-        logger.info("Executed SQL script successfully.")
-        logger.info("result in stdout: " + result.stdout)
-        responseData['Data'] = f"\n{result.stdout}"
-
-    except subprocess.CalledProcessError as e:
+        check_connections()
+        ledger = get_connection(DBNAME, dbpass, certs_filepath)
+        pending = get_pending_migrations(migrations, get_applied_migrations(ledger))
+        if not pending:
+            logger.info("No pending SQL migrations.")
+            responseData['Data'] = "\nNo pending SQL migrations."
+            return responseData
+
+        # Serialize concurrent instance-start events, then re-read the ledger under the lock
+        ledger.run("SELECT pg_advisory_lock(:lock_id)", lock_id=MIGRATIONS_LOCK_ID)
+        try:
+            create_migrations_ledger(ledger)
+            pending = get_pending_migrations(migrations, get_applied_migrations(ledger))
+            for version, description, checksum, content in pending:
+                logger.info("Applying SQL migration V" + str(version) + ": " + description)
+                output.append("Migration V" + str(version) + ": " + description)
+                run_migration(split_sql_script(content), ledger, version, description, checksum,
+                              dbpass, certs_filepath, output)
+        finally:
+            unlock_migrations(ledger)
+
+    except (pg8000.native.InterfaceError, pg8000.native.DatabaseError, OSError, ssl.SSLError) as e:
         logger.error('Exception: ' + str(e))
-        logger.error("ERROR: Unexpected error: Failed to execute psql command.")
-        responseData['Data'] += f"\nERROR: Unexpected error: Failed to execute psql command."
-        raise ExecuteSQLScriptException("ERROR: Unexpected error: Failed to execute psql command. Exception: " + str(e))
-    return responseData
\ No newline at end of file
+        close_connection(DBNAME)
+        responseData['Data'] = "\n".join(output) + "\nERROR: Unexpected error: Failed to apply SQL migrations."
+        raise ExecuteSQLScriptException("ERROR: Unexpected error: Failed to apply SQL migrations. Exception: " + str(e))
+    except ExecuteSQLScriptException:
+        responseData['Data'] = "\n".join(output) + "\nERROR: Unexpected error: Failed to apply SQL migrations."
+        raise
+
+    logger.info("Applied " + str(len(pending)) + " SQL migrations successfully.")
+    responseData['Data'] = "\n" + "\n".join(output)
+    return responseData
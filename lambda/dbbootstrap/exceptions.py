@@ -15,4 +15,8 @@ class GetSQLScriptException(BaseSpecificException):
 
 class ExecuteSQLScriptException(BaseSpecificException):
     def __init__(self, message):
-        super().__init__(message)
\ No newline at end of file
+        super().__init__(message)
+
+class MigrationChecksumException(BaseSpecificException):
+    def __init__(self, message):
+        super().__init__(message)
@@ -0,0 +1,88 @@
+STATEMENT = 'statement'
+CONNECT = 'connect'
+GEXEC = 'gexec'
+
+
+def split_sql_script(script):
+    """Split a psql script into statements, \\gexec queries and \\c database switches.
+
+    Semicolons inside quoted strings, quoted identifiers, dollar-quoted
+    bodies (DO $$ ... $$) and comments do not end a statement. A query ended
+    by \\gexec instead of a semicolon has each value of its result executed
+    as a statement, as psql does.
+    Returns a list of (kind, value) tuples where kind is STATEMENT, GEXEC or CONNECT.
+    """
+    commands = []
+    current = []
+    i = 0
+    length = len(script)
+
+    def flush():
+        statement = ''.join(current).strip()
+        if statement:
+            commands.append((STATEMENT, statement))
+        current.clear()
+
+    while i < length:
+        char = script[i]
+
+        # psql meta command, only \c / \connect and \gexec are supported
+        if char == '\\':
+            end = script.find('\n', i)
+            end = length if end == -1 else end
+            parts = script[i + 1:end].split()
+            query = ''.join(current).strip()
+            if parts and parts[0] == 'gexec' and query:
+                commands.append((GEXEC, query))
+                current.clear()
+            elif parts and parts[0] in ('c', 'connect') and len(parts) > 1 and not query:
+                commands.append((CONNECT, parts[1].strip('"')))
+            else:
+                raise ValueError("Unsupported psql meta command: " + script[i:end])
+            i = end
+            continue
+
+        if char == '-' and script.startswith('--', i):
+            end = script.find('\n', i)
+            i = length if end == -1 else end
+            continue
+
+        if char == '/' and script.startswith('/*', i):
+            end = script.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+            continue
+
+        if char in ("'", '"'):
+            end = i + 1
+            while end < length:
+                if script[end] == char:
+                    if end + 1 < length and script[end + 1] == char:
+                        end += 2
+                        continue
+                    break
+                end += 1
+            current.append(script[i:end + 1])
+            i = end + 1
+            continue
+
+        if char == '$':
+            end_tag = script.find('$', i + 1)
+            tag = script[i:end_tag + 1] if end_tag != -1 else ''
+            if tag and (len(tag) == 2 or tag[1:-1].replace('_', 'a').isalnum()) and not tag[1].isdigit():
+                end = script.find(tag, end_tag + 1)
+                end = length if end == -1 else end + len(tag)
+                current.append(script[i:end])
+                i = end
+                continue
+
+        if char == ';':
+            current.append(char)
+            flush()
+            i += 1
+            continue
+
+        current.append(char)
+        i += 1
+
+    flush()
+    return commands
@@ -0,0 +1,287 @@
+"""Benchmark the cold and warm starts of the dbbootstrap Lambda locally.
+
+The dbbootstrap image is built, unless its build context hash is already
+built locally, and run under the Runtime Interface Emulator bundled with
+the AWS Lambda base image. A local PostgreSQL server stands in for Aurora
+and a moto server for S3 and Secrets Manager, seeded with the SQL
+migrations and the master password. Synthetic RDS-EVENT-0088 SNS payloads
+are replayed, each one past the duplicate event window of the previous one
+so that every invocation runs the whole bootstrap path.
+
+The first invocation applies the migrations to the empty database and is
+reported apart. Each cold run then starts a fresh container and invokes it
+once, followed by warm invocations of the same container. The report holds
+the image size, the init duration and the p50/p95 handler latencies of the
+cold and warm invocations, checked against the budgets.
+"""
+from argparse import ArgumentParser
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+import itertools
+import json
+import logging
+import math
+import re
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from constants import LAMBDA_DIR, SQL_DIR
+from utils.aws_utils import list_local_files
+from utils.docker_utils import build_docker_image, compute_build_context_hash
+
+LOGGER = logging.getLogger()
+
+POSTGRES_IMAGE = "postgres:15-alpine"
+MOTO_IMAGE = "motoserver/moto:4.2.14"
+# port of the Runtime Interface Emulator in the Lambda base image and its invoke path
+RIE_PORT = 8080
+RIE_INVOKE_PATH = "/2015-03-31/functions/function/invocations"
+# matches DUPLICATE_EVENT_WINDOW of the Lambda, synthetic events are spaced further apart
+DUPLICATE_EVENT_WINDOW = 300
+REPORT_REGEX = re.compile(r"REPORT RequestId: \S+\s+(?:Init Duration: (?P<init>[\d.]+) ms\s+)?"
+                          r"Duration: (?P<duration>[\d.]+) ms")
+DB_NAME = "postgres"
+DB_USER = "postgres"
+DB_PASSWORD = "benchmark"
+REGION = "us-east-1"
+SQL_S3_KEY = "scripts/sql/migrations/"
+
+def parse_args() -> Dict[str, Any]:
+    parser = ArgumentParser(description="Benchmark the cold and warm starts of the dbbootstrap Lambda locally")
+    parser.add_argument("--cold-runs", type=int, default=5, help="Fresh containers, each invoked once cold")
+    parser.add_argument("--warm-runs", type=int, default=20, help="Warm invocations after each cold one")
+    parser.add_argument("--records", type=int, default=2,
+                        help="Instance started records per event, one per instance of the cluster")
+    parser.add_argument("--rebuild", action="store_true", help="Remove the local image first to time the build")
+    parser.add_argument("--budget-image-mb", type=float, default=700.0, help="Budget of the image size")
+    parser.add_argument("--budget-init-ms", type=float, default=1500.0, help="Budget of the p95 init duration")
+    parser.add_argument("--budget-cold-ms", type=float, default=3000.0,
+                        help="Budget of the p95 latency of cold invocations")
+    parser.add_argument("--budget-warm-ms", type=float, default=300.0,
+                        help="Budget of the p95 latency of warm invocations")
+    parser.add_argument("--output", help="Save the report as JSON")
+    return vars(parser.parse_args())
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest rank percentile, None without values."""
+    if(len(values) == 0): return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95),
+            "min": min(values, default=None), "max": max(values, default=None), "count": len(values)}
+
+
+def create_sns_event(event_time: datetime, records: int) -> Dict[str, Any]:
+    """Create the SNS event RDS publishes when the instances of a cluster start."""
+    event = {"Records": []}
+    for i in range(records):
+        message = {
+            "Event Source": "db-instance",
+            "Event Time": f"{event_time:%Y-%m-%d %H:%M:%S}.{event_time.microsecond // 1000:03d}",
+            "Identifier Link": f"https://console.aws.amazon.com/rds/home?region={REGION}#dbinstance:id=instance-{i}",
+            "Source ID": f"instance-{i}",
+            "Source ARN": f"arn:aws:rds:{REGION}:000000000000:db:instance-{i}",
+            "Event ID": "http://docs.amazonwebservices.com/AmazonRDS/latest/UserGuide/USER_Events.html#RDS-EVENT-0088",
+            "Event Message": "DB instance started"
+        }
+        event["Records"].append({
+            "EventSource": "aws:sns",
+            "EventVersion": "1.0",
+            "EventSubscriptionArn": f"arn:aws:sns:{REGION}:000000000000:rds-events:{uuid.uuid4()}",
+            "Sns": {
+                "Type": "Notification",
+                "MessageId": str(uuid.uuid4()),
+                "TopicArn": f"arn:aws:sns:{REGION}:000000000000:rds-events",
+                "Subject": "RDS Notification Message",
+                "Message": json.dumps(message),
+                "Timestamp": f"{event_time:%Y-%m-%dT%H:%M:%S}.{event_time.microsecond // 1000:03d}Z",
+                "MessageAttributes": {"EventID": {"Type": "String", "Value": "RDS-EVENT-0088"}}
+            }
+        })
+    return event
+
+
+def get_host_port(container, port: int) -> int:
+    container.reload()
+    return int(container.ports[f"{port}/tcp"][0]["HostPort"])
+
+
+def wait_for_http(url: str, timeout: float = 60.0) -> None:
+    """Wait until a server answers on url, any HTTP status counts."""
+    deadline = time.monotonic() + timeout
+    while(True):
+        try:
+            urllib.request.urlopen(url, timeout=1).close()
+            return
+        except urllib.error.HTTPError:
+            return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            if(time.monotonic() > deadline): raise TimeoutError(f"Nothing answered on {url} in {timeout:.0f}s")
+            time.sleep(0.05)
+
+
+def start_postgres(client, network: str):
+    container = client.containers.run(POSTGRES_IMAGE, detach=True, network=network, name=f"{network}-postgres",
+                                      environment={"POSTGRES_PASSWORD": DB_PASSWORD})
+    deadline = time.monotonic() + 60
+    while(container.exec_run(f"pg_isready -U {DB_USER} -h localhost").exit_code != 0):
+        if(time.monotonic() > deadline): raise TimeoutError("PostgreSQL did not start in 60s")
+        time.sleep(0.2)
+    # rds_iam exists on Aurora only, the migrations grant it
+    container.exec_run(["psql", "-U", DB_USER, "-c", "CREATE ROLE rds_iam"])
+    return container
+
+
+def start_moto(client, network: str):
+    """Start moto and seed it with the SQL migrations and the master password, return it and the secret ARN."""
+    import boto3
+    container = client.containers.run(MOTO_IMAGE, detach=True, network=network, name=f"{network}-moto",
+                                      ports={"5000/tcp": None})
+    endpoint_url = f"http://localhost:{get_host_port(container, 5000)}"
+    wait_for_http(endpoint_url)
+    session = boto3.session.Session(aws_access_key_id="benchmark", aws_secret_access_key="benchmark",
+                                    region_name=REGION)
+    s3_client = session.client("s3", endpoint_url=endpoint_url)
+    s3_client.create_bucket(Bucket="benchmark")
+    migrations_dir = f"{SQL_DIR}/migrations"
+    for file_path in list_local_files(migrations_dir):
+        s3_client.upload_file(file_path, "benchmark", SQL_S3_KEY + file_path[len(migrations_dir) + 1:])
+    secret = session.client("secretsmanager", endpoint_url=endpoint_url).create_secret(
+        Name="benchmark", SecretString=json.dumps({"username": DB_USER, "password": DB_PASSWORD}))
+    return container, secret["ARN"]
+
+
+def start_lambda(client, image_name: str, network: str, secret_arn: str):
+    """Start the Lambda container, return it and its invoke URL once the emulator answers."""
+    container = client.containers.run(image_name, detach=True, network=network, ports={f"{RIE_PORT}/tcp": None},
+                                      environment={
+                                          "DBHost": f"{network}-postgres",
+                                          "DBPort": "5432",
+                                          "DBName": DB_NAME,
+                                          "DBUser": DB_USER,
+                                          "DBSSLMode": "disable",
+                                          "Secret_ARN": secret_arn,
+                                          "Region_Name": REGION,
+                                          "SQLScriptS3Bucket": "benchmark",
+                                          "SQLScriptS3Key": SQL_S3_KEY,
+                                          # the botocore of the base image reads the endpoint of every service
+                                          "AWS_ENDPOINT_URL": f"http://{network}-moto:5000",
+                                          "AWS_ACCESS_KEY_ID": "benchmark",
+                                          "AWS_SECRET_ACCESS_KEY": "benchmark",
+                                          "AWS_REGION": REGION
+                                      })
+    base_url = f"http://localhost:{get_host_port(container, RIE_PORT)}"
+    wait_for_http(base_url)
+    return container, base_url + RIE_INVOKE_PATH
+
+
+def invoke(url: str, event: Dict[str, Any]) -> Dict[str, Any]:
+    """Invoke the emulator, return the latency in ms and the handler response."""
+    request = urllib.request.Request(url, data=json.dumps(event).encode(), method="POST")
+    start = time.monotonic()
+    with urllib.request.urlopen(request, timeout=300) as response:
+        body = json.loads(response.read() or "null")
+    latency = (time.monotonic() - start) * 1000
+    # the handler exits on errors, the emulator answers with the error instead of the handler response
+    if(isinstance(body, dict) == False or "errorMessage" in body):
+        raise RuntimeError(f"Invocation failed: {body}")
+    return {"latency": latency, "response": body}
+
+
+def get_reports(container) -> List[Dict[str, float]]:
+    """Get the init and handler durations of the REPORT lines of the emulator, in invocation order."""
+    logs = container.logs().decode("utf-8", "replace")
+    return [{"init": float(match.group("init")) if match.group("init") else None,
+             "duration": float(match.group("duration"))} for match in REPORT_REGEX.finditer(logs)]
+
+
+def check_budgets(report: Dict[str, Any], args: Dict[str, Any]) -> List[str]:
+    checks = [
+        ("image size", report["image"]["size_mb"], args["budget_image_mb"], "MB"),
+        ("p95 init duration", report["cold"]["init_ms"]["p95"], args["budget_init_ms"], "ms"),
+        ("p95 cold latency", report["cold"]["latency_ms"]["p95"], args["budget_cold_ms"], "ms"),
+        ("p95 warm latency", report["warm"]["latency_ms"]["p95"], args["budget_warm_ms"], "ms"),
+    ]
+    return [f"The {name} is {value:.1f}{unit}, over the budget of {budget:.0f}{unit}"
+            for name, value, budget, unit in checks if value is not None and value > budget]
+
+
+if __name__ == "__main__":
+    from docker import DockerClient
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)-8s %(message)s")
+    args = parse_args()
+    client = DockerClient.from_env()
+    dockerfile = f"{LAMBDA_DIR}/dbbootstrap"
+    image_name = f"{LAMBDA_DIR}/dbbootstrap:{compute_build_context_hash(dockerfile)}"
+
+    if(args["rebuild"]):
+        client.images.remove(image_name, force=True)
+    start = time.monotonic()
+    build_docker_image(client, dockerfile, image_name)
+    report = {"image": {"name": image_name, "build_duration": time.monotonic() - start,
+                        "size_mb": client.images.get(image_name).attrs["Size"] / 1024 / 1024}}
+
+    network = client.networks.create(f"dbbootstrap-benchmark-{uuid.uuid4().hex[:8]}")
+    containers = []
+    now = datetime.now(timezone.utc)
+    events = (create_sns_event(now + timedelta(seconds=(DUPLICATE_EVENT_WINDOW + 1) * i), args["records"])
+              for i in itertools.count(1))
+
+    try:
+        containers.append(start_postgres(client, network.name))
+        moto, secret_arn = start_moto(client, network.name)
+        containers.append(moto)
+
+        samples = {"cold_latency": [], "cold_duration": [], "init": [], "warm_latency": [], "warm_duration": []}
+        for run in range(args["cold_runs"] + 1):
+            container, url = start_lambda(client, image_name, network.name, secret_arn)
+            try:
+                first = invoke(url, next(events))
+                if(run == 0):
+                    # the database is empty, the first invocation applies every migration
+                    report["migrate"] = {"latency_ms": first["latency"], "response": first["response"]}
+                    LOGGER.info(f"migrate: {first['latency']:.1f}ms")
+                    continue
+                samples["cold_latency"].append(first["latency"])
+                warm = [invoke(url, next(events))["latency"] for _ in range(args["warm_runs"])]
+                samples["warm_latency"].extend(warm)
+                reports = get_reports(container)
+                if(len(reports) > 0):
+                    samples["cold_duration"].append(reports[0]["duration"])
+                    if(reports[0]["init"] is not None): samples["init"].append(reports[0]["init"])
+                    samples["warm_duration"].extend(entry["duration"] for entry in reports[1:])
+                LOGGER.info(f"cold run {run}: {first['latency']:.1f}ms cold, "
+                            f"{percentile(warm, 50):.1f}ms warm p50")
+            finally:
+                container.remove(force=True)
+    finally:
+        for container in containers:
+            container.remove(force=True)
+        network.remove()
+
+    report["cold"] = {"latency_ms": summarize(samples["cold_latency"]), "init_ms": summarize(samples["init"]),
+                      "duration_ms": summarize(samples["cold_duration"])}
+    report["warm"] = {"latency_ms": summarize(samples["warm_latency"]),
+                      "duration_ms": summarize(samples["warm_duration"])}
+    report["budgets"] = {key[len("budget_"):]: value for key, value in args.items() if key.startswith("budget_")}
+
+    LOGGER.info(f"image: {report['image']['size_mb']:.1f}MB")
+    for kind in ("cold", "warm"):
+        for metric, entry in report[kind].items():
+            if(entry["count"] == 0): continue
+            LOGGER.info(f"{kind} {metric}: p50 {entry['p50']:.1f}, p95 {entry['p95']:.1f} "
+                        f"(min {entry['min']:.1f}, max {entry['max']:.1f}, {entry['count']} samples)")
+    if(args["output"] is not None):
+        with open(args["output"], "w") as f:
+            json.dump(report, f, indent=2)
+
+    errors = check_budgets(report, args)
+    for error in errors:
+        LOGGER.error(error)
+    if(len(errors) > 0): exit(1)
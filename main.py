@@ -1,68 +1,461 @@
-from utils.config_utils import (
-    configure, 
-    auto_configure_cloudformation, 
-    get_logger
-)
-from utils.aws_utils import (
-    get_caller_identity,
-    create_s3_bucket,
-    push_to_ecr,
-    upload_file_to_s3,
-    upload_dir_to_s3,
-    create_stack,
-    upload_to_secret_manager,
-)
+# Modules wrapping boto3, docker or yaml are imported by the steps using them, so that
+# --help, --validate and the config checks start without loading the SDKs.
+from utils.config_utils import configure, auto_configure_cloudformation, get_keycloak_admin_secret_id
 from utils.ssh_utils import generate_key
+from utils.state_utils import DeploymentState, STATE_DIR, PLAN_STATE_DIR
+from utils.bundle_utils import build_bundles
+from utils.pipeline_utils import Task, run_pipeline, reverse_dependencies
+from utils.trace_utils import Tracer, start_span, submit
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
 import uuid
-import boto3
-from docker import DockerClient
 import os
 from constants import *
-from typing import Dict, Any
+from typing import Dict, Any, List, TYPE_CHECKING
 
-def main(config: Dict[Any, Any]) -> None:
-    """Main function."""
+if TYPE_CHECKING:
+    from utils.aws_call_utils import AWSCallLayer, CallStats
+    from utils.plan_utils import PlanBackend
+
+LOGGER = logging.getLogger()
+
+# resources created by main and the resources each of them uses, --destroy deletes them in reverse order
+RESOURCE_DEPENDENCIES = {
+    "bucket": [],
+    "keycloak_cache_bucket": [],
+    "repository": [],
+    "secret": [],
+    "stack": ["bucket", "keycloak_cache_bucket", "repository", "secret"]
+}
+
+def get_deployment_name(config: Dict[str, Any]) -> str:
+    project = config["project"]
+    return f"{project['name']}-{project['environment']['name']}-{project['environment']['region']}"
+
+
+def get_bucket_name(config: Dict[str, Any], account: str) -> str:
+    project = config["project"]
+    return f"k8s-{project['name']}-{project['environment']['name']}-{project['environment']['region']}-{account}"
+
+
+def get_keycloak_cache_bucket_name(config: Dict[str, Any], account: str) -> str:
+    project = config["project"]
+    return (f"keycloak-cache-{project['name']}-{project['environment']['name']}-"
+            f"{project['environment']['region']}-{account}")
+
+
+def get_ssh_key_path(config: Dict[str, Any]) -> str:
+    """Get the SSH key path of an environment, shared by the regions it is deployed to."""
+    return os.path.expanduser(f"~/.ssh/{config['project']['name']}-{config['project']['environment']['name']}")
+
+
+def generate_keys(configs: List[Dict[str, Any]]) -> List[str]:
+    """Generate the SSH key of every environment once, before the deployments sharing it start."""
+    return [generate_key(key_path) for key_path in sorted(set(get_ssh_key_path(config) for config in configs))]
+
+
+def get_bundle_keys(bundles: Dict[str, str]) -> Dict[str, str]:
+    """Get the S3 key of the bundle of each role, bundle names are content hashed."""
+    return {role: f"{BUNDLES_S3_PREFIX}/{os.path.basename(path)}" for role, path in bundles.items()}
+
+
+def get_repository_name(config: Dict[str, Any]) -> str:
+    return f"{config['project']['name']}/{config['project']['environment']['name']}/lambda/dbbootstrap"
+
+
+def get_docker_client(stats: "CallStats", backend: "PlanBackend" = None):
+    """Create the Docker client of a run, a fake one when planning, its calls are recorded in stats."""
+    if(backend is not None): return backend.docker_client(stats)
+    from docker import DockerClient
+    from utils.plan_utils import RecordedDockerClient
+    return RecordedDockerClient(DockerClient.from_env(), stats)
+
+
+def prepare(configs: List[Dict[str, Any]], stats: "CallStats", backend: "PlanBackend" = None,
+            timings: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Build the artifacts shared by every deployment once.
+
+    The node script bundles, the release of the templates and SQL scripts,
+    the Lambda image and the mirrored artifacts do not depend on the environment, each deployment only uploads or pushes
+    them to its own region. The image is built on first use, so it is not
+    built at all when every repository already holds its tag. The SSH keys
+    are generated here too, as the regions of an environment share one key.
+    """
+    from utils.artifact_utils import load_artifacts, fetch_artifacts
+    from utils.docker_utils import build_docker_image, compute_build_context_hash
+    from utils.release_utils import compute_release
+
+    docker_client = get_docker_client(stats, backend)
+    dockerfile = f"{LAMBDA_DIR}/dbbootstrap"
+    mirrored = [config for config in configs if config["deployment"]["artifacts"]["mirror"]]
+    image_lock = threading.Lock()
+
+    def get_image() -> str:
+        image_name = f"{LAMBDA_DIR}/dbbootstrap:{compute_build_context_hash(dockerfile)}"
+        with image_lock:
+            build_docker_image(docker_client, dockerfile, image_name)
+        return image_name
+
+    def fetch(results: Dict[str, Any]) -> List[Any]:
+        if(len(mirrored) == 0): return []
+        artifacts_config = mirrored[0]["deployment"]["artifacts"]
+        artifacts = load_artifacts(artifacts_config["file"])
+        if(backend is not None): return backend.fetch_artifacts(stats, artifacts, ARTIFACTS_CACHE_DIR)
+        return fetch_artifacts(artifacts, ARTIFACTS_CACHE_DIR, artifacts_config["max_workers"],
+                               artifacts_config["timeout"])
+
+    def release(results: Dict[str, Any]) -> Dict[str, Any]:
+        # a given release is already published, the local files are not deployed
+        if(configs[0]["args"]["release"] is not None): return None
+        return compute_release(bundles=get_bundle_keys(results["bundles"]),
+                               image_tag=compute_build_context_hash(dockerfile))
+
+    tasks = [
+        Task("keygen", lambda results: generate_keys(configs)),
+        Task("bundles", lambda results: build_bundles()),
+        Task("artifacts", fetch),
+        Task("release", release, ["bundles"]),
+    ]
+    shared = run_pipeline(tasks, configs[0]["deployment"]["max_workers"], "prepare", timings)
+    shared["image"] = get_image
+    return shared
+
+
+def main(config: Dict[Any, Any], aws: "AWSCallLayer", shared: Dict[str, Any], backend: "PlanBackend" = None,
+         timings: Dict[str, Any] = None) -> None:
+    """Main function.
+
+    The deployment steps are declared as a task graph and run concurrently
+    as soon as their dependencies have completed. With a plan backend the
+    AWS and Docker calls are recorded against a local stand-in instead.
+    """
+    from utils.template_utils import check_root_parameters
+    from utils.artifact_utils import mirror_artifacts
+    from utils.cloudformation_utils import wait_for_stack, get_change_set_type, update_stack
+    from utils.release_utils import (
+        get_release_prefix,
+        load_release,
+        fetch_release_template,
+        publish_release,
+        prune_releases
+    )
+    from utils.aws_utils import (
+        get_caller_identity,
+        create_s3_bucket,
+        push_to_ecr,
+        create_ecr_repository,
+        upload_files_to_s3,
+        list_s3_objects,
+        get_transfer_config,
+        create_stack,
+        upload_to_secret_manager,
+    )
 
     project_name = config["project"]["name"]
     environment_name = config["project"]["environment"]["name"]
     region = config["project"]["environment"]["region"]
 
-    ssh_key_name =  project_name + "-" + environment_name
-    ssh_key_path = os.path.expanduser("~/.ssh/" + ssh_key_name)
-    generate_key(ssh_key_name)
-
-    sts_client = boto3.client("sts")
-    caller_identity = get_caller_identity(sts_client)
-    account = caller_identity["Account"]
-    
-    LOGGER.info(f"Caller Identity -> AWS Account: {account}")
-    LOGGER.info(f"Caller Identity -> AWS Region: {region}")
-
-    s3_client = boto3.client("s3", region)
-    bucket_name = f"k8s-{project_name}-{environment_name}-{region}-{account}"
-
-    create_s3_bucket(s3_client, bucket_name, region)
-    upload_file_to_s3(s3_client, bucket_name, ssh_key_path + ".pub", "ssh/client-key.pub")
-    upload_dir_to_s3(s3_client, bucket_name, SCRIPTS_DIR)
-    upload_dir_to_s3(s3_client, bucket_name, TEMPLATES_DIR)
-    
-    docker_client = DockerClient.from_env()
-    ecr_client = boto3.client('ecr', region_name='us-east-1')
-    repository_name = f"{project_name}/{environment_name}/lambda/dbbootstrap"
-    image_uri = push_to_ecr(docker_client, ecr_client, f"{LAMBDA_DIR}/dbbootstrap", repository_name)
-
-    secrets_manager_client = boto3.client("secretsmanager", region)
-    upload_to_secret_manager(secrets_manager_client, KEYCLOAK_ADMIN_PWD_SECRET_ID, str(uuid.uuid4()))
-
-    cf_client = boto3.client("cloudformation", region)
-    kc_cache_bucket_name = f"keycloak-cache-{project_name}-{environment_name}-{region}-{account}"
-    auto_configure_cloudformation(config, bucket_name, kc_cache_bucket_name, image_uri)
-    create_stack(cf_client, config["cloudformation"])
+    ssh_key_path = get_ssh_key_path(config)
 
-if __name__ == "__main__":
-    config = configure()
-    LOGGER = get_logger()
-    main(config)
-    
+    s3_config = config["deployment"]["s3"]
+    sts_client = aws.client("sts", region)
+    s3_client = aws.client("s3", region, endpoint_url=s3_config["endpoint_url"])
+    ecr_client = aws.client("ecr", region)
+    secrets_manager_client = aws.client("secretsmanager", region)
+    cf_client = aws.client("cloudformation", region)
+    with aws.session_lock:
+        credentials = aws.session.get_credentials()
+    transfer_config = get_transfer_config(s3_config)
+    docker_client = get_docker_client(aws.stats, backend)
+    repository_name = get_repository_name(config)
+    release_id = config["args"]["release"]
+    secret_id = get_keycloak_admin_secret_id(config)
+
+    state_config = config["deployment"]["state"]
+    state = DeploymentState(project_name, environment_name, region, config["args"]["refresh"],
+                            PLAN_STATE_DIR if backend is not None else STATE_DIR)
+    credentials_fingerprint = credentials.access_key if credentials is not None else None
+
+    def get_account(results: Dict[str, Any]) -> str:
+        account = state.cached("account", lambda: get_caller_identity(sts_client)["Account"],
+                               credentials_fingerprint, state_config["identity_ttl"])
+        state.bind_account(account)
+        LOGGER.info(f"Caller Identity -> AWS Account: {account}")
+        LOGGER.info(f"Caller Identity -> AWS Region: {region}")
+        return account
+
+    def create_bucket(results: Dict[str, Any]) -> str:
+        bucket_name = get_bucket_name(config, results["sts"])
+        if(state.get("bucket", bucket_name) is None):
+            create_s3_bucket(s3_client, bucket_name, region)
+            state.put("bucket", bucket_name, bucket_name, state_config["ttl"])
+        return bucket_name
+
+    def build_and_push_image(results: Dict[str, Any]) -> str:
+        # a given release is deployed with the image it was published with
+        if(release_id is not None): return None
+        repository_uri = state.cached("ecr_repository",
+                                      lambda: create_ecr_repository(ecr_client, repository_name),
+                                      f"{results['sts']}:{repository_name}", state_config["ttl"])
+        return push_to_ecr(docker_client, ecr_client, f"{LAMBDA_DIR}/dbbootstrap", repository_name,
+                           repository_uri, shared["image"])
 
+    def create_secret(results: Dict[str, Any]) -> None:
+        fingerprint = f"{results['sts']}:{secret_id}"
+        if(state.get("secret", fingerprint) is None):
+            upload_to_secret_manager(secrets_manager_client, secret_id, str(uuid.uuid4()))
+            state.put("secret", secret_id, fingerprint, state_config["ttl"])
 
+    def upload_ssh_key(results: Dict[str, Any]) -> None:
+        upload_files_to_s3(s3_client, results["bucket"], [(ssh_key_path + ".pub", "ssh/client-key.pub")],
+                           s3_config["max_workers"], transfer_config)
+
+    def upload_bundles(results: Dict[str, Any]) -> Dict[str, str]:
+        if(release_id is not None): return None
+        # Bundle keys are content hashed, an existing key already holds the same bundle
+        keys = get_bundle_keys(shared["bundles"])
+        remote_objects = list_s3_objects(s3_client, results["bucket"], BUNDLES_S3_PREFIX + "/")
+        files = [(shared["bundles"][role], key) for role, key in keys.items() if key not in remote_objects]
+        upload_files_to_s3(s3_client, results["bucket"], files, s3_config["max_workers"], transfer_config)
+        return keys
+
+    def publish(results: Dict[str, Any]) -> Dict[str, Any]:
+        # a release deploys the bundle keys and image it was published with
+        if(release_id is None):
+            publish_release(s3_client, results["bucket"], shared["release"], results["docker"],
+                            s3_config["max_workers"], transfer_config)
+            return {"id": shared["release"]["id"], "bundles": results["upload_bundles"], "image": results["docker"]}
+        manifest = load_release(s3_client, results["bucket"], release_id)
+        if(manifest is None):
+            raise ValueError(f"Release {release_id} is not published in S3 Bucket {results['bucket']}.")
+        if(manifest.get("bundles") is None or manifest.get("image_uri") is None):
+            raise ValueError(f"Release {release_id} does not record its bundle keys and image, "
+                             f"it was published by an older version and cannot be deployed again.")
+        LOGGER.info(f"Deploying published release {release_id}")
+        return {"id": release_id, "bundles": manifest["bundles"], "image": manifest["image_uri"]}
+
+    def mirror(results: Dict[str, Any]) -> None:
+        artifacts_config = config["deployment"]["artifacts"]
+        if(artifacts_config["mirror"] == False): return
+        mirror_artifacts(s3_client, results["bucket"], shared["artifacts"], s3_config["max_workers"],
+                         transfer_config)
+
+    def launch_stack(results: Dict[str, Any]) -> None:
+        kc_cache_bucket_name = get_keycloak_cache_bucket_name(config, results["sts"])
+        release = results["release"]
+        cloudformation_config = auto_configure_cloudformation(config, results["bucket"], kc_cache_bucket_name,
+                                                              release["image"], release["bundles"],
+                                                              get_release_prefix(release["id"]))
+        if(config["deployment"]["validate_templates"]):
+            # the local templates are those of the release only when it was published by this run
+            root_template = f"{TEMPLATES_DIR}/main.yaml" if release_id is None else \
+                fetch_release_template(s3_client, results["bucket"], release_id)
+            if(len(check_root_parameters(cloudformation_config["Parameters"], root_template)) > 0):
+                raise ValueError("Invalid stack parameters for the root template.")
+        stack_config = config["deployment"]["stack"]
+        change_set_type = get_change_set_type(cf_client, cloudformation_config["StackName"])
+        if(change_set_type is not None):
+            stack_id = update_stack(cf_client, cloudformation_config, stack_config["execute_change_set"],
+                                    change_set_type)
+        else:
+            stack_id = create_stack(cf_client, cloudformation_config)
+        if(stack_id is not None and stack_config["wait"]):
+            with start_span("cloudformation.wait", stack=stack_id):
+                wait_for_stack(cf_client, stack_id, stack_config["min_poll_delay"],
+                               stack_config["max_poll_delay"], stack_config["timeout"])
+        if(stack_id is not None):
+            prune_releases(s3_client, results["bucket"], [release["id"]],
+                           config["deployment"]["releases"]["retain"])
+
+    tasks = [
+        Task("sts", get_account),
+        Task("bucket", create_bucket, ["sts"]),
+        Task("upload_ssh_key", upload_ssh_key, ["bucket"]),
+        Task("release", publish, ["bucket", "upload_bundles", "docker"]),
+        Task("upload_bundles", upload_bundles, ["bucket"]),
+        Task("mirror_artifacts", mirror, ["bucket"]),
+        Task("docker", build_and_push_image, ["sts"]),
+        Task("secret", create_secret, ["sts"]),
+        Task("stack", launch_stack, ["sts", "bucket", "upload_ssh_key", "release", "upload_bundles",
+                                    "mirror_artifacts", "docker", "secret"]),
+    ]
+    run_pipeline(tasks, config["deployment"]["max_workers"], get_deployment_name(config), timings)
+
+
+def destroy(config: Dict[Any, Any], aws: "AWSCallLayer", backend: "PlanBackend" = None,
+            timings: Dict[str, Any] = None) -> None:
+    """Delete the resources created by main.
+
+    The stack goes first, as it uses every other resource, then the buckets,
+    emptied of all their object versions, the ECR repository and the secret
+    are deleted concurrently. Missing resources are skipped, so a failed or
+    partial destroy can be run again.
+    """
+    from utils.cloudformation_utils import wait_for_stack, delete_stack
+    from utils.aws_utils import get_caller_identity, delete_s3_bucket, delete_ecr_repository, delete_secret
+
+    region = config["project"]["environment"]["region"]
+    s3_config = config["deployment"]["s3"]
+    stack_config = config["deployment"]["stack"]
+    sts_client = aws.client("sts", region)
+    s3_client = aws.client("s3", region, endpoint_url=s3_config["endpoint_url"])
+    ecr_client = aws.client("ecr", region)
+    secrets_manager_client = aws.client("secretsmanager", region)
+    cf_client = aws.client("cloudformation", region)
+
+    # the recorded resources are about to go, the next deployment has to create them again
+    DeploymentState(config["project"]["name"], config["project"]["environment"]["name"], region, True,
+                    PLAN_STATE_DIR if backend is not None else STATE_DIR).clear()
+
+    def remove_stack(results: Dict[str, Any]) -> None:
+        stack_id = delete_stack(cf_client, config["cloudformation"]["StackName"])
+        if(stack_id is not None):
+            with start_span("cloudformation.wait", stack=stack_id):
+                wait_for_stack(cf_client, stack_id, stack_config["min_poll_delay"],
+                               stack_config["max_poll_delay"], stack_config["timeout"])
+
+    deleters = {
+        "stack": remove_stack,
+        "bucket": lambda results: delete_s3_bucket(s3_client, get_bucket_name(config, results["sts"]),
+                                                   s3_config["max_workers"]),
+        "keycloak_cache_bucket": lambda results: delete_s3_bucket(
+            s3_client, get_keycloak_cache_bucket_name(config, results["sts"]), s3_config["max_workers"]),
+        "repository": lambda results: delete_ecr_repository(ecr_client, get_repository_name(config)),
+        "secret": lambda results: delete_secret(secrets_manager_client, get_keycloak_admin_secret_id(config),
+                                                config["deployment"]["destroy"]["force_delete_secret"]),
+    }
+    dependents = reverse_dependencies(RESOURCE_DEPENDENCIES)
+    tasks = [Task("sts", lambda results: get_caller_identity(sts_client)["Account"])]
+    tasks += [Task(name, deleters[name], ["sts"] + dependents[name]) for name in RESOURCE_DEPENDENCIES]
+    run_pipeline(tasks, config["deployment"]["max_workers"], get_deployment_name(config), timings)
+
+
+def collect_timelines(config: Dict[Any, Any], aws: "AWSCallLayer") -> Dict[str, Any]:
+    """Report the boot phases recorded by the nodes of an environment, see scripts/common/timeline.sh.
+
+    The report is logged and saved under TIMELINES_DIR, to compare scale-outs.
+    """
+    import json
+    from utils.aws_utils import get_caller_identity
+    from utils.timeline_utils import load_timelines, build_timeline_report, log_timeline_report
+
+    region = config["project"]["environment"]["region"]
+    s3_config = config["deployment"]["s3"]
+    account = get_caller_identity(aws.client("sts", region))["Account"]
+    s3_client = aws.client("s3", region, endpoint_url=s3_config["endpoint_url"])
+    records = load_timelines(s3_client, get_bucket_name(config, account), s3_config["max_workers"])
+    report = build_timeline_report(records)
+    log_timeline_report(get_deployment_name(config), report)
+
+    os.makedirs(TIMELINES_DIR, exist_ok=True)
+    with open(os.path.join(TIMELINES_DIR, f"{get_deployment_name(config)}.json"), "w") as f:
+        json.dump({"report": report, "records": records}, f, indent=2)
+    return report
+
+
+def run_reported(report: Dict[str, Dict[str, Any]], name: str, fn) -> bool:
+    """Run fn(timings) in its own span and record its status, duration, error and step durations in the report."""
+    timings = {}
+    start = time.monotonic()
+    error = None
+    try:
+        with start_span(name):
+            fn(timings)
+    except (Exception, SystemExit) as e:
+        LOGGER.error(f"{name} failed: {e!r}")
+        error = repr(e)
+    report[name] = {
+        "status": "failed" if error else "succeeded",
+        "duration": time.monotonic() - start,
+        "error": error,
+        "steps": {step: end - begin for step, (begin, end) in timings.items()}
+    }
+    return error is None
+
+
+def deploy(configs: List[Dict[str, Any]], aws: "AWSCallLayer", backend: "PlanBackend" = None) -> Dict[str, Dict[str, Any]]:
+    """Deploy every config, running up to deployment.max_environments deployments concurrently.
+
+    The shared artifacts are prepared once before the deployments start. A
+    failed deployment does not stop the others, every outcome is collected
+    in the report. With --destroy each environment is destroyed instead.
+
+    :return: Report keyed by deployment name, and prepare, with status, duration, error and step durations.
+    :rtype: Dict[str, Dict[str, Any]]
+    """
+    names = [get_deployment_name(config) for config in configs]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if(len(duplicates) > 0):
+        raise ValueError(f"Several configs deploy the same project, environment and region: {duplicates}")
+    # stacks are named by the config alone, two environments of a region would update the same stack
+    stacks = [f"{config['project']['environment']['region']}/{config['cloudformation']['StackName']}"
+              for config in configs]
+    shared_stacks = sorted(set(stack for stack in stacks if stacks.count(stack) > 1))
+    if(len(shared_stacks) > 0):
+        raise ValueError(f"Several configs deploy the same stack to one region, set a distinct "
+                         f"cloudformation.StackName per environment: {shared_stacks}")
+
+    report = {}
+    shared = {}
+    destroying = configs[0]["args"]["destroy"]
+
+    def deploy_one(config: Dict[str, Any]) -> None:
+        name = get_deployment_name(config)
+        threading.current_thread().name = name
+        if(destroying):
+            run_reported(report, name, lambda timings: destroy(config, aws, backend, timings))
+        else:
+            run_reported(report, name, lambda timings: main(config, aws, shared, backend, timings))
+
+    try:
+        prepared = destroying or run_reported(
+            report, "prepare", lambda timings: shared.update(prepare(configs, aws.stats, backend, timings)))
+        if(prepared):
+            max_environments = max(1, min(configs[0]["deployment"]["max_environments"], len(configs)))
+            with ThreadPoolExecutor(max_workers=max_environments, thread_name_prefix="deploy") as executor:
+                for future in [submit(executor, deploy_one, config) for config in configs]:
+                    future.result()
+    finally:
+        aws.stats.log_summary()
+    log_deployment_report(report)
+    return report
+
+
+def log_deployment_report(report: Dict[str, Dict[str, Any]]) -> None:
+    LOGGER.info("Deployments:")
+    for name, entry in sorted(report.items()):
+        LOGGER.info(f"  {name:<40} {entry['status']:<10} {entry['duration']:8.2f}s"
+                    + (f"  {entry['error']}" if entry["error"] else ""))
+
+
+if __name__ == "__main__":
+    configs = configure()
+    args = configs[0]["args"]
+    validate_templates = any(config["deployment"]["validate_templates"] for config in configs)
+    if(args["validate"] or (validate_templates and args["destroy"] == False and args["timelines"] == False)):
+        from utils.template_utils import analyze_templates
+        if(len(analyze_templates()) > 0): exit(1)
+    if(args["timelines"]):
+        from utils.aws_call_utils import AWSCallLayer
+        aws = AWSCallLayer(configs[0]["deployment"]["aws"])
+        for config in configs:
+            collect_timelines(config, aws)
+    elif(args["validate"] == False):
+        from utils.aws_call_utils import AWSCallLayer
+        from utils.plan_utils import create_plan_backend, log_plan
+        aws_config = configs[0]["deployment"]["aws"]
+        backend = create_plan_backend(args, aws_config)
+        aws = AWSCallLayer(aws_config, backend=backend)
+        tracer = Tracer()
+        with tracer.span("destroy" if args["destroy"] else "deploy", deployments=len(configs),
+                         plan=backend is not None):
+            report = deploy(configs, aws, backend)
+        if(args["trace"] is not None):
+            tracer.export(args["trace"], args["trace_format"])
+        if(backend is not None):
+            log_plan(aws.stats)
+        if(args["record"] is not None or backend is not None):
+            aws.stats.save(args["record"] or PLAN_CALLS_FILE)
+        if(any(entry["status"] != "succeeded" for entry in report.values())): exit(1)
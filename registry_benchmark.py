@@ -0,0 +1,75 @@
+"""Benchmark the Docker build and push steps against a local registry.
+
+Start a registry first: docker run -d -p 5000:5000 registry:2
+The dbbootstrap image is built, unless its build context hash is already
+built locally, then pushed twice to a new repository of the registry:
+once with every layer missing and once with every layer present. The
+report holds the duration, layer counts and throughput of each step and
+the peak memory of the process, which stays flat however long the build
+and push outputs are.
+"""
+from argparse import ArgumentParser
+from typing import Any, Dict
+import json
+import logging
+import resource
+import time
+import uuid
+
+from constants import LAMBDA_DIR
+from utils.docker_utils import build_docker_image, compute_build_context_hash, push_docker_image
+
+LOGGER = logging.getLogger()
+
+def parse_args() -> Dict[str, Any]:
+    parser = ArgumentParser(description="Benchmark the Docker build and push steps against a local registry")
+    parser.add_argument("--registry", default="localhost:5000", help="Registry to push to")
+    parser.add_argument("--rebuild", action="store_true", help="Remove the local image first to time the build")
+    parser.add_argument("--output", help="Save the report as JSON")
+    return vars(parser.parse_args())
+
+
+def get_peak_memory_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize_push(state: Dict[str, Any]) -> Dict[str, Any]:
+    pushed = sum(1 for status in state["layers"].values() if status == "Pushed")
+    return {
+        "duration": state["duration"],
+        "layers_pushed": pushed,
+        "layers_existing": len(state["layers"]) - pushed,
+        "megabytes": state["bytes"] / 1024 / 1024,
+        "throughput_mb_s": state["bytes"] / 1024 / 1024 / max(state["duration"], 1e-6),
+        "peak_memory_mb": get_peak_memory_mb()
+    }
+
+
+if __name__ == "__main__":
+    from docker import DockerClient
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)-8s %(message)s")
+    args = parse_args()
+    client = DockerClient.from_env()
+    dockerfile = f"{LAMBDA_DIR}/dbbootstrap"
+    tag = compute_build_context_hash(dockerfile)
+    image_name = f"{LAMBDA_DIR}/dbbootstrap:{tag}"
+    repository = f"{args['registry']}/dbbootstrap-benchmark-{uuid.uuid4().hex[:8]}"
+
+    if(args["rebuild"]):
+        client.images.remove(image_name, force=True)
+    start = time.monotonic()
+    build_docker_image(client, dockerfile, image_name)
+    report = {"build": {"duration": time.monotonic() - start, "peak_memory_mb": get_peak_memory_mb()}}
+
+    client.images.get(image_name).tag(repository, tag=tag)
+    report["push_cold"] = summarize_push(push_docker_image(client, repository, tag))
+    report["push_warm"] = summarize_push(push_docker_image(client, repository, tag))
+    client.images.remove(f"{repository}:{tag}")
+
+    for step, entry in report.items():
+        LOGGER.info(f"{step}: " + ", ".join(f"{key} {value:.2f}" if isinstance(value, float) else f"{key} {value}"
+                                            for key, value in entry.items()))
+    if(args["output"] is not None):
+        with open(args["output"], "w") as f:
+            json.dump(report, f, indent=2)
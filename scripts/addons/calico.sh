@@ -3,11 +3,25 @@
 set -ex
 
 K8S_POD_NETWORK_CIDR=$1
+ARTIFACTS_DIR="/opt/artifacts"
 
 required_args=(
   K8S_POD_NETWORK_CIDR
 )
 
+function fetch_artifact() {
+  local url=$1
+  local output=$2
+  local mirrored="${ARTIFACTS_DIR}/$(basename "${url}")"
+
+  # artifacts mirrored into the project bucket are synced to ARTIFACTS_DIR by the node user data
+  if [ -f "${mirrored}" ]; then
+    sudo cp "${mirrored}" "${output}"
+  else
+    sudo wget -qO "${output}" "${url}"
+  fi
+}
+
 for arg in "${required_args[@]}"; do
   if [[ -z "${!arg}" ]]; then
     echo "ERROR: $arg is not set"
@@ -23,8 +37,8 @@ EOF"
 
 BASE_DIR=/home/ubuntu/calico
 mkdir -p ${BASE_DIR}
-wget https://raw.githubusercontent.com/projectcalico/calico/v3.26.1/manifests/tigera-operator.yaml \
-  -O ${BASE_DIR}/tigera-operator.yaml
+fetch_artifact https://raw.githubusercontent.com/projectcalico/calico/v3.26.1/manifests/tigera-operator.yaml \
+  ${BASE_DIR}/tigera-operator.yaml
 kubectl create -f ${BASE_DIR}/tigera-operator.yaml
 
 cat <<EOF | tee ${BASE_DIR}/custom-resources.yaml
@@ -51,6 +65,6 @@ EOF
 
 kubectl create -f ${BASE_DIR}/custom-resources.yaml
 
-curl -L https://github.com/projectcalico/calico/releases/download/v3.26.1/calicoctl-linux-amd64 -o calicoctl
-chmod +x ./calicoctl
-sudo mv calicoctl /usr/local/bin/
+fetch_artifact https://github.com/projectcalico/calico/releases/download/v3.26.1/calicoctl-linux-amd64 \
+  /usr/local/bin/calicoctl
+sudo chmod +x /usr/local/bin/calicoctl
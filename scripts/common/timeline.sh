@@ -0,0 +1,115 @@
+#!/bin/bash
+# Boot phase timeline, sourced by the node scripts of every bundle.
+#
+# Each phase appends one JSON record to TIMELINE_FILE, which is uploaded to
+# s3://${BOOTSTRAP_TIMELINE_BUCKET}/timelines/<role>/<instance id>.jsonl after
+# every phase and when the script exits, so nodes stuck in a wait show up too.
+# Without BOOTSTRAP_TIMELINE_BUCKET the records are only kept on the node.
+# Collect them with: python main.py --timelines
+
+TIMELINE_FILE="/tmp/bootstrap-timeline.jsonl"
+TIMELINE_PREFIX="timelines"
+TIMELINE_PHASE=""
+TIMELINE_UPLOAD_PID=""
+
+function timeline_now() {
+  date +%s%3N
+}
+
+function timeline_record() {
+  local phase=$1
+  local kind=$2
+  local start=$3
+  local end=$4
+  local status=$5
+
+  printf '{"role": "%s", "instance": "%s", "script": "%s", "phase": "%s", "kind": "%s", "start": %s, "end": %s, "status": "%s"}\n' \
+    "${TIMELINE_ROLE}" "${TIMELINE_INSTANCE}" "${TIMELINE_SCRIPT}" "${phase}" "${kind}" "${start}" "${end}" "${status}" \
+    >> "${TIMELINE_FILE}"
+}
+
+function timeline_upload() {
+  if [ -z "${BOOTSTRAP_TIMELINE_BUCKET}" ]; then
+    return 0
+  fi
+  aws s3 cp --quiet "$1" \
+    "s3://${BOOTSTRAP_TIMELINE_BUCKET}/${TIMELINE_PREFIX}/${TIMELINE_ROLE}/${TIMELINE_INSTANCE}.jsonl" || true
+}
+
+function timeline_upload_async() {
+  # one upload at a time so that an older snapshot never overwrites a newer one
+  if [ -n "${TIMELINE_UPLOAD_PID}" ]; then
+    wait "${TIMELINE_UPLOAD_PID}" || true
+  fi
+  cp "${TIMELINE_FILE}" "${TIMELINE_FILE}.upload"
+  timeline_upload "${TIMELINE_FILE}.upload" &
+  TIMELINE_UPLOAD_PID=$!
+}
+
+function timeline_exit() {
+  local status=$?
+  # set -e ended the script in the middle of a phase
+  if [ -n "${TIMELINE_PHASE}" ]; then
+    timeline_record "${TIMELINE_PHASE}" "${TIMELINE_PHASE_KIND}" "${TIMELINE_PHASE_START}" "$(timeline_now)" "failed"
+  fi
+  if [ -n "${TIMELINE_UPLOAD_PID}" ]; then
+    wait "${TIMELINE_UPLOAD_PID}" || true
+  fi
+  timeline_upload "${TIMELINE_FILE}"
+  exit "${status}"
+}
+
+# Usage: timeline_init <role>
+function timeline_init() {
+  TIMELINE_ROLE=$1
+  TIMELINE_SCRIPT=$(basename "$0")
+  TIMELINE_INSTANCE=$(curl -s --max-time 2 http://169.254.169.254/latest/meta-data/instance-id || hostname)
+  : > "${TIMELINE_FILE}"
+  trap timeline_exit EXIT
+
+  # from the kernel boot to the script: cloud-init, the user data packages and the bundle download
+  local boot=$(( $(date -d "$(uptime -s)" +%s) * 1000 ))
+  timeline_record "user_data" "boot" "${boot}" "$(timeline_now)" "ok"
+  timeline_upload_async
+}
+
+# Usage: phase <name> <kind> <command> [args...]
+# kind groups the phases across scripts: install, config, pull, wait, join, addon
+function phase() {
+  TIMELINE_PHASE=$1
+  TIMELINE_PHASE_KIND=$2
+  TIMELINE_PHASE_START=$(timeline_now)
+  shift 2
+
+  "$@"
+
+  timeline_record "${TIMELINE_PHASE}" "${TIMELINE_PHASE_KIND}" "${TIMELINE_PHASE_START}" "$(timeline_now)" "ok"
+  TIMELINE_PHASE=""
+  timeline_upload_async
+}
+
+# Usage: timeline_ready <name>
+# Record the moment the node serves its role, the end of its critical path.
+function timeline_ready() {
+  local now=$(timeline_now)
+  timeline_record "$1" "ready" "${now}" "${now}" "ok"
+  timeline_upload_async
+}
+
+# Usage: timeline_wait_node_ready <timeout>
+# Wait for the kubelet to report the node Ready and record it. Never fails
+# the boot, a node that is not Ready in time is recorded with a timeout.
+function timeline_wait_node_ready() {
+  local timeout=$1
+  local start=$(timeline_now)
+  local check="sudo kubectl --kubeconfig /etc/kubernetes/kubelet.conf get node \"\$(hostname)\" \
+    -o jsonpath='{.status.conditions[?(@.type==\"Ready\")].status}' 2>/dev/null | grep -q True"
+
+  if timeout "${timeout}" bash -c "until ${check}; do sleep 2; done"; then
+    timeline_record "wait_node_ready" "wait" "${start}" "$(timeline_now)" "ok"
+    timeline_ready "node_ready"
+  else
+    timeline_record "wait_node_ready" "wait" "${start}" "$(timeline_now)" "timeout"
+    timeline_upload_async
+  fi
+}
@@ -2,6 +2,8 @@
 
 set -xe
 
+source "$(dirname "${BASH_SOURCE[0]}")/../common/timeline.sh"
+
 function check_required_args() {
     local args=("$@")
 
@@ -63,15 +65,34 @@ function initialize_system() {
   sudo sysctl --system
 }
 
+function fetch_artifact() {
+  local url=$1
+  local output=$2
+  local mirrored="${ARTIFACTS_DIR}/$(basename "${url}")"
+
+  # artifacts mirrored into the project bucket are synced to ARTIFACTS_DIR by the node user data
+  if [ -f "${mirrored}" ]; then
+    sudo cp "${mirrored}" "${output}"
+  else
+    sudo wget -qO "${output}" "${url}"
+  fi
+}
+
 function install_utils() {
   sudo apt update -y
   sudo apt install -y jq
-  sudo wget -qO /usr/local/bin/yq https://github.com/mikefarah/yq/releases/latest/download/yq_linux_amd64
+  fetch_artifact https://github.com/mikefarah/yq/releases/download/v4.40.5/yq_linux_amd64 /usr/local/bin/yq
   sudo chmod +x /usr/local/bin/yq
   sudo apt install -y default-jre
 }
 
 function install_helm() {
+    local helm_archive="${ARTIFACTS_DIR}/helm-v3.13.2-linux-amd64.tar.gz"
+    if [ -f "${helm_archive}" ]; then
+      sudo tar -xzf "${helm_archive}" -C /usr/local/bin --strip-components=1 linux-amd64/helm
+      return
+    fi
+
     curl https://baltocdn.com/helm/signing.asc | gpg --dearmor | sudo tee /usr/share/keyrings/helm.gpg > /dev/null
     sudo apt-get install apt-transport-https --yes
     echo "deb [arch=$(dpkg --print-architecture) signed-by=/usr/share/keyrings/helm.gpg] https://baltocdn.com/helm/stable/debian/ all main" | sudo tee /etc/apt/sources.list.d/helm-stable-debian.list
@@ -284,6 +305,12 @@ containerRuntimeEndpoint: unix:///run/containerd/containerd.sock
 EOF
 }
 
+function pull_images() {
+  local config_filepath=$1
+  # the same images kubeadm init pulls, pulled beforehand so that the timeline tells them apart
+  sudo kubeadm config images pull --config "${config_filepath}"
+}
+
 function run_kubeadm_init() {
   local config_filepath=$1
   local log_file=$2
@@ -340,21 +367,19 @@ function upload_join_cmd() {
 function setup_calico_cni() {
   local cni=$1
   local pods_network_cidr=$2
-  local s3_bucket=$3
+  local local_addon_dir=$3
 
   kubectl taint nodes --all node-role.kubernetes.io/control-plane-
-  aws s3 cp s3://${s3_bucket}/scripts/addons/calico.sh /tmp/calico.sh
-  chmod +x /tmp/calico.sh
-  bash /tmp/calico.sh "${pods_network_cidr}"
+  bash ${local_addon_dir}/calico.sh "${pods_network_cidr}"
 }
 
 function setup_cni() {
   local cni=$1
   local pods_network_cidr=$2
-  local s3_bucket=$3
+  local local_addon_dir=$3
 
   if [ "${cni}" == "calico" ]; then
-    setup_calico_cni "${cni}" "${pods_network_cidr}" "${s3_bucket}"
+    setup_calico_cni "${cni}" "${pods_network_cidr}" "${local_addon_dir}"
   else
     echo "CNI not yet supported. Exiting..."
     exit 1
@@ -375,14 +400,11 @@ function scale_controlplane() {
 }
 
 function install_addon() {
-  local s3_bucket="$1"
-  local s3_base_path="$2"
-  local script_name="$3"
-  local local_addon_dir="$4"
-  local args="${@:5}"
-
-  aws s3 cp s3://${s3_bucket}/${s3_base_path}/${script_name} ${local_addon_dir}/${script_name}
-  chmod +x ${local_addon_dir}/${script_name}
+  local script_name="$1"
+  local local_addon_dir="$2"
+  local args="${@:3}"
+
+  # addon scripts are extracted from the addons bundle by the node user data
   bash ${local_addon_dir}/${script_name} ${args}
 }
 
@@ -420,8 +442,8 @@ CNI="calico"
 KUBEADM_CONFIG_FILEPATH="kubeadm-config.yaml"
 KUBEADM_LOG_FILEPATH="kubeadm-init.out"
 TAINT_NETWORK_NOT_READY="node.kubernetes.io/network-unavailable:NoSchedule"
-S3_ADDONS_BASE_PATH="scripts/addons"
-LOCAL_ADDONS_DIR="/tmp"
+LOCAL_ADDONS_DIR="/opt/bootstrap/addons"
+ARTIFACTS_DIR="/opt/artifacts"
 IRSA_ANN_KEY="eks.amazonaws.com/role-arn"
 
 required_args=(
@@ -453,16 +475,19 @@ required_args=(
   NTH_ROLE_ARN
 )
 
+timeline_init controlplane
 check_required_args "${required_args[@]}"
-initialize_system "${K8S_NODES_HOSTNAME_MODE}"
-install_packages "${K8S_VERSION}"
-wait_for_resources 600 "OidcProvider is not up" "curl --silent --head --fail https://${OIDC_PROVIDER_URL}"
-prepare_oidc_resources "${OIDC_PROVIDER_URL}" "${OIDC_KEY_SECRET_ID}"
-wait_for_resources 600 "Waiting for NLB to be up" "aws elbv2 describe-load-balancers \
+phase initialize_system config initialize_system "${K8S_NODES_HOSTNAME_MODE}"
+phase install_packages install install_packages "${K8S_VERSION}"
+phase wait_oidc_provider wait \
+  wait_for_resources 600 "OidcProvider is not up" "curl --silent --head --fail https://${OIDC_PROVIDER_URL}"
+phase prepare_oidc_resources config prepare_oidc_resources "${OIDC_PROVIDER_URL}" "${OIDC_KEY_SECRET_ID}"
+phase wait_nlb wait \
+  wait_for_resources 600 "Waiting for NLB to be up" "aws elbv2 describe-load-balancers \
                                                     --names \"${K8S_CLUSTER_NAME}-controlplane-nlb\" \
                                                     --query \"LoadBalancers[?State.Code==`active`].DNSName\" \
                                                     --output text"
-create_kubeadm_config \
+phase create_kubeadm_config config create_kubeadm_config \
   "${KUBEADM_CONFIG_FILEPATH}" \
   "${K8S_CLUSTER_NAME}" \
   "${K8S_POD_NETWORK_CIDR}" \
@@ -473,29 +498,29 @@ create_kubeadm_config \
   "${OIDC_USERNAME_CLAIM}" \
   "${OIDC_GROUPS_CLAIM}"
 
-run_kubeadm_init "${KUBEADM_CONFIG_FILEPATH}" "${KUBEADM_LOG_FILEPATH}"
+phase pull_images pull pull_images "${KUBEADM_CONFIG_FILEPATH}"
+phase kubeadm_init join run_kubeadm_init "${KUBEADM_CONFIG_FILEPATH}" "${KUBEADM_LOG_FILEPATH}"
 configure_kubectl
-upload_join_cmd \
+phase upload_controlplane_join_cmd config upload_join_cmd \
   "${K8S_CLUSTER_NAME}" \
   "${KUBEADM_LOG_FILEPATH}" \
   "You can now join any number of control-plane node by running the following command" \
   "kubeadm join" \
   "controlplane"
 
-upload_join_cmd \
+phase upload_worker_join_cmd config upload_join_cmd \
   "${K8S_CLUSTER_NAME}" \
   "${KUBEADM_LOG_FILEPATH}" \
   "you can join any number of worker nodes by running the following" \
   "kubeadm join" \
   "worker"
 
-setup_cni "${CNI}" "${K8S_POD_NETWORK_CIDR}" "${S3_BUCKET}"
-wait_for_resources 300 "Waiting for taint on node to be removed" \
+phase setup_cni addon setup_cni "${CNI}" "${K8S_POD_NETWORK_CIDR}" "${LOCAL_ADDONS_DIR}"
+phase wait_network_ready wait wait_for_resources 300 "Waiting for taint on node to be removed" \
   "kubectl describe node '$(hostname)' | grep 'Taints' | grep -q -v '${TAINT_NETWORK_NOT_READY}' 2>/dev/null"
+timeline_ready node_ready
 
-install_addon \
-  "${S3_BUCKET}" \
-  "${S3_ADDONS_BASE_PATH}" \
+phase addon_eks_irsa_webhook addon install_addon \
   "eks-irsa-webhook.sh" \
   "${LOCAL_ADDONS_DIR}" \
   "${EKS_IRSA_WEBHOOK_SA_NAMESPACE}" \
@@ -503,51 +528,39 @@ install_addon \
 
 kubectl taint nodes --all node-role.kubernetes.io/control-plane=:NoSchedule
 
-install_addon \
-  "${S3_BUCKET}" \
-  "${S3_ADDONS_BASE_PATH}" \
+phase addon_aws_cloud_provider addon install_addon \
   "aws-cloud-provider.sh" \
   "${LOCAL_ADDONS_DIR}" \
   "${AWS_CLOUD_PROVIDER_SA_NAMESPACE}" \
   "${IRSA_ANN_KEY}: ${AWS_CLOUD_PROVIDER_ROLE_ARN}"
 
-install_addon \
-  "${S3_BUCKET}" \
-  "${S3_ADDONS_BASE_PATH}" \
+phase addon_cluster_autoscaler addon install_addon \
   "cluster-autoscaler.sh" \
   "${LOCAL_ADDONS_DIR}" \
   "${K8S_CLUSTER_NAME}" \
   "${CLUSTER_AUTO_SCALER_SA_NAMESPACE}" \
   "${IRSA_ANN_KEY}: ${CLUSTER_AUTO_SCALER_ROLE_ARN}"
 
-install_addon \
-  "${S3_BUCKET}" \
-  "${S3_ADDONS_BASE_PATH}" \
+phase addon_aws_load_balancer_controller addon install_addon \
   "aws-load-balancer-controller.sh" \
   "${LOCAL_ADDONS_DIR}" \
   "${K8S_CLUSTER_NAME}" \
   "${AWS_LOAD_BALANCER_CONTROLLER_SA_NAMESPACE}" \
   "${IRSA_ANN_KEY}: ${AWS_LOAD_BALANCER_CONTROLLER_ROLE_ARN}"
 
-install_addon \
-  "${S3_BUCKET}" \
-  "${S3_ADDONS_BASE_PATH}" \
+phase addon_external_snapshotter addon install_addon \
   "external-snapshotter.sh" \
   "${LOCAL_ADDONS_DIR}" \
   "${EBS_CSI_DRIVER_SA_NAMESPACE}"
 
-install_addon \
-  "${S3_BUCKET}" \
-  "${S3_ADDONS_BASE_PATH}" \
+phase addon_aws_ebs_csi_driver addon install_addon \
   "aws-ebs-csi-driver.sh" \
   "${LOCAL_ADDONS_DIR}" \
   "${K8S_CLUSTER_NAME}" \
   "${EBS_CSI_DRIVER_SA_NAMESPACE}" \
   "${IRSA_ANN_KEY}: ${EBS_CSI_DRIVER_ROLE_ARN}"
 
-install_addon \
-  "${S3_BUCKET}" \
-  "${S3_ADDONS_BASE_PATH}" \
+phase addon_node_termination_handler addon install_addon \
   "node-termination-handler.sh" \
   "${LOCAL_ADDONS_DIR}" \
   "${NTH_NAMESPACE}" \
@@ -555,8 +568,8 @@ install_addon \
   "0.22.0" \
   "${IRSA_ANN_KEY}: ${NTH_ROLE_ARN}"
 
-install_addon \
-  "${S3_BUCKET}" \
-  "${S3_ADDONS_BASE_PATH}" \
+phase addon_metrics_server addon install_addon \
   "metrics-server.sh" \
   "${LOCAL_ADDONS_DIR}"
+
+timeline_ready cluster_ready
@@ -3,6 +3,8 @@
 # Set -e to exit on error and -x to print each command
 set -xe
 
+source "$(dirname "${BASH_SOURCE[0]}")/../common/timeline.sh"
+
 function check_required_args() {
     local args=("$@")
 
@@ -41,20 +43,33 @@ function install_and_configure_utils() {
     aws --version
 }
 
+function fetch_artifact() {
+    local url=$1
+    local output=$2
+    local mirrored="${ARTIFACTS_DIR}/$(basename "${url}")"
+
+    # artifacts mirrored into the project bucket are synced to ARTIFACTS_DIR by the node user data
+    if [ -f "${mirrored}" ]; then
+        cp "${mirrored}" "${output}"
+    else
+        wget "${url}" -O "${output}"
+    fi
+}
+
 function install_ec2stack_plugins() {
     local plugin_download_path=$1
 
-    wget https://repo1.maven.org/maven2/org/jgroups/aws/jgroups-aws/2.0.1.Final/jgroups-aws-2.0.1.Final.jar \
-    -O "${plugin_download_path}/jgroups-aws-2.0.1.Final.jar"
+    fetch_artifact https://repo1.maven.org/maven2/org/jgroups/aws/jgroups-aws/2.0.1.Final/jgroups-aws-2.0.1.Final.jar \
+        "${plugin_download_path}/jgroups-aws-2.0.1.Final.jar"
 
-    wget https://repo1.maven.org/maven2/com/amazonaws/aws-java-sdk-core/1.12.576/aws-java-sdk-core-1.12.576.jar \
-        -O "${plugin_download_path}/aws-java-sdk-core-1.12.576.jar"
+    fetch_artifact https://repo1.maven.org/maven2/com/amazonaws/aws-java-sdk-core/1.12.576/aws-java-sdk-core-1.12.576.jar \
+        "${plugin_download_path}/aws-java-sdk-core-1.12.576.jar"
 
-    wget https://repo1.maven.org/maven2/com/amazonaws/aws-java-sdk-s3/1.12.576/aws-java-sdk-s3-1.12.576.jar \
-        -O "${plugin_download_path}/aws-java-sdk-s3-1.12.576.jar"
+    fetch_artifact https://repo1.maven.org/maven2/com/amazonaws/aws-java-sdk-s3/1.12.576/aws-java-sdk-s3-1.12.576.jar \
+        "${plugin_download_path}/aws-java-sdk-s3-1.12.576.jar"
 
-    wget https://repo1.maven.org/maven2/joda-time/joda-time/2.12.4/joda-time-2.12.4.jar \
-        -O "${plugin_download_path}/joda-time-2.12.4.jar"
+    fetch_artifact https://repo1.maven.org/maven2/joda-time/joda-time/2.12.4/joda-time-2.12.4.jar \
+        "${plugin_download_path}/joda-time-2.12.4.jar"
 }
 
 function install_db_iam_auth_plugins() {
@@ -63,20 +78,20 @@ function install_db_iam_auth_plugins() {
     local aws_sdk_version=$3
     local aws_sdk_packages=("${@:4}")
 
-    wget https://repo1.maven.org/maven2/software/amazon/jdbc/aws-advanced-jdbc-wrapper/${aws_jdbc_driver_version}/aws-advanced-jdbc-wrapper-${aws_jdbc_driver_version}.jar \
-    -O "${plugin_download_path}/aws-advanced-jdbc-wrapper-${aws_jdbc_driver_version}.jar"
+    fetch_artifact https://repo1.maven.org/maven2/software/amazon/jdbc/aws-advanced-jdbc-wrapper/${aws_jdbc_driver_version}/aws-advanced-jdbc-wrapper-${aws_jdbc_driver_version}.jar \
+        "${plugin_download_path}/aws-advanced-jdbc-wrapper-${aws_jdbc_driver_version}.jar"
 
     for package in "${aws_sdk_packages[@]}"; do
         local url="https://repo1.maven.org/maven2/software/amazon/awssdk/${package}/${aws_sdk_version}/${package}-${aws_sdk_version}.jar"
         local jar_file="${plugin_download_path}/${package}-${aws_sdk_version}.jar"
-        wget $url -O $jar_file
+        fetch_artifact $url $jar_file
     done
 }   
 
 function install_keycloak() {
     local keycloak_version=$1
-    wget https://github.com/keycloak/keycloak/releases/download/${keycloak_version}/keycloak-${keycloak_version}.zip \
-    -O keycloak-${keycloak_version}.zip
+    fetch_artifact https://github.com/keycloak/keycloak/releases/download/${keycloak_version}/keycloak-${keycloak_version}.zip \
+        keycloak-${keycloak_version}.zip
 }
 
 function install_packages() {
@@ -417,6 +432,7 @@ USER_HOME="/opt/keycloak"
 KEYCLOAK_DIR="/opt/keycloak-${KEYCLOAK_VERSION}"
 CERTS_DOWNLOAD_PATH="/tmp/certs"
 PLUGIN_DOWNLOAD_PATH="/tmp/keycloak"
+ARTIFACTS_DIR="/opt/artifacts"
 AWS_JDBC_DRIVER_VERSION="2.2.2"
 AWS_SDK_VERSION="2.20.107"
 AWS_SDK_PACKAGES=(
@@ -442,27 +458,28 @@ DB_URL_PROPERTIES="wrapperPlugins=iam&ssl=true&sslmode=verify-ca&sslrootcert=${K
 KUBERNETES_REALM_NAME="kubernetes"
 
 
+timeline_init keycloak
 check_required_args "${required_args[@]}"
 set_hostname "${HOSTNAME}"
 
-install_packages \
+phase install_packages install install_packages \
     "${KEYCLOAK_VERSION}" \
     "${PLUGIN_DOWNLOAD_PATH}" \
     "${AWS_JDBC_DRIVER_VERSION}" \
     "${AWS_SDK_VERSION}" \
     "${AWS_SDK_PACKAGES[@]}"
 
-get_rds_glocal_cacert "${CERTS_DOWNLOAD_PATH}" "${AWS_REGION}"
+phase get_rds_cacert install get_rds_glocal_cacert "${CERTS_DOWNLOAD_PATH}" "${AWS_REGION}"
 create_user_and_group "${USER}" "${USER_HOME}"
 
-setup_keycloak_dirs \
+phase setup_keycloak_dirs config setup_keycloak_dirs \
     "${USER}" \
     "${KEYCLOAK_VERSION}" \
     "${AWS_REGION}" \
     "${PLUGIN_DOWNLOAD_PATH}" \
     "${CERTS_DOWNLOAD_PATH}"
 
-create_keycloak_service_envfile \
+phase create_keycloak_service_envfile config create_keycloak_service_envfile \
     "${KEYCLOAK_VERSION}" \
     "${FRONTEND_PROXY_DNS}" \
     "${DB_SCHEMA}" \
@@ -475,21 +492,22 @@ create_keycloak_service_envfile \
     "${S3_BUCKET_NAME}" \
     "${KEYCLOAK_ADMIN_PASSWORD_SECRET_ID}"
 
-get_realms_from_s3 \
+phase get_realms_from_s3 config get_realms_from_s3 \
     "${S3_BUCKET_NAME}" \
     "${KEYCLOAK_DIR}/data/import" \
     "${USER}"
 
-create_keycloak_service "${KEYCLOAK_VERSION}" "${AWS_REGION}"
+phase create_keycloak_service config create_keycloak_service "${KEYCLOAK_VERSION}" "${AWS_REGION}"
 
-start_keycloak_service
+phase start_keycloak_service config start_keycloak_service
 
-wait_for_resources \
+phase wait_keycloak wait wait_for_resources \
     300 \
     "Keycloak is not ready yet." \
     "curl --output /dev/null --silent --head --fail https://${FRONTEND_PROXY_DNS}/auth/realms/master"
+timeline_ready keycloak_ready
 
-create_privkey_and_upload_to_sm \
+phase create_oidc_key config create_privkey_and_upload_to_sm \
     "${USER}" \
     "${KEYCLOAK_DIR}" \
     "${KEYCLOAK_DIR}/keys/kube-rsa.pem" \
@@ -498,11 +516,11 @@ create_privkey_and_upload_to_sm \
     "${K8S_KEY_SECRET_ID}" \
     "${KEYCLOAK_ADMIN_PASSWORD_SECRET_ID}"
 
-scale_keycloak_asg \
+phase scale_keycloak_asg config scale_keycloak_asg \
     "${KEYCLOAK_ASG_NAME}" \
     "${KEYCLOAK_ASG_DESIRED_CAPACITY}"
 
-notify_cloudformation \
+phase notify_cloudformation config notify_cloudformation \
     "${AWS_CF_STACK_NAME}" \
     "${KEYCLOAL_ASG_RESOURCE_NAME}" \
     "${AWS_REGION}"
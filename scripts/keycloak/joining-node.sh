@@ -3,6 +3,8 @@
 # Set -e to exit on error and -x to print each command
 set -xe
 
+source "$(dirname "${BASH_SOURCE[0]}")/../common/timeline.sh"
+
 function check_required_args() {
     local args=("$@")
 
@@ -39,20 +41,33 @@ function install_and_configure_utils() {
     aws --version
 }
 
+function fetch_artifact() {
+    local url=$1
+    local output=$2
+    local mirrored="${ARTIFACTS_DIR}/$(basename "${url}")"
+
+    # artifacts mirrored into the project bucket are synced to ARTIFACTS_DIR by the node user data
+    if [ -f "${mirrored}" ]; then
+        cp "${mirrored}" "${output}"
+    else
+        wget "${url}" -O "${output}"
+    fi
+}
+
 function install_ec2stack_plugins() {
     local plugin_download_path=$1
 
-    wget https://repo1.maven.org/maven2/org/jgroups/aws/jgroups-aws/2.0.1.Final/jgroups-aws-2.0.1.Final.jar \
-    -O "${plugin_download_path}/jgroups-aws-2.0.1.Final.jar"
+    fetch_artifact https://repo1.maven.org/maven2/org/jgroups/aws/jgroups-aws/2.0.1.Final/jgroups-aws-2.0.1.Final.jar \
+        "${plugin_download_path}/jgroups-aws-2.0.1.Final.jar"
 
-    wget https://repo1.maven.org/maven2/com/amazonaws/aws-java-sdk-core/1.12.576/aws-java-sdk-core-1.12.576.jar \
-        -O "${plugin_download_path}/aws-java-sdk-core-1.12.576.jar"
+    fetch_artifact https://repo1.maven.org/maven2/com/amazonaws/aws-java-sdk-core/1.12.576/aws-java-sdk-core-1.12.576.jar \
+        "${plugin_download_path}/aws-java-sdk-core-1.12.576.jar"
 
-    wget https://repo1.maven.org/maven2/com/amazonaws/aws-java-sdk-s3/1.12.576/aws-java-sdk-s3-1.12.576.jar \
-        -O "${plugin_download_path}/aws-java-sdk-s3-1.12.576.jar"
+    fetch_artifact https://repo1.maven.org/maven2/com/amazonaws/aws-java-sdk-s3/1.12.576/aws-java-sdk-s3-1.12.576.jar \
+        "${plugin_download_path}/aws-java-sdk-s3-1.12.576.jar"
 
-    wget https://repo1.maven.org/maven2/joda-time/joda-time/2.12.4/joda-time-2.12.4.jar \
-        -O "${plugin_download_path}/joda-time-2.12.4.jar"
+    fetch_artifact https://repo1.maven.org/maven2/joda-time/joda-time/2.12.4/joda-time-2.12.4.jar \
+        "${plugin_download_path}/joda-time-2.12.4.jar"
 }
 
 function install_db_iam_auth_plugins() {
@@ -61,20 +76,20 @@ function install_db_iam_auth_plugins() {
     local aws_sdk_version=$3
     local aws_sdk_packages=("${@:4}")
 
-    wget https://repo1.maven.org/maven2/software/amazon/jdbc/aws-advanced-jdbc-wrapper/${aws_jdbc_driver_version}/aws-advanced-jdbc-wrapper-${aws_jdbc_driver_version}.jar \
-    -O "${plugin_download_path}/aws-advanced-jdbc-wrapper-${aws_jdbc_driver_version}.jar"
+    fetch_artifact https://repo1.maven.org/maven2/software/amazon/jdbc/aws-advanced-jdbc-wrapper/${aws_jdbc_driver_version}/aws-advanced-jdbc-wrapper-${aws_jdbc_driver_version}.jar \
+        "${plugin_download_path}/aws-advanced-jdbc-wrapper-${aws_jdbc_driver_version}.jar"
 
     for package in "${aws_sdk_packages[@]}"; do
         local url="https://repo1.maven.org/maven2/software/amazon/awssdk/${package}/${aws_sdk_version}/${package}-${aws_sdk_version}.jar"
         local jar_file="${plugin_download_path}/${package}-${aws_sdk_version}.jar"
-        wget $url -O $jar_file
+        fetch_artifact $url $jar_file
     done
 }   
 
 function install_keycloak() {
     local keycloak_version=$1
-    wget https://github.com/keycloak/keycloak/releases/download/${keycloak_version}/keycloak-${keycloak_version}.zip \
-    -O keycloak-${keycloak_version}.zip
+    fetch_artifact https://github.com/keycloak/keycloak/releases/download/${keycloak_version}/keycloak-${keycloak_version}.zip \
+        keycloak-${keycloak_version}.zip
 }
 
 function install_packages() {
@@ -288,6 +303,7 @@ USER_HOME="/opt/keycloak"
 KEYCLOAK_DIR="/opt/keycloak-${KEYCLOAK_VERSION}"
 CERTS_DOWNLOAD_PATH="/tmp/certs"
 PLUGIN_DOWNLOAD_PATH="/tmp/keycloak"
+ARTIFACTS_DIR="/opt/artifacts"
 AWS_JDBC_DRIVER_VERSION="2.2.2"
 AWS_SDK_VERSION="2.20.107"
 AWS_SDK_PACKAGES=(
@@ -312,27 +328,28 @@ AWS_SDK_PACKAGES=(
 DB_URL_PROPERTIES="wrapperPlugins=iam&ssl=true&sslmode=verify-ca&sslrootcert=${KEYCLOAK_DIR}/certs/${AWS_REGION}-bundle.pem"
 
 
+timeline_init keycloak
 check_required_args "${required_args[@]}"
 set_hostname "${HOSTNAME}"
 
-install_packages \
+phase install_packages install install_packages \
     "${KEYCLOAK_VERSION}" \
     "${PLUGIN_DOWNLOAD_PATH}" \
     "${AWS_JDBC_DRIVER_VERSION}" \
     "${AWS_SDK_VERSION}" \
     "${AWS_SDK_PACKAGES[@]}"
 
-get_rds_glocal_cacert "${CERTS_DOWNLOAD_PATH}" "${AWS_REGION}"
+phase get_rds_cacert install get_rds_glocal_cacert "${CERTS_DOWNLOAD_PATH}" "${AWS_REGION}"
 create_user_and_group "${USER}" "${USER_HOME}"
 
-setup_keycloak_dirs \
+phase setup_keycloak_dirs config setup_keycloak_dirs \
     "${USER}" \
     "${KEYCLOAK_VERSION}" \
     "${AWS_REGION}" \
     "${PLUGIN_DOWNLOAD_PATH}" \
     "${CERTS_DOWNLOAD_PATH}"
 
-create_keycloak_service_envfile \
+phase create_keycloak_service_envfile config create_keycloak_service_envfile \
     "${KEYCLOAK_VERSION}" \
     "${FRONTEND_PROXY_DNS}" \
     "${DB_SCHEMA}" \
@@ -345,6 +362,9 @@ create_keycloak_service_envfile \
     "${S3_BUCKET_NAME}" \
     "${KEYCLOAK_ADMIN_PASSWORD_SECRET_ID}"
 
-create_keycloak_service "${KEYCLOAK_VERSION}" "${AWS_REGION}"
+phase create_keycloak_service config create_keycloak_service "${KEYCLOAK_VERSION}" "${AWS_REGION}"
+
+phase start_keycloak_service config start_keycloak_service
 
-start_keycloak_service
\ No newline at end of file
+# the load balancer health checks take the node in from here
+timeline_ready keycloak_started
@@ -1,6 +1,8 @@
 -- -----------------------------------------------------------------------------
 -- create ROLE and Database ----------------------------------------------------
 -- -----------------------------------------------------------------------------
+-- every statement is idempotent: CREATE DATABASE cannot run in the transaction
+-- of the migration, so a failure after it re-runs the whole script
 DO $$
 BEGIN
 CREATE USER keycloak ;
@@ -8,7 +10,8 @@ EXCEPTION WHEN duplicate_object THEN RAISE NOTICE '%, skipping', SQLERRM USING E
 END
 $$;
 
-CREATE DATABASE keycloak WITH OWNER keycloak;
+SELECT 'CREATE DATABASE keycloak WITH OWNER keycloak'
+WHERE NOT EXISTS (SELECT FROM pg_database WHERE datname = 'keycloak')\gexec
 -- -----------------------------------------------------------------------------
 -- Grant rds_iam role to the role created above --------------------------------
 -- -----------------------------------------------------------------------------
@@ -18,10 +21,7 @@ GRANT rds_iam TO keycloak;
 -- -----------------------------------------------------------------------------
 \c keycloak
 REVOKE ALL ON SCHEMA public FROM PUBLIC ;
-CREATE SCHEMA keycloak AUTHORIZATION keycloak ;
+CREATE SCHEMA IF NOT EXISTS keycloak AUTHORIZATION keycloak ;
 ALTER ROLE keycloak SET search_path=keycloak ;
 GRANT ALL ON ALL TABLES IN SCHEMA keycloak TO keycloak ;
 REVOKE ALL ON DATABASE keycloak FROM PUBLIC ;
-
-
-
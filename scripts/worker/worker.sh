@@ -2,6 +2,8 @@
 
 set -xe
 
+source "$(dirname "${BASH_SOURCE[0]}")/../common/timeline.sh"
+
 function check_required_args() {
     local args=("$@")
 
@@ -196,15 +198,18 @@ required_args=(
     K8S_NODES_HOSTNAME_MODE
 )
 
+timeline_init worker
 check_required_args "${required_args[@]}"
-initialize_system "${K8S_NODES_HOSTNAME_MODE}"
-install_packages "${K8S_VERSION}"
-prepare_for_cni "${CNI}"
-create_kubeadm_config \
+phase initialize_system config initialize_system "${K8S_NODES_HOSTNAME_MODE}"
+phase install_packages install install_packages "${K8S_VERSION}"
+phase prepare_for_cni config prepare_for_cni "${CNI}"
+phase create_kubeadm_config config create_kubeadm_config \
   "${KUBEADM_CONFIG_FILEPATH}" \
   "${K8S_CLUSTER_NAME}" 
 
-run_kubeadm_init "${KUBEADM_CONFIG_FILEPATH}" "${KUBEADM_LOG_FILEPATH}"
+phase kubeadm_join join run_kubeadm_join "${KUBEADM_CONFIG_FILEPATH}" "${KUBEADM_LOG_FILEPATH}"
+# the kubelet pulls the kube-proxy and CNI images before the node turns Ready
+timeline_wait_node_ready 600
 
 
 
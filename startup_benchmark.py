@@ -0,0 +1,108 @@
+"""Benchmark the startup of the deployer command line.
+
+Importing main runs several times in fresh interpreters under
+python -X importtime. The median import time of main must stay within
+the budget and none of the SDKs, which the deployment steps import when
+they run, may be loaded by the import. The wall time of main.py --help
+is reported along, it is what any offline command pays before its work.
+"""
+from argparse import ArgumentParser
+from typing import Any, Dict, List, Tuple
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LOGGER = logging.getLogger()
+
+# modules loaded only by the steps calling AWS or Docker, or reading YAML
+LAZY_MODULES = ("boto3", "botocore", "docker", "requests", "urllib3", "yaml")
+
+def parse_args() -> Dict[str, Any]:
+    parser = ArgumentParser(description="Check the import time of the deployer against a budget")
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per measurement")
+    parser.add_argument("--budget-ms", type=float, default=60.0, help="Budget of the median import time of main")
+    parser.add_argument("--output", help="Save the report as JSON")
+    return vars(parser.parse_args())
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Parse the -X importtime lines into (module, self us, cumulative us), the module indented by depth."""
+    imports = []
+    for line in stderr.splitlines():
+        if(line.startswith("import time:") == False or "self [us]" in line): continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|", 2)
+        imports.append((module[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def get_subtree(imports: List[Tuple[str, int, int]], root: str) -> List[Tuple[str, int, int]]:
+    """Get the imports made by a top level module, importtime lists them right before it."""
+    end = next(i for i, (module, _, _) in enumerate(imports) if module == root)
+    start = end
+    while(start > 0 and imports[start - 1][0].startswith(" ")):
+        start -= 1
+    return imports[start:end]
+
+
+def measure_import() -> Tuple[float, List[Tuple[str, int, int]]]:
+    """Import main in a fresh interpreter, return its cumulative import time in ms and the import lines."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=os.path.dirname(
+        os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    imports = parse_importtime(result.stderr)
+    total = next(cumulative for module, _, cumulative in imports if module == "main")
+    return total / 1000, imports
+
+
+def measure_help() -> float:
+    """Run main.py --help, return its wall time in ms."""
+    start = time.monotonic()
+    subprocess.run([sys.executable, "main.py", "--help"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                   capture_output=True, check=True)
+    return (time.monotonic() - start) * 1000
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args()
+    runs = [measure_import() for _ in range(args["runs"])]
+    import_times = [total for total, _ in runs]
+    help_times = [measure_help() for _ in range(args["runs"])]
+
+    imports = get_subtree(runs[-1][1], "main")
+    loaded = sorted(set(module.strip().split(".")[0] for module, _, _ in imports))
+    eager = [module for module in LAZY_MODULES if module in loaded]
+    # direct imports of main, indented by two spaces under it
+    heaviest = sorted(((module.strip(), cumulative / 1000) for module, _, cumulative in imports
+                       if module.startswith("  ") and module.startswith("   ") == False),
+                      key=lambda item: -item[1])[:10]
+
+    report = {
+        "import_main_ms": {"min": min(import_times), "median": statistics.median(import_times),
+                           "max": max(import_times)},
+        "help_ms": {"min": min(help_times), "median": statistics.median(help_times), "max": max(help_times)},
+        "budget_ms": args["budget_ms"],
+        "eager_sdks": eager,
+        "heaviest_imports_ms": dict(heaviest)
+    }
+    LOGGER.info(f"import main: {report['import_main_ms']['median']:.1f}ms median "
+                f"({report['import_main_ms']['min']:.1f}ms min), budget {args['budget_ms']:.0f}ms")
+    LOGGER.info(f"main.py --help: {report['help_ms']['median']:.1f}ms median wall time")
+    for module, cumulative in heaviest:
+        LOGGER.info(f"  {module:<40} {cumulative:8.1f}ms")
+    if(args["output"] is not None):
+        with open(args["output"], "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if(len(eager) > 0):
+        LOGGER.error(f"Importing main loads {', '.join(eager)}, import them in the steps using them")
+        failed = True
+    if(report["import_main_ms"]["median"] > args["budget_ms"]):
+        LOGGER.error(f"Importing main takes {report['import_main_ms']['median']:.1f}ms, "
+                     f"over the budget of {args['budget_ms']:.0f}ms")
+        failed = True
+    if(failed): exit(1)
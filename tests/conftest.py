@@ -0,0 +1,75 @@
+import importlib
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_s3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda", "dbbootstrap")
+# top level modules of the Lambda, they shadow the constants module of the repository
+LAMBDA_MODULES = ("constants", "exceptions", "cache", "sqlscript", "dbbootstrap")
+BUCKET_NAME = "test-bucket"
+LAMBDA_ENVIRONMENT = {
+    "DBHost": "localhost",
+    "DBPort": "5432",
+    "DBName": "postgres",
+    "DBUser": "postgres",
+    "Secret_ARN": "arn:aws:secretsmanager:us-east-1:000000000000:secret:test",
+    "Region_Name": "us-east-1",
+    "SQLScriptS3Bucket": BUCKET_NAME,
+    "SQLScriptS3Key": "sql/migrations/"
+}
+
+
+@pytest.fixture(autouse=True)
+def aws_environment(monkeypatch):
+    """Run from the repository root with fake credentials, so no test can reach a real account."""
+    monkeypatch.chdir(ROOT)
+    for name in ("AWS_PROFILE", "AWS_SESSION_TOKEN", "AWS_SECURITY_TOKEN"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+
+@pytest.fixture
+def bucket_name():
+    return BUCKET_NAME
+
+
+@pytest.fixture
+def s3_client(bucket_name):
+    """S3 client of a moto stand-in holding an empty bucket."""
+    with mock_s3():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=bucket_name)
+        yield client
+
+
+def load_lambda_module(name: str):
+    """Import a module of the dbbootstrap Lambda apart from the modules of the repository."""
+    saved = {module: sys.modules.pop(module) for module in LAMBDA_MODULES if module in sys.modules}
+    sys.path.insert(0, LAMBDA_DIR)
+    try:
+        with pytest.MonkeyPatch.context() as monkeypatch:
+            for key, value in LAMBDA_ENVIRONMENT.items():
+                monkeypatch.setenv(key, value)
+            monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+            return importlib.import_module(name)
+    finally:
+        sys.path.remove(LAMBDA_DIR)
+        for module in LAMBDA_MODULES:
+            sys.modules.pop(module, None)
+        sys.modules.update(saved)
+
+
+@pytest.fixture(scope="session")
+def sqlscript():
+    return load_lambda_module("sqlscript")
+
+
+@pytest.fixture(scope="session")
+def dbbootstrap():
+    return load_lambda_module("dbbootstrap")
@@ -0,0 +1,92 @@
+import functools
+import hashlib
+import http.server
+import threading
+
+import pytest
+
+from constants import ARTIFACTS_FILE, ARTIFACTS_S3_PREFIX
+from utils.artifact_utils import fetch_artifact, fetch_artifacts, load_artifacts, mirror_artifacts
+from utils.exceptions import ArtifactException
+
+CONTENT = b"#!/bin/sh\necho artifact\n"
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def artifact_server(tmp_path):
+    """Local HTTP server serving the files of a directory, the offline stand-in of the artifact urls."""
+    served = tmp_path / "served"
+    served.mkdir()
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=served))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield served, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def artifact(url, sha256=None, role="worker"):
+    filename = url.rsplit("/", 1)[-1]
+    return {"role": role, "url": url, "sha256": sha256, "filename": filename,
+            "key": f"{ARTIFACTS_S3_PREFIX}/{role}/{filename}"}
+
+
+def test_shipped_artifacts_have_a_key_per_role():
+    artifacts = load_artifacts(ARTIFACTS_FILE)
+
+    assert len(artifacts) > 0
+    assert all(a["key"] == f"{ARTIFACTS_S3_PREFIX}/{a['role']}/{a['filename']}" for a in artifacts)
+    assert len({a["key"] for a in artifacts}) == len(artifacts)
+
+
+def test_fetched_artifact_is_verified_and_cached(artifact_server, tmp_path):
+    served, url = artifact_server
+    (served / "tool").write_bytes(CONTENT)
+    pinned = artifact(f"{url}/tool", hashlib.sha256(CONTENT).hexdigest())
+
+    file_path = fetch_artifact(pinned, str(tmp_path / "cache"))
+    with open(file_path, "rb") as f:
+        assert f.read() == CONTENT
+    # a verified cached copy is not fetched again
+    (served / "tool").unlink()
+    assert fetch_artifact(pinned, str(tmp_path / "cache")) == file_path
+
+
+def test_checksum_mismatch_is_not_cached(artifact_server, tmp_path):
+    served, url = artifact_server
+    (served / "tool").write_bytes(CONTENT)
+
+    with pytest.raises(ArtifactException, match="Checksum mismatch"):
+        fetch_artifact(artifact(f"{url}/tool", "0" * 64), str(tmp_path / "cache"))
+    assert list((tmp_path / "cache" / "worker").iterdir()) == []
+
+
+def test_every_failed_fetch_is_reported(artifact_server, tmp_path):
+    served, url = artifact_server
+    (served / "tool").write_bytes(CONTENT)
+    artifacts = [artifact(f"{url}/tool"), artifact(f"{url}/missing-1"), artifact(f"{url}/missing-2")]
+
+    with pytest.raises(ArtifactException) as error:
+        fetch_artifacts(artifacts, str(tmp_path / "cache"), max_workers=3)
+    assert sorted(error.value.url.split(", ")) == [f"{url}/missing-1", f"{url}/missing-2"]
+
+
+def test_mirror_uploads_only_missing_or_changed_artifacts(artifact_server, tmp_path, s3_client, bucket_name):
+    served, url = artifact_server
+    for name in ("a", "b", "c"):
+        (served / name).write_bytes(CONTENT)
+    files = fetch_artifacts([artifact(f"{url}/{name}") for name in ("a", "b", "c")], str(tmp_path / "cache"))
+    s3_client.put_object(Bucket=bucket_name, Key=f"{ARTIFACTS_S3_PREFIX}/worker/a", Body=CONTENT)
+    s3_client.put_object(Bucket=bucket_name, Key=f"{ARTIFACTS_S3_PREFIX}/worker/b", Body=b"older")
+
+    report = mirror_artifacts(s3_client, bucket_name, files, max_workers=2)
+    assert (report["uploaded"], report["skipped"]) == (2, 1)
+    assert s3_client.get_object(Bucket=bucket_name, Key=f"{ARTIFACTS_S3_PREFIX}/worker/b")["Body"].read() == CONTENT
+
+    report = mirror_artifacts(s3_client, bucket_name, files, max_workers=2)
+    assert (report["uploaded"], report["skipped"]) == (0, 3)
@@ -0,0 +1,141 @@
+import json
+
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError, ConnectionClosedError
+
+from utils import aws_call_utils
+from utils.aws_call_utils import AWSCallLayer, FaultResponse, TokenBucket
+from utils.aws_utils import get_caller_identity
+from utils.exceptions import AWSCallException
+
+CALLER_IDENTITY = (
+    b'<GetCallerIdentityResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/"><GetCallerIdentityResult>'
+    b'<Arn>arn:aws:iam::123456789012:user/test</Arn><UserId>TEST</UserId><Account>123456789012</Account>'
+    b'</GetCallerIdentityResult><ResponseMetadata><RequestId>test</RequestId></ResponseMetadata>'
+    b'</GetCallerIdentityResponse>'
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeRandom:
+    """Faults for the first attempts only, and no backoff delay."""
+
+    def __init__(self, faults):
+        self.faults = faults
+
+    def random(self):
+        if(self.faults > 0):
+            self.faults -= 1
+            return 0.0
+        return 1.0
+
+    def uniform(self, low, high):
+        return 0.0
+
+
+@pytest.fixture
+def aws_config():
+    return {
+        "max_attempts": 4,
+        "base_delay": 0.0,
+        "max_delay": 0.0,
+        "rate_limits": {"default": {"rate": 1000, "burst": 1000}},
+        "fault_injection": {"rate": 1.0, "code": "Throttling"}
+    }
+
+
+def answer(client, status, body, headers=None):
+    """Answer the attempts reaching the network, after the fault injection, with a canned response."""
+    service = client.meta.service_model.service_id.hyphenize()
+    client.meta.events.register(
+        f"before-send.{service}", lambda request, **_: AWSResponse(request.url, status, headers or {},
+                                                                   FaultResponse(body)))
+
+
+def test_token_bucket_allows_bursts_then_the_rate(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(aws_call_utils, "time", clock)
+    bucket = TokenBucket(rate=2, burst=3)
+
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)
+    # an idle bucket refills up to the burst only
+    clock.sleep(10)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+
+
+def test_transient_faults_are_retried(monkeypatch, aws_config):
+    monkeypatch.setattr(aws_call_utils, "random", FakeRandom(faults=2))
+    layer = AWSCallLayer(aws_config)
+    client = layer.client("sts", "us-east-1")
+    answer(client, 200, CALLER_IDENTITY)
+
+    assert get_caller_identity(client)["Account"] == "123456789012"
+    [call] = layer.stats.calls
+    assert (call["operation"], call["retries"], call["error"]) == ("GetCallerIdentity", 2, None)
+
+
+def test_retries_stop_after_max_attempts(monkeypatch, aws_config):
+    monkeypatch.setattr(aws_call_utils, "random", FakeRandom(faults=100))
+    layer = AWSCallLayer(aws_config)
+    client = layer.client("sts", "us-east-1")
+
+    with pytest.raises(AWSCallException) as error:
+        get_caller_identity(client)
+    assert (error.value.operation, error.value.code) == ("GetCallerIdentity", "Throttling")
+    [call] = layer.stats.calls
+    assert (call["retries"], call["error"]) == (aws_config["max_attempts"] - 1, "Throttling")
+
+
+def test_non_retryable_errors_fail_at_once(monkeypatch, aws_config):
+    monkeypatch.setattr(aws_call_utils, "random", FakeRandom(faults=100))
+    layer = AWSCallLayer({**aws_config, "fault_injection": {"rate": 1.0, "code": "AccessDenied"}})
+    client = layer.client("sts", "us-east-1")
+
+    with pytest.raises(ClientError):
+        client.get_caller_identity()
+    assert layer.stats.calls[0]["retries"] == 0
+
+
+def test_connection_errors_are_retried_and_typed(aws_config):
+    layer = AWSCallLayer({**aws_config, "fault_injection": {}})
+    client = layer.client("sts", "us-east-1")
+    attempts = []
+
+    def refuse(request, **_):
+        attempts.append(request)
+        raise ConnectionClosedError(endpoint_url=request.url)
+
+    client.meta.events.register("before-send.sts", refuse)
+    with pytest.raises(AWSCallException) as error:
+        get_caller_identity(client)
+    assert error.value.code == "ConnectionClosedError"
+    assert len(attempts) == aws_config["max_attempts"]
+
+
+def test_client_token_is_reused_by_every_attempt(monkeypatch, aws_config):
+    monkeypatch.setattr(aws_call_utils, "random", FakeRandom(faults=2))
+    layer = AWSCallLayer(aws_config)
+    client = layer.client("secretsmanager", "us-east-1")
+    tokens = []
+    client.meta.events.register_first(
+        "before-send.secrets-manager",
+        lambda request, **_: tokens.append(json.loads(request.body)["ClientRequestToken"]))
+    answer(client, 200, b'{"ARN": "arn", "Name": "test"}', {"Content-Type": "application/x-amz-json-1.1"})
+
+    client.create_secret(Name="test", SecretString="secret")
+    assert len(tokens) == 3 and len(set(tokens)) == 1
+    assert layer.stats.calls[0]["params"]["SecretString"] == "<redacted>"
@@ -0,0 +1,65 @@
+import hashlib
+import os
+
+from boto3.s3.transfer import TransferConfig
+
+from utils.aws_utils import compute_file_etag, list_s3_objects, sync_dirs_to_s3
+
+PART_SIZE = 5 * 1024 * 1024
+
+
+def write_file(path, content: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_etag_of_single_part_file_is_md5(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"hello")
+    assert compute_file_etag(str(path)) == hashlib.md5(b"hello").hexdigest()
+    assert compute_file_etag(str(path), multipart=True) == hashlib.md5(b"hello").hexdigest()
+
+
+def test_etag_matches_s3_multipart_upload(tmp_path, s3_client, bucket_name):
+    path = tmp_path / "large"
+    path.write_bytes(os.urandom(2 * PART_SIZE + 1024))
+    config = TransferConfig(multipart_threshold=PART_SIZE, multipart_chunksize=PART_SIZE, use_threads=False)
+    s3_client.upload_file(str(path), bucket_name, "large", Config=config)
+
+    etag = list_s3_objects(s3_client, bucket_name, "large")["large"]["ETag"]
+    assert etag.endswith("-3")
+    assert compute_file_etag(str(path), multipart=True, chunk_size=PART_SIZE) == etag
+
+
+def test_sync_uploads_only_new_or_changed_files(tmp_path, monkeypatch, s3_client, bucket_name):
+    monkeypatch.chdir(tmp_path)
+    write_file("scripts/a.sh", b"echo a")
+    write_file("scripts/nested/b.sh", b"echo b")
+
+    report = sync_dirs_to_s3(s3_client, bucket_name, ["scripts"])
+    assert (report["uploaded"], report["skipped"]) == (2, 0)
+    assert set(list_s3_objects(s3_client, bucket_name, "scripts/")) == {"scripts/a.sh", "scripts/nested/b.sh"}
+
+    report = sync_dirs_to_s3(s3_client, bucket_name, ["scripts"])
+    assert (report["uploaded"], report["skipped"]) == (0, 2)
+
+    # same size, different content: only the ETag tells them apart
+    write_file("scripts/a.sh", b"echo c")
+    report = sync_dirs_to_s3(s3_client, bucket_name, ["scripts"])
+    assert (report["uploaded"], report["skipped"]) == (1, 1)
+    body = s3_client.get_object(Bucket=bucket_name, Key="scripts/a.sh")["Body"].read()
+    assert body == b"echo c"
+
+
+def test_sync_under_key_prefix(tmp_path, monkeypatch, s3_client, bucket_name):
+    monkeypatch.chdir(tmp_path)
+    write_file("cf_templates/main.yaml", b"Resources: {}")
+
+    report = sync_dirs_to_s3(s3_client, bucket_name, ["cf_templates"], key_prefix="releases/abc/")
+    assert report["uploaded"] == 1
+    assert list(list_s3_objects(s3_client, bucket_name, "releases/")) == ["releases/abc/cf_templates/main.yaml"]
+
+    # files synced under another prefix do not count as uploaded under this one
+    report = sync_dirs_to_s3(s3_client, bucket_name, ["cf_templates"], key_prefix="releases/def/")
+    assert report["uploaded"] == 1
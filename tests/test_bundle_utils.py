@@ -0,0 +1,79 @@
+import hashlib
+import json
+import tarfile
+
+import pytest
+
+from constants import BUNDLE_ROLES
+from utils.bundle_utils import build_bundle, build_bundles
+
+
+@pytest.fixture
+def scripts(tmp_path):
+    """Scripts of a role laid out as under scripts/."""
+    base_dir = tmp_path / "scripts"
+    (base_dir / "common").mkdir(parents=True)
+    (base_dir / "worker").mkdir()
+    (base_dir / "common" / "functions.sh").write_text("#!/bin/bash\n")
+    (base_dir / "worker" / "worker.sh").write_text("#!/bin/bash\nsource common/functions.sh\n")
+    (base_dir / "worker" / "kubelet.yaml").write_text("kind: KubeletConfiguration\n")
+    return base_dir
+
+
+def build(scripts, output_dir, role="worker"):
+    return build_bundle(role, [str(scripts / "common"), str(scripts / "worker")], str(output_dir), str(scripts))
+
+
+def sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_same_scripts_build_the_same_bundle(scripts, tmp_path):
+    first = build(scripts, tmp_path / "first")
+    # later modification times do not change the archive
+    (scripts / "worker" / "worker.sh").touch()
+    second = build(scripts, tmp_path / "second")
+    assert first.rsplit("/", 1)[1] == second.rsplit("/", 1)[1]
+    assert sha256(first) == sha256(second)
+
+
+def test_changed_script_gets_a_new_key(scripts, tmp_path):
+    first = build(scripts, tmp_path)
+    (scripts / "worker" / "worker.sh").write_text("#!/bin/bash\necho changed\n")
+    second = build(scripts, tmp_path)
+    assert first != second
+
+
+def test_bundle_holds_the_files_and_their_manifest(scripts, tmp_path):
+    with tarfile.open(build(scripts, tmp_path)) as tar:
+        members = {member.name: member for member in tar.getmembers()}
+        manifest = json.load(tar.extractfile("manifests/worker.json"))
+        script = tar.extractfile("worker/worker.sh").read()
+
+    assert sorted(members) == ["common/functions.sh", "manifests/worker.json", "worker/kubelet.yaml",
+                               "worker/worker.sh"]
+    assert (members["worker/worker.sh"].mode, members["worker/kubelet.yaml"].mode) == (0o755, 0o644)
+    assert {member.mtime for member in members.values()} == {0}
+    assert manifest["role"] == "worker"
+    assert [file["path"] for file in manifest["files"]] == ["common/functions.sh", "worker/kubelet.yaml",
+                                                            "worker/worker.sh"]
+    assert manifest["files"][2]["sha256"] == hashlib.sha256(script).hexdigest()
+
+
+def test_up_to_date_bundle_is_not_rebuilt(scripts, tmp_path):
+    bundle = build(scripts, tmp_path)
+    with open(bundle, "ab") as f:
+        f.write(b"marker")
+    assert build(scripts, tmp_path) == bundle
+    with open(bundle, "rb") as f:
+        assert f.read().endswith(b"marker")
+
+
+def test_shipped_scripts_are_bundled_per_role(tmp_path):
+    bundles = build_bundles(output_dir=str(tmp_path))
+    assert sorted(bundles) == sorted(BUNDLE_ROLES)
+    for role, bundle in bundles.items():
+        with tarfile.open(bundle) as tar:
+            assert f"manifests/{role}.json" in tar.getnames()
+    assert build_bundles(output_dir=str(tmp_path)) == bundles
@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import ANY, Stubber
+
+from utils.cloudformation_utils import (get_change_set_type, new_stack_state, poll_stack, update_stack,
+                                        wait_for_stack)
+from utils.exceptions import AWSCallException, StackOperationException
+
+STACK_ID = "arn:aws:cloudformation:us-east-1:123456789012:stack/main/1"
+CHANGE_SET_ID = "arn:aws:cloudformation:us-east-1:123456789012:changeSet/main-1/1"
+CONFIG = {"StackName": "main", "TemplateURL": "https://s3.amazonaws.com/bucket/main.yaml", "Parameters": []}
+
+
+@pytest.fixture
+def cloudformation():
+    client = boto3.client("cloudformation", region_name="us-east-1")
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def describe_stacks(stubber, status):
+    stubber.add_response("describe_stacks", {"Stacks": [{
+        "StackId": STACK_ID, "StackName": "main", "StackStatus": status,
+        "CreationTime": "2026-01-01T00:00:00Z"}]}, {"StackName": "main"})
+
+
+@pytest.mark.parametrize("status, change_set_type", [
+    ("CREATE_COMPLETE", "UPDATE"),
+    ("UPDATE_ROLLBACK_COMPLETE", "UPDATE"),
+    ("REVIEW_IN_PROGRESS", "CREATE"),
+    ("DELETE_COMPLETE", None)])
+def test_change_set_type_follows_the_stack_status(cloudformation, status, change_set_type):
+    client, stubber = cloudformation
+    describe_stacks(stubber, status)
+    assert get_change_set_type(client, "main") == change_set_type
+
+
+@pytest.mark.parametrize("status", ["ROLLBACK_COMPLETE", "DELETE_FAILED", "UPDATE_ROLLBACK_FAILED",
+                                    "UPDATE_IN_PROGRESS", "CREATE_IN_PROGRESS"])
+def test_stacks_that_cannot_be_deployed_are_rejected(cloudformation, status):
+    client, stubber = cloudformation
+    describe_stacks(stubber, status)
+    with pytest.raises(StackOperationException) as error:
+        get_change_set_type(client, "main")
+    assert error.value.status == status
+
+
+def test_missing_stack_is_created(cloudformation):
+    client, stubber = cloudformation
+    stubber.add_client_error("describe_stacks", "ValidationError", "Stack with id main does not exist")
+    assert get_change_set_type(client, "main") is None
+
+
+def test_describe_errors_are_typed(cloudformation):
+    client, stubber = cloudformation
+    stubber.add_client_error("describe_stacks", "AccessDenied", "not allowed")
+    with pytest.raises(AWSCallException) as error:
+        get_change_set_type(client, "main")
+    assert (error.value.operation, error.value.code) == ("DescribeStacks", "AccessDenied")
+
+
+def test_stack_under_review_is_created_by_a_create_change_set(cloudformation):
+    client, stubber = cloudformation
+    stubber.add_response("create_change_set", {"Id": CHANGE_SET_ID, "StackId": STACK_ID},
+                         {"ChangeSetName": ANY, "ChangeSetType": "CREATE", "IncludeNestedStacks": True, **CONFIG})
+    stubber.add_response("describe_change_set", {"Status": "CREATE_COMPLETE", "StackName": "main", "Changes": []},
+                         {"ChangeSetName": CHANGE_SET_ID})
+    stubber.add_response("describe_change_set", {"Status": "CREATE_COMPLETE", "StackName": "main", "Changes": []},
+                         {"ChangeSetName": CHANGE_SET_ID})
+    stubber.add_response("describe_change_set", {"StackId": STACK_ID, "Changes": []},
+                         {"ChangeSetName": CHANGE_SET_ID})
+    stubber.add_response("execute_change_set", {}, {"ChangeSetName": CHANGE_SET_ID})
+
+    assert update_stack(client, CONFIG, execute=True, change_set_type="CREATE") == STACK_ID
+
+
+def test_empty_change_set_is_deleted(cloudformation):
+    client, stubber = cloudformation
+    stubber.add_response("create_change_set", {"Id": CHANGE_SET_ID, "StackId": STACK_ID},
+                         {"ChangeSetName": ANY, "ChangeSetType": "UPDATE", "IncludeNestedStacks": True, **CONFIG})
+    stubber.add_response("describe_change_set", {
+        "Status": "FAILED", "StatusReason": "The submitted information didn't contain changes."},
+        {"ChangeSetName": CHANGE_SET_ID})
+    stubber.add_response("delete_change_set", {}, {"ChangeSetName": CHANGE_SET_ID})
+
+    assert update_stack(client, CONFIG, execute=True) is None
+
+
+NESTED_STACK_ID = "arn:aws:cloudformation:us-east-1:123456789012:stack/main-Network-1/2"
+
+
+def stack_event(event_id, stack_id, logical_id, status, timestamp, physical_id=None,
+                resource_type="AWS::CloudFormation::Stack"):
+    return {"EventId": event_id, "StackId": stack_id, "StackName": stack_id.split("/")[1],
+            "LogicalResourceId": logical_id, "PhysicalResourceId": physical_id or stack_id,
+            "ResourceType": resource_type, "ResourceStatus": status, "Timestamp": timestamp}
+
+
+class ScriptedEvents:
+    """describe_stack_events paginator replaying one scripted answer per poll of each stack, newest first."""
+
+    def __init__(self, script):
+        self.script = script
+        self.polls = {stack_id: 0 for stack_id in script}
+
+    def get_paginator(self, operation):
+        assert operation == "describe_stack_events"
+        return self
+
+    def paginate(self, StackName):
+        answer = self.script[StackName][self.polls[StackName]]
+        self.polls[StackName] += 1
+        if(isinstance(answer, Exception)): raise answer
+        return [{"StackEvents": answer}]
+
+
+def throttled():
+    return ClientError({"Error": {"Code": "Throttling", "Message": "Rate exceeded"}}, "DescribeStackEvents")
+
+
+def test_wait_for_stack_follows_nested_stacks_through_throttling():
+    start = datetime.now(timezone.utc)
+    at = lambda seconds: start + timedelta(seconds=seconds)
+    root_started = stack_event("main-1", STACK_ID, "main", "CREATE_IN_PROGRESS", at(0))
+    nested_started = stack_event("main-2", STACK_ID, "Network", "CREATE_IN_PROGRESS", at(1), NESTED_STACK_ID)
+    client = ScriptedEvents({
+        STACK_ID: [
+            [nested_started, root_started],
+            throttled(),
+            [stack_event("main-4", STACK_ID, "main", "CREATE_COMPLETE", at(60)),
+             stack_event("main-3", STACK_ID, "Network", "CREATE_COMPLETE", at(50), NESTED_STACK_ID),
+             nested_started, root_started]],
+        NESTED_STACK_ID: [
+            [stack_event("network-3", NESTED_STACK_ID, "main-Network-1", "CREATE_COMPLETE", at(45)),
+             stack_event("network-2", NESTED_STACK_ID, "Vpc", "CREATE_COMPLETE", at(30), "vpc-1", "AWS::EC2::VPC"),
+             stack_event("network-1", NESTED_STACK_ID, "main-Network-1", "CREATE_IN_PROGRESS", at(2))]]})
+
+    report = wait_for_stack(client, STACK_ID, min_delay=0.0, max_delay=0.0)
+
+    assert report == {"main": {"status": "CREATE_COMPLETE", "duration": 60.0},
+                      "Network": {"status": "CREATE_COMPLETE", "duration": 43.0}}
+    # the finished nested stack is not polled again
+    assert client.polls == {STACK_ID: 3, NESTED_STACK_ID: 1}
+
+
+def test_wait_for_stack_raises_on_a_failed_stack():
+    start = datetime.now(timezone.utc)
+    client = ScriptedEvents({STACK_ID: [[
+        stack_event("main-2", STACK_ID, "main", "ROLLBACK_COMPLETE", start + timedelta(seconds=5)),
+        stack_event("main-1", STACK_ID, "main", "CREATE_IN_PROGRESS", start)]]})
+    with pytest.raises(StackOperationException) as error:
+        wait_for_stack(client, STACK_ID, min_delay=0.0, max_delay=0.0)
+    assert error.value.status == "ROLLBACK_COMPLETE"
+
+
+def test_poll_delay_backs_off_and_resets_on_new_events(cloudformation):
+    client, stubber = cloudformation
+    since = datetime.now(timezone.utc)
+    state = new_stack_state(STACK_ID, "main")
+    stubber.add_client_error("describe_stack_events", "Throttling", "Rate exceeded")
+    stubber.add_response("describe_stack_events", {"StackEvents": []}, {"StackName": STACK_ID})
+    stubber.add_response("describe_stack_events", {"StackEvents": [
+        stack_event("main-1", STACK_ID, "main", "CREATE_IN_PROGRESS", since)]}, {"StackName": STACK_ID})
+    stubber.add_response("describe_stack_events", {"StackEvents": [
+        stack_event("main-1", STACK_ID, "main", "CREATE_IN_PROGRESS", since)]}, {"StackName": STACK_ID})
+
+    delays = []
+    for _ in range(4):
+        events = poll_stack(client, state, since, min_delay=2.0, max_delay=5.0)
+        delays.append((len(events), state["delay"]))
+    # throttled doubles, nothing new grows by half up to max_delay, new events reset, seen events are skipped
+    assert delays == [(0, 4.0), (0, 5.0), (1, 2.0), (0, 3.0)]
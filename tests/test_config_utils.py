@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from utils import config_utils
+from utils.config_utils import compile_configs
+from utils.exceptions import ConfigException
+
+
+@pytest.fixture(autouse=True)
+def config_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(config_utils, "CONFIG_CACHE_DIR", str(tmp_path / "cache"))
+
+
+def write_config(tmp_path, text, name="config.yaml"):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_user_config_is_merged_over_the_default(tmp_path):
+    path = write_config(tmp_path, "project:\n  environment:\n    name: prod\n"
+                                  "cloudformation:\n  Parameters:\n    KeyName: admin\n    SubnetIds: [a, b]\n")
+    [config] = compile_configs([path])
+
+    assert config["project"]["name"] == "my-project"
+    assert config["project"]["environment"] == {"name": "prod", "region": "us-east-1"}
+    assert config["cloudformation"]["Parameters"] == (
+        {"ParameterKey": "KeyName", "ParameterValue": "admin"},
+        {"ParameterKey": "SubnetIds", "ParameterValue": "a,b"})
+
+
+def test_matrix_expands_into_one_config_per_entry(tmp_path):
+    path = write_config(tmp_path, "matrix:\n"
+                                  "  - project: {environment: {name: dev}}\n"
+                                  "  - project: {environment: {name: prod, region: eu-west-1}}\n")
+    configs = compile_configs([path])
+
+    assert [(c["project"]["environment"]["name"], c["project"]["environment"]["region"]) for c in configs] == \
+        [("dev", "us-east-1"), ("prod", "eu-west-1")]
+    assert all("matrix" not in config for config in configs)
+
+
+def test_every_invalid_deployment_is_reported(tmp_path):
+    path = write_config(tmp_path, "matrix:\n"
+                                  "  - project: {environment: {name: 1}}\n"
+                                  "  - cloudformation: {StackNme: main}\n"
+                                  "  - cloudformation: {Parameters: {Subnets: {a: b}}}\n")
+    with pytest.raises(ConfigException) as error:
+        compile_configs([path])
+
+    assert [e.split(": ", 1)[1] for e in error.value.errors] == [
+        "project.environment.name: expected str, got int",
+        "cloudformation.StackNme: unknown key, expected one of StackName, TemplateURL, Capabilities, Parameters",
+        "cloudformation.Parameters.Subnets: expected a scalar or a list, got dict"]
+    assert "(deployment 2)" in error.value.errors[2]
+
+
+def test_compiled_configs_are_read_only(tmp_path):
+    [config] = compile_configs([write_config(tmp_path, "{}")])
+
+    with pytest.raises(TypeError):
+        config["project"]["name"] = "other"
+    with pytest.raises(TypeError):
+        config["cloudformation"].update(StackName="other")
+    assert isinstance(config["cloudformation"]["Capabilities"], tuple)
+
+
+def test_unchanged_configs_are_loaded_from_the_cache(monkeypatch, tmp_path):
+    path = write_config(tmp_path, "project:\n  name: cached\n")
+    compiled = compile_configs([path])
+
+    def load_yaml(path):
+        raise AssertionError(f"{path} parsed again")
+
+    with monkeypatch.context() as m:
+        m.setattr(config_utils, "load_yaml", load_yaml)
+        assert compile_configs([path]) == compiled
+
+    write_config(tmp_path, "project:\n  name: edited\n")
+    assert compile_configs([path])[0]["project"]["name"] == "edited"
+
+
+def test_cache_is_plain_json(tmp_path):
+    path = write_config(tmp_path, "project:\n  name: cached\n")
+    compiled = compile_configs([path])
+
+    [cache_file] = (tmp_path / "cache").iterdir()
+    assert cache_file.suffix == ".json"
+    assert json.loads(cache_file.read_text())[0]["project"]["name"] == "cached"
+    assert compile_configs([path]) == compiled
@@ -0,0 +1,186 @@
+import collections
+import hashlib
+
+import pg8000.native
+import pytest
+
+INIT_MIGRATION = """
+DO $$
+BEGIN
+CREATE USER kc;
+EXCEPTION WHEN duplicate_object THEN NULL;
+END
+$$;
+SELECT 'CREATE DATABASE kc'
+WHERE NOT EXISTS (SELECT FROM pg_database WHERE datname = 'kc')\\gexec
+GRANT rds_iam TO kc;
+\\c kc
+CREATE SCHEMA IF NOT EXISTS kc AUTHORIZATION kc;
+"""
+TABLE_MIGRATION = "CREATE TABLE t (id int);\nINSERT INTO t VALUES (1);\n"
+
+
+class FakeServer:
+    """Just enough of a PostgreSQL server for the migration ledger: databases, transactions and the lock."""
+
+    def __init__(self):
+        self.databases = {"postgres"}
+        self.ledger = None
+        self.lock_holder = None
+        self.fail_on = None
+        self.log = []
+
+
+class FakeConnection:
+    def __init__(self, server, database):
+        self.server = server
+        self.database = database
+        self.notices = collections.deque()
+        self.row_count = -1
+        self.transaction = None
+        self.closed = False
+
+    def error(self, code, message):
+        return pg8000.native.DatabaseError({"C": code, "M": message})
+
+    def apply(self, action):
+        if(self.transaction is None): action()
+        else: self.transaction.append(action)
+
+    def run(self, sql, **params):
+        server = self.server
+        server.log.append((self, sql))
+        if(self.closed): raise pg8000.native.InterfaceError("connection is closed")
+        if(sql == "BEGIN"):
+            self.transaction = []
+        elif(sql == "COMMIT"):
+            for action in self.transaction: action()
+            self.transaction = None
+        elif(sql == "ROLLBACK"):
+            self.transaction = None
+        elif(server.fail_on is not None and server.fail_on in sql):
+            raise self.error("42000", f"failing on {server.fail_on}")
+        elif(sql.startswith("SELECT pg_advisory_lock")):
+            assert server.lock_holder is None
+            server.lock_holder = self
+        elif(sql.startswith("SELECT pg_advisory_unlock")):
+            assert server.lock_holder is self, "unlocked by another session than the one holding the lock"
+            server.lock_holder = None
+        elif(sql.startswith("CREATE TABLE IF NOT EXISTS public.schema_migrations")):
+            assert server.lock_holder is self, "ledger created without holding the lock"
+            if(server.ledger is None): server.ledger = {}
+        elif(sql.startswith("SELECT version, checksum")):
+            if(server.ledger is None): raise self.error("42P01", "relation does not exist")
+            return [[version, checksum] for version, checksum in server.ledger.items()]
+        elif(sql.startswith("INSERT INTO public.schema_migrations")):
+            self.apply(lambda: server.ledger.__setitem__(params["version"], params["checksum"]))
+        elif(sql.startswith("SELECT 'CREATE DATABASE")):
+            return [] if "kc" in server.databases else [["CREATE DATABASE kc"]]
+        elif(sql.startswith("CREATE DATABASE")):
+            if(self.transaction is not None): raise self.error("25001", "cannot run inside a transaction block")
+            server.databases.add(sql.split()[2])
+        return []
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def server(dbbootstrap, monkeypatch):
+    server = FakeServer()
+
+    def connect(database, **kwargs):
+        if(database not in server.databases): raise server.error("3D000", f"database {database} does not exist")
+        return FakeConnection(server, database)
+
+    monkeypatch.setattr(dbbootstrap, "DB_SSLMODE", "disable")
+    monkeypatch.setattr(dbbootstrap.pg8000.native, "Connection", connect)
+    monkeypatch.setattr(dbbootstrap, "connections", {})
+    return server
+
+
+def write_migrations(tmp_path, scripts):
+    migrations = []
+    for version, (description, content) in enumerate(scripts, start=1):
+        path = tmp_path / f"V{version:04d}__{description}.sql"
+        path.write_text(content)
+        migrations.append((version, description, str(path)))
+    return migrations
+
+
+def checksum(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def test_pending_migrations_skip_applied_ones_and_reject_modified_ones(dbbootstrap, tmp_path):
+    migrations = write_migrations(tmp_path, [("init", INIT_MIGRATION), ("table", TABLE_MIGRATION)])
+    pending = dbbootstrap.get_pending_migrations(migrations, {1: checksum(INIT_MIGRATION)})
+    assert [(version, description) for version, description, _, _ in pending] == [(2, "table")]
+
+    with pytest.raises(dbbootstrap.MigrationChecksumException):
+        dbbootstrap.get_pending_migrations(migrations, {1: checksum("modified")})
+
+
+def test_migrations_are_applied_once_under_the_lock(dbbootstrap, server, tmp_path):
+    migrations = write_migrations(tmp_path, [("init", INIT_MIGRATION), ("table", TABLE_MIGRATION)])
+    dbbootstrap.apply_migrations(migrations, "password", None, {})
+
+    assert server.ledger == {1: checksum(INIT_MIGRATION), 2: checksum(TABLE_MIGRATION)}
+    assert server.databases == {"postgres", "kc"}
+    assert server.lock_holder is None
+
+    server.log.clear()
+    response = dbbootstrap.apply_migrations(migrations, "password", None, {})
+    assert response["Data"] == "\nNo pending SQL migrations."
+    # nothing pending costs one check of each cached connection and the ledger read, no lock
+    assert [sql for _, sql in server.log] == ["SELECT 1", "SELECT 1",
+                                              "SELECT version, checksum FROM public.schema_migrations"]
+
+
+def test_missing_ledger_is_only_created_under_the_lock(dbbootstrap, server):
+    connection = FakeConnection(server, "postgres")
+    assert dbbootstrap.get_applied_migrations(connection) == {}
+    assert server.ledger is None
+
+
+def test_transactional_migration_and_its_ledger_row_commit_together(dbbootstrap, server, tmp_path):
+    migrations = write_migrations(tmp_path, [("table", TABLE_MIGRATION)])
+    dbbootstrap.apply_migrations(migrations, "password", None, {})
+
+    statements = [sql.split()[0] for _, sql in server.log]
+    begin = statements.index("BEGIN", statements.index("CREATE"))
+    assert statements[begin:] == ["BEGIN", "CREATE", "INSERT", "INSERT", "COMMIT", "SELECT"]
+
+
+def test_failed_migration_leaves_no_ledger_row_and_can_run_again(dbbootstrap, server, tmp_path):
+    migrations = write_migrations(tmp_path, [("init", INIT_MIGRATION)])
+    server.fail_on = "GRANT rds_iam"
+    with pytest.raises(dbbootstrap.ExecuteSQLScriptException):
+        dbbootstrap.apply_migrations(migrations, "password", None, {})
+    # CREATE DATABASE cannot be rolled back, the ledger row is
+    assert server.databases == {"postgres", "kc"}
+    assert server.ledger == {}
+    assert server.lock_holder is None
+
+    server.fail_on = None
+    dbbootstrap.apply_migrations(migrations, "password", None, {})
+    assert server.ledger == {1: checksum(INIT_MIGRATION)}
+
+
+def test_create_database_never_runs_in_a_transaction(dbbootstrap, server, tmp_path):
+    migrations = write_migrations(tmp_path, [("init", INIT_MIGRATION)])
+    # the fake server refuses CREATE DATABASE in a transaction block, as PostgreSQL does
+    dbbootstrap.apply_migrations(migrations, "password", None, {})
+    assert len([sql for _, sql in server.log if sql.startswith("CREATE DATABASE")]) == 1
+
+
+def test_stale_connections_are_replaced_once_per_invocation(dbbootstrap, server, tmp_path):
+    migrations = write_migrations(tmp_path, [("table", TABLE_MIGRATION)])
+    dbbootstrap.apply_migrations(migrations, "password", None, {})
+    stale = dbbootstrap.connections["postgres"]
+    stale.close()
+
+    dbbootstrap.apply_migrations(migrations, "password", None, {})
+    assert dbbootstrap.connections["postgres"] is not stale
+    checks = [sql for _, sql in server.log if sql == "SELECT 1"]
+    assert len(checks) == 1
@@ -0,0 +1,75 @@
+import json
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+SECRET_ARN = "arn:aws:secretsmanager:us-east-1:000000000000:secret:test"
+
+
+@pytest.fixture
+def cold_cache(dbbootstrap, monkeypatch):
+    """An empty cache, as on the first invocation of a container."""
+    monkeypatch.setattr(dbbootstrap, "cache", type(dbbootstrap.cache)())
+    return dbbootstrap.cache
+
+
+def test_secret_is_fetched_once_per_container(dbbootstrap, cold_cache, monkeypatch):
+    client = boto3.client("secretsmanager", region_name="us-east-1")
+    monkeypatch.setattr(dbbootstrap, "secrets_client", client)
+    with Stubber(client) as stubber:
+        # a single response, a second call to the service would fail the stubber
+        stubber.add_response("get_secret_value", {"SecretString": json.dumps({"password": "secret"})},
+                             {"SecretId": SECRET_ARN})
+        assert dbbootstrap.get_secret(SECRET_ARN, "us-east-1") == "secret"
+        assert dbbootstrap.get_secret(SECRET_ARN, "us-east-1") == "secret"
+        stubber.assert_no_pending_responses()
+    assert (cold_cache.hits, cold_cache.misses) == (1, 1)
+
+
+def test_sql_script_is_downloaded_again_only_when_changed(dbbootstrap, cold_cache, s3_client, bucket_name,
+                                                          tmp_path, monkeypatch):
+    requests = []
+    monkeypatch.setattr(dbbootstrap, "s3_client", s3_client)
+    s3_client.meta.events.register("before-call.s3.GetObject", lambda params, **kwargs: requests.append(params))
+    local_filepath = str(tmp_path / "sql" / "V0001__init.sql")
+
+    s3_client.put_object(Bucket=bucket_name, Key="sql/V0001__init.sql", Body=b"CREATE TABLE a();")
+    dbbootstrap.get_sql_script_from_s3(bucket_name, "sql/V0001__init.sql", local_filepath)
+    dbbootstrap.get_sql_script_from_s3(bucket_name, "sql/V0001__init.sql", local_filepath)
+    assert [request["headers"].get("If-None-Match") for request in requests] == [None, cold_cache.get(
+        ("sql_etag", bucket_name, "sql/V0001__init.sql", local_filepath))]
+
+    s3_client.put_object(Bucket=bucket_name, Key="sql/V0001__init.sql", Body=b"CREATE TABLE b();")
+    dbbootstrap.get_sql_script_from_s3(bucket_name, "sql/V0001__init.sql", local_filepath)
+    with open(local_filepath) as sql_file:
+        assert sql_file.read() == "CREATE TABLE b();"
+
+
+def test_missing_sql_script_is_downloaded_again(dbbootstrap, cold_cache, s3_client, bucket_name, tmp_path,
+                                                monkeypatch):
+    monkeypatch.setattr(dbbootstrap, "s3_client", s3_client)
+    local_filepath = tmp_path / "V0001__init.sql"
+    s3_client.put_object(Bucket=bucket_name, Key="sql/V0001__init.sql", Body=b"SELECT 1;")
+    dbbootstrap.get_sql_script_from_s3(bucket_name, "sql/V0001__init.sql", str(local_filepath))
+    local_filepath.unlink()
+    dbbootstrap.get_sql_script_from_s3(bucket_name, "sql/V0001__init.sql", str(local_filepath))
+    assert local_filepath.read_text() == "SELECT 1;"
+
+
+def test_certificates_are_downloaded_once_per_container(dbbootstrap, cold_cache, tmp_path):
+    bundle = tmp_path / "bundle.pem"
+    bundle.write_text("certificate")
+    certs_filepath = str(tmp_path / "global-bundle.pem")
+
+    dbbootstrap.get_global_certificates(bundle.as_uri(), certs_filepath)
+    bundle.write_text("rotated")
+    dbbootstrap.get_global_certificates(bundle.as_uri(), certs_filepath)
+    with open(certs_filepath) as cert_file:
+        assert cert_file.read() == "certificate"
+    assert (cold_cache.hits, cold_cache.misses) == (1, 1)
+
+
+def test_unreachable_certificates_raise(dbbootstrap, cold_cache, tmp_path):
+    with pytest.raises(dbbootstrap.GetGlobalCertificatesException):
+        dbbootstrap.get_global_certificates((tmp_path / "missing.pem").as_uri(), str(tmp_path / "bundle.pem"))
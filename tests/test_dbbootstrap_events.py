@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+CLUSTER = "aurora-cluster"
+
+
+def sns_record(message_id, event_id, event_time, attribute=True, source=CLUSTER):
+    message = {"Event Source": "db-cluster", "Event Time": event_time, "Source ID": source,
+               "Event ID": f"http://docs.amazonwebservices.com/AmazonRDS/latest/UserGuide/USER_Events.html#{event_id}"}
+    return {"Sns": {
+        "MessageId": message_id,
+        "Timestamp": "2026-01-01T00:00:00.000Z",
+        "Message": json.dumps(message),
+        "MessageAttributes": {"EventID": {"Type": "String", "Value": event_id}} if attribute else {}
+    }}
+
+
+@pytest.fixture
+def bootstraps(dbbootstrap, monkeypatch):
+    """Bootstraps run by the handler, on a cold container whose migrations are stubbed out."""
+    bootstraps = []
+
+    def apply_migrations(migrations, dbpass, certs_filepath, responseData):
+        bootstraps.append(migrations)
+        responseData["Data"] = "applied"
+        return responseData
+
+    monkeypatch.setattr(dbbootstrap, "cache", type(dbbootstrap.cache)())
+    monkeypatch.setattr(dbbootstrap, "DB_SSLMODE", "disable")
+    monkeypatch.setattr(dbbootstrap, "get_secret", lambda secret_arn, region_name: "password")
+    monkeypatch.setattr(dbbootstrap, "get_migrations_from_s3", lambda bucket, prefix, local_dir: ["V0001"])
+    monkeypatch.setattr(dbbootstrap, "apply_migrations", apply_migrations)
+    return bootstraps
+
+
+def statuses(response):
+    return {record["MessageId"]: record["Status"] for record in response["Records"]}
+
+
+def test_batch_is_bootstrapped_once_per_cluster(dbbootstrap, bootstraps):
+    response = dbbootstrap.handler({"Records": [
+        sns_record("started-1", "RDS-EVENT-0088", "2026-01-01 00:00:00.000"),
+        # the message link carries the event id when the attribute is missing
+        sns_record("started-2", "RDS-EVENT-0088", "2026-01-01 00:01:00.000", attribute=False),
+        sns_record("stopped", "RDS-EVENT-0087", "2026-01-01 00:02:00.000"),
+        {"Sns": {"MessageId": "garbage", "Message": "not json"}}
+    ]}, None)
+
+    assert len(bootstraps) == 1
+    assert statuses(response) == {"started-1": "bootstrapped", "started-2": "duplicate", "stopped": "ignored",
+                                  "garbage": "invalid"}
+
+
+def test_warm_container_skips_starts_within_the_window(dbbootstrap, bootstraps):
+    dbbootstrap.handler({"Records": [sns_record("first", "RDS-EVENT-0088", "2026-01-01 00:00:00.000")]}, None)
+    response = dbbootstrap.handler({"Records": [
+        sns_record("replica", "RDS-EVENT-0088", "2026-01-01 00:04:00.000")]}, None)
+    assert statuses(response) == {"replica": "duplicate"}
+    assert "No instance started event" in response["Data"]
+
+    response = dbbootstrap.handler({"Records": [
+        sns_record("restart", "RDS-EVENT-0088", "2026-01-01 01:00:00.000")]}, None)
+    assert statuses(response) == {"restart": "bootstrapped"}
+    assert len(bootstraps) == 2
+
+
+def test_failed_bootstrap_is_retried_by_the_next_event(dbbootstrap, bootstraps, monkeypatch):
+    def failing_apply_migrations(migrations, dbpass, certs_filepath, responseData):
+        raise dbbootstrap.ExecuteSQLScriptException("migration failed")
+
+    with monkeypatch.context() as m:
+        m.setattr(dbbootstrap, "apply_migrations", failing_apply_migrations)
+        with pytest.raises(SystemExit):
+            dbbootstrap.handler({"Records": [sns_record("first", "RDS-EVENT-0088", "2026-01-01 00:00:00.000")]},
+                                None)
+
+    response = dbbootstrap.handler({"Records": [
+        sns_record("retry", "RDS-EVENT-0088", "2026-01-01 00:01:00.000")]}, None)
+    assert statuses(response) == {"retry": "bootstrapped"}
+    assert len(bootstraps) == 1
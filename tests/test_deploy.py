@@ -0,0 +1,193 @@
+import pytest
+
+import main
+from utils import config_utils
+from utils.aws_call_utils import AWSCallLayer
+from utils.config_utils import compile_configs, freeze, merge_configs, parse_args
+from utils.plan_utils import PlanBackend
+
+ENVIRONMENTS = """
+matrix:
+  - project: {environment: {name: dev, region: us-east-1}}
+    cloudformation: {StackName: dev}
+  - project: {environment: {name: dev, region: eu-west-1}}
+    cloudformation: {StackName: dev}
+  - project: {environment: {name: prod, region: us-east-1}}
+    cloudformation: {StackName: prod}
+"""
+
+
+@pytest.fixture
+def plan(monkeypatch, tmp_path):
+    """Plan backend deployments, with the local state, config cache and SSH keys under tmp_path."""
+    monkeypatch.setattr(config_utils, "CONFIG_CACHE_DIR", str(tmp_path / "config"))
+    monkeypatch.setattr(main, "PLAN_STATE_DIR", str(tmp_path / "state"))
+    monkeypatch.setenv("HOME", str(tmp_path))
+    keys = []
+
+    def generate_key(key_path):
+        keys.append(key_path)
+        for path in (key_path, key_path + ".pub"):
+            with open(path, "w") as f:
+                f.write("key")
+        return key_path
+
+    monkeypatch.setattr(main, "generate_key", generate_key)
+    (tmp_path / ".ssh").mkdir()
+    return keys
+
+
+def compile_deployments(tmp_path, text, *argv):
+    path = tmp_path / "config.yaml"
+    path.write_text(text)
+    args = parse_args(["-c", str(path), "--plan", *argv])
+    return [freeze(merge_configs(config, {"args": args})) for config in compile_configs([str(path)])]
+
+
+def run_plan(configs):
+    backend = PlanBackend()
+    aws = AWSCallLayer(configs[0]["deployment"]["aws"], backend=backend)
+    return main.deploy(configs, aws, backend), aws.stats.calls
+
+
+def created_stacks(calls):
+    """Name and bucket of the stacks created by the recorded calls."""
+    return sorted((call["params"]["StackName"], call["params"]["TemplateURL"].split("/")[3])
+                  for call in calls if call["operation"] == "CreateStack")
+
+
+def test_environments_are_deployed_concurrently(plan, tmp_path):
+    report, calls = run_plan(compile_deployments(tmp_path, ENVIRONMENTS))
+
+    assert {name: entry["status"] for name, entry in report.items()} == {
+        "prepare": "succeeded", "my-project-dev-us-east-1": "succeeded", "my-project-dev-eu-west-1": "succeeded",
+        "my-project-prod-us-east-1": "succeeded"}
+    assert created_stacks(calls) == [("dev", "k8s-my-project-dev-eu-west-1-000000000000"),
+                                     ("dev", "k8s-my-project-dev-us-east-1-000000000000"),
+                                     ("prod", "k8s-my-project-prod-us-east-1-000000000000")]
+    # the regions of an environment share its key, generated once before the deployments
+    assert plan == [str(tmp_path / ".ssh" / "my-project-dev"), str(tmp_path / ".ssh" / "my-project-prod")]
+
+
+def test_environments_sharing_a_stack_are_rejected(plan, tmp_path):
+    configs = compile_deployments(tmp_path, "matrix:\n"
+                                            "  - project: {environment: {name: dev}}\n"
+                                            "  - project: {environment: {name: prod}}\n")
+    with pytest.raises(ValueError, match=r"us-east-1/main"):
+        run_plan(configs)
+
+
+def test_duplicate_deployments_are_rejected(plan, tmp_path):
+    configs = compile_deployments(tmp_path, "matrix:\n"
+                                            "  - cloudformation: {StackName: a}\n"
+                                            "  - cloudformation: {StackName: b}\n")
+    with pytest.raises(ValueError, match="my-project-dev-us-east-1"):
+        run_plan(configs)
+
+
+def test_failed_environment_does_not_stop_the_others(plan, tmp_path, monkeypatch):
+    from utils import aws_utils
+
+    create_s3_bucket = aws_utils.create_s3_bucket
+
+    def failing_create_s3_bucket(client, bucket_name, region):
+        if(region == "eu-west-1"): raise RuntimeError("bucket quota")
+        return create_s3_bucket(client, bucket_name, region)
+
+    monkeypatch.setattr(aws_utils, "create_s3_bucket", failing_create_s3_bucket)
+    report, calls = run_plan(compile_deployments(tmp_path, ENVIRONMENTS))
+
+    assert report["my-project-dev-eu-west-1"]["status"] == "failed"
+    assert "bucket quota" in report["my-project-dev-eu-west-1"]["error"]
+    assert report["my-project-dev-us-east-1"]["status"] == "succeeded"
+    assert report["my-project-prod-us-east-1"]["status"] == "succeeded"
+    assert [stack for stack, bucket in created_stacks(calls)] == ["dev", "prod"]
+
+
+@pytest.fixture
+def moto_account(plan, monkeypatch):
+    """AWS calls answered by moto, stacks only recorded as moto cannot create the nested stacks."""
+    from moto import mock_cloudformation, mock_ecr, mock_s3, mock_secretsmanager, mock_sts
+    from utils import aws_utils
+
+    stacks = []
+
+    def create_stack(client, config):
+        stacks.append({parameter["ParameterKey"]: parameter["ParameterValue"] for parameter in config["Parameters"]})
+        return f"arn:aws:cloudformation:us-east-1:123456789012:stack/{config['StackName']}/{len(stacks)}"
+
+    monkeypatch.setattr(aws_utils, "create_stack", create_stack)
+    with mock_sts(), mock_s3(), mock_ecr(), mock_secretsmanager(), mock_cloudformation():
+        yield stacks
+
+
+def run_against_moto(configs):
+    backend = PlanBackend(answer_aws=False)
+    aws = AWSCallLayer(configs[0]["deployment"]["aws"], backend=backend)
+    return main.deploy(configs, aws, backend), aws.stats.calls
+
+
+def test_rollback_deploys_the_bundles_and_image_of_the_release(moto_account, tmp_path, monkeypatch):
+    from utils import aws_utils, docker_utils
+
+    deployment = "deployment: {stack: {wait: false}}\n"
+    report, _ = run_against_moto(compile_deployments(tmp_path, deployment))
+    assert report["my-project-dev-us-east-1"]["status"] == "succeeded"
+    [published] = moto_account
+    release_id = published["ReleasePrefix"].split("/")[1]
+
+    # a newer checkout with another Lambda image
+    monkeypatch.setattr(docker_utils, "compute_build_context_hash", lambda dockerfile: "newer")
+    monkeypatch.setattr(aws_utils, "compute_build_context_hash", lambda dockerfile: "newer")
+    report, calls = run_against_moto(compile_deployments(tmp_path, deployment, "--release", release_id))
+
+    assert report["my-project-dev-us-east-1"]["status"] == "succeeded"
+    assert moto_account[1] == published
+    # nothing but the SSH key is uploaded or pushed
+    assert [call["params"]["Key"] for call in calls if call["operation"] == "PutObject"] == ["ssh/client-key.pub"]
+    assert not any(call["service"] == "docker" for call in calls)
+
+
+def test_rollback_to_a_release_without_recorded_bundles_fails(moto_account, tmp_path):
+    import boto3
+
+    s3 = boto3.client("s3", region_name="us-east-1")
+    bucket_name = "k8s-my-project-dev-us-east-1-123456789012"
+    s3.create_bucket(Bucket=bucket_name)
+    s3.put_object(Bucket=bucket_name, Key="releases/old/manifest.json", Body=b'{"release": "old", "files": []}')
+    report, _ = run_against_moto(compile_deployments(tmp_path, "deployment: {stack: {wait: false}}\n",
+                                                     "--release", "old"))
+
+    assert report["my-project-dev-us-east-1"]["status"] == "failed"
+    assert "does not record its bundle keys and image" in report["my-project-dev-us-east-1"]["error"]
+    assert moto_account == []
+
+
+def test_rollback_checks_the_parameters_against_the_released_template(moto_account, tmp_path):
+    import boto3
+
+    deployment = "deployment: {stack: {wait: false}}\n"
+    run_against_moto(compile_deployments(tmp_path, deployment))
+    release_id = moto_account[0]["ReleasePrefix"].split("/")[1]
+    # the released root template predates the worker bundle
+    s3 = boto3.client("s3", region_name="us-east-1")
+    bucket_name = "k8s-my-project-dev-us-east-1-123456789012"
+    key = f"releases/{release_id}/cf_templates/main.yaml"
+    template = s3.get_object(Bucket=bucket_name, Key=key)["Body"].read().decode()
+    s3.put_object(Bucket=bucket_name, Key=key, Body=template.replace("WorkerBundleS3Key:", "OldWorkerKey:", 1))
+    report, _ = run_against_moto(compile_deployments(tmp_path, deployment, "--release", release_id))
+
+    assert report["my-project-dev-us-east-1"]["error"] == "ValueError('Invalid stack parameters for the root template.')"
+    assert len(moto_account) == 1
+
+
+def test_second_deployment_reuses_the_recorded_resources(plan, tmp_path):
+    creates = {"CreateBucket", "CreateRepository", "CreateSecret"}
+    environment = "cloudformation: {StackName: dev}\n"
+    _, calls = run_plan(compile_deployments(tmp_path, environment))
+    assert creates <= {call["operation"] for call in calls}
+
+    _, calls = run_plan(compile_deployments(tmp_path, environment))
+    assert creates.isdisjoint(call["operation"] for call in calls)
+    _, calls = run_plan(compile_deployments(tmp_path, environment, "--refresh"))
+    assert creates <= {call["operation"] for call in calls}
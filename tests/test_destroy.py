@@ -0,0 +1,72 @@
+import json
+
+import boto3
+import pytest
+from moto import mock_cloudformation, mock_ecr, mock_s3, mock_secretsmanager, mock_sts
+
+import main
+from utils.aws_call_utils import AWSCallLayer
+from utils.config_utils import freeze, get_keycloak_admin_secret_id, merge_configs, parse_args, parse_config
+
+ACCOUNT = "123456789012"
+TEMPLATE = json.dumps({"Resources": {"Topic": {"Type": "AWS::SNS::Topic"}}})
+
+
+@pytest.fixture
+def config(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "STATE_DIR", str(tmp_path / "state"))
+    config = merge_configs(parse_config(None), {"args": parse_args(["--destroy"])})
+    config["deployment"]["stack"]["min_poll_delay"] = 0.01
+    return freeze(config)
+
+
+@pytest.fixture
+def environment(config):
+    """Resources of a deployed environment, next to the secret of another environment of the region."""
+    with mock_sts(), mock_s3(), mock_ecr(), mock_secretsmanager(), mock_cloudformation():
+        s3 = boto3.client("s3", region_name="us-east-1")
+        bucket_name = main.get_bucket_name(config, ACCOUNT)
+        s3.create_bucket(Bucket=bucket_name)
+        s3.put_bucket_versioning(Bucket=bucket_name, VersioningConfiguration={"Status": "Enabled"})
+        for version in range(2):
+            for i in range(300):
+                s3.put_object(Bucket=bucket_name, Key=f"scripts/{i}", Body=str(version).encode())
+        s3.create_bucket(Bucket=main.get_keycloak_cache_bucket_name(config, ACCOUNT))
+        boto3.client("ecr", region_name="us-east-1").create_repository(repositoryName=main.get_repository_name(config))
+        secrets = boto3.client("secretsmanager", region_name="us-east-1")
+        secrets.create_secret(Name=get_keycloak_admin_secret_id(config), SecretString="admin")
+        secrets.create_secret(Name="my-project/prod/keycloak/admin/password", SecretString="admin")
+        boto3.client("cloudformation", region_name="us-east-1").create_stack(
+            StackName=config["cloudformation"]["StackName"], TemplateBody=TEMPLATE)
+        yield
+
+
+def test_destroy_deletes_the_stack_before_the_resources_it_uses(config, environment):
+    aws = AWSCallLayer(config["deployment"]["aws"])
+    main.destroy(config, aws)
+
+    s3 = boto3.client("s3", region_name="us-east-1")
+    assert s3.list_buckets()["Buckets"] == []
+    assert boto3.client("ecr", region_name="us-east-1").describe_repositories()["repositories"] == []
+    secrets = boto3.client("secretsmanager", region_name="us-east-1").list_secrets()["SecretList"]
+    # the other environments of the region keep their secret
+    assert [secret["Name"] for secret in secrets] == ["my-project/prod/keycloak/admin/password"]
+
+    calls = sorted(aws.stats.calls, key=lambda call: call["start"])
+    operations = [call["operation"] for call in calls]
+    stack_deleted = max(i for i, operation in enumerate(operations) if operation == "DescribeStackEvents")
+    assert operations.index("DeleteStack") < stack_deleted
+    assert all(operations.index(operation) > stack_deleted
+               for operation in ("ListObjectVersions", "DeleteBucket", "DeleteRepository", "DeleteSecret"))
+    # the 600 object versions of the project bucket fit one batch
+    assert operations.count("DeleteObjects") == 1
+
+
+def test_destroy_skips_missing_resources(config, environment):
+    main.destroy(config, AWSCallLayer(config["deployment"]["aws"]))
+    aws = AWSCallLayer(config["deployment"]["aws"])
+    main.destroy(config, aws)
+
+    assert all(call["error"] in (None, "ValidationError", "NoSuchBucket", "RepositoryNotFoundException",
+                                 "ResourceNotFoundException") for call in aws.stats.calls)
+    assert "DeleteStack" not in [call["operation"] for call in aws.stats.calls]
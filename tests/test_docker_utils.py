@@ -0,0 +1,120 @@
+import base64
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from utils import aws_utils
+from utils.docker_utils import compute_build_context_hash, follow_docker_stream
+from utils.exceptions import DockerException
+
+REGISTRY = "123456789012.dkr.ecr.us-east-1.amazonaws.com"
+REPOSITORY_URI = f"{REGISTRY}/lambda"
+
+PUSH_STREAM = [
+    {"status": "The push refers to repository [registry/lambda]"},
+    {"status": "Preparing", "progressDetail": {}, "id": "base"},
+    {"status": "Preparing", "progressDetail": {}, "id": "app"},
+    {"status": "Layer already exists", "progressDetail": {}, "id": "base"},
+    {"status": "Pushing", "progressDetail": {"current": 512, "total": 2048}, "id": "app"},
+    {"status": "Pushing", "progressDetail": {"current": 2048, "total": 2048}, "id": "app"},
+    {"status": "Pushed", "progressDetail": {}, "id": "app"},
+    {"status": "latest: digest: sha256:abc size: 739"}
+]
+
+
+def test_push_stream_keeps_the_last_status_and_bytes_of_each_layer():
+    state = follow_docker_stream(iter(PUSH_STREAM), "push", "registry/lambda:latest", interval=0.0)
+    assert state["layers"] == {"base": "Layer already exists", "app": "Pushed"}
+    assert state["bytes"] == 2048
+
+
+def test_build_stream_counts_steps_and_keeps_the_image_id():
+    stream = [{"stream": "Step 1/2 : FROM python:3.11\n"}, {"stream": " ---> 1234\n"},
+              {"stream": "Step 2/2 : COPY . .\n"}, {"aux": {"ID": "sha256:1234"}}]
+    state = follow_docker_stream(iter(stream), "build", "lambda:latest")
+    assert (state["steps"], state["image_id"]) == (2, "sha256:1234")
+
+
+def test_stream_errors_raise():
+    stream = PUSH_STREAM[:3] + [{"errorDetail": {"message": "denied: not authorized"}, "error": "denied"}]
+    with pytest.raises(DockerException) as error:
+        follow_docker_stream(iter(stream), "push", "registry/lambda:latest")
+    assert error.value.image == "registry/lambda:latest"
+
+
+def test_build_context_hash_follows_paths_and_contents(tmp_path):
+    (tmp_path / "Dockerfile").write_text("FROM python:3.11\n")
+    (tmp_path / "app.py").write_text("print(1)\n")
+    first = compute_build_context_hash(str(tmp_path))
+    assert compute_build_context_hash(str(tmp_path)) == first
+    (tmp_path / "app.py").rename(tmp_path / "main.py")
+    assert compute_build_context_hash(str(tmp_path)) != first
+
+
+@pytest.fixture
+def ecr(tmp_path, monkeypatch):
+    """Stubbed ECR client, with empty in-process and on-disk token caches."""
+    monkeypatch.setattr(aws_utils, "ECR_AUTH_CACHE_DIR", str(tmp_path / "ecr"))
+    monkeypatch.setattr(aws_utils, "ECR_AUTH_CACHE", {})
+    client = boto3.client("ecr", region_name="us-east-1")
+    with Stubber(client) as stubber:
+        yield client, stubber
+        stubber.assert_no_pending_responses()
+
+
+def authorization_token(stubber, password, expires_in):
+    stubber.add_response("get_authorization_token", {"authorizationData": [{
+        "authorizationToken": base64.b64encode(f"AWS:{password}".encode()).decode(),
+        "proxyEndpoint": f"https://{REGISTRY}",
+        "expiresAt": datetime.now(timezone.utc) + expires_in}]}, {})
+
+
+def test_ecr_token_is_shared_by_pushes_and_runs(ecr):
+    client, stubber = ecr
+    authorization_token(stubber, "first", timedelta(hours=12))
+    auth = aws_utils.get_ecr_auth_config(client, REGISTRY)
+    assert auth == {"username": "AWS", "password": "first", "serveraddress": f"https://{REGISTRY}"}
+    assert aws_utils.get_ecr_auth_config(client, REGISTRY) == auth
+    # a new run reads the token saved on disk
+    aws_utils.ECR_AUTH_CACHE.clear()
+    assert aws_utils.get_ecr_auth_config(client, REGISTRY) == auth
+
+
+def test_ecr_token_close_to_expiry_is_renewed(ecr):
+    client, stubber = ecr
+    authorization_token(stubber, "first", timedelta(minutes=5))
+    authorization_token(stubber, "second", timedelta(hours=12))
+    assert aws_utils.get_ecr_auth_config(client, REGISTRY)["password"] == "first"
+    assert aws_utils.get_ecr_auth_config(client, REGISTRY)["password"] == "second"
+
+
+class RejectingImages:
+    """Docker images API of a daemon whose pushes the registry rejects."""
+
+    def get(self, image_name):
+        return self
+
+    def tag(self, repository, tag):
+        pass
+
+    def push(self, repository, tag, stream, decode, auth_config):
+        return iter([{"errorDetail": {"message": "authorization token has expired"}}])
+
+
+class RejectingDocker:
+    images = RejectingImages()
+
+
+def test_rejected_push_forgets_the_token(ecr, tmp_path):
+    client, stubber = ecr
+    (tmp_path / "Dockerfile").write_text("FROM python:3.11\n")
+    stubber.add_client_error("describe_images", "ImageNotFoundException", "not found")
+    authorization_token(stubber, "revoked", timedelta(hours=12))
+
+    with pytest.raises(DockerException):
+        aws_utils.push_to_ecr(RejectingDocker(), client, str(tmp_path), "lambda", REPOSITORY_URI,
+                              local_image=lambda: "lambda:local")
+    assert aws_utils.ECR_AUTH_CACHE == {}
+    assert aws_utils.load_ecr_auth(REGISTRY) is None
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta, timezone
+
+from lambda_benchmark import (DUPLICATE_EVENT_WINDOW, check_budgets, create_sns_event, get_reports, percentile,
+                              summarize)
+
+EMULATOR_LOGS = b"""START RequestId: 1 Version: $LATEST
+REPORT RequestId: 1\tInit Duration: 812.50 ms\tDuration: 1530.20 ms\tBilled Duration: 1531 ms
+START RequestId: 2 Version: $LATEST
+REPORT RequestId: 2\tDuration: 41.75 ms\tBilled Duration: 42 ms
+"""
+
+
+class LoggedContainer:
+    def logs(self):
+        return EMULATOR_LOGS
+
+
+def test_percentiles_use_the_nearest_rank():
+    values = [float(value) for value in range(1, 21)]
+    assert (percentile(values, 50), percentile(values, 95)) == (10.0, 19.0)
+    assert summarize([]) == {"p50": None, "p95": None, "min": None, "max": None, "count": 0}
+
+
+def test_emulator_reports_give_init_and_handler_durations():
+    assert get_reports(LoggedContainer()) == [{"init": 812.5, "duration": 1530.2},
+                                              {"init": None, "duration": 41.75}]
+
+
+def test_only_metrics_over_budget_fail():
+    report = {"image": {"size_mb": 650.0}, "cold": {"init_ms": summarize([900.0]), "latency_ms": summarize([3500.0])},
+              "warm": {"latency_ms": summarize([])}}
+    budgets = {"budget_image_mb": 700.0, "budget_init_ms": 1500.0, "budget_cold_ms": 3000.0, "budget_warm_ms": 300.0}
+    assert check_budgets(report, budgets) == ["The p95 cold latency is 3500.0ms, over the budget of 3000ms"]
+
+
+def test_synthetic_events_run_the_whole_bootstrap_each_time(dbbootstrap, monkeypatch):
+    bootstraps = []
+    monkeypatch.setattr(dbbootstrap, "cache", type(dbbootstrap.cache)())
+    monkeypatch.setattr(dbbootstrap, "DB_SSLMODE", "disable")
+    monkeypatch.setattr(dbbootstrap, "get_secret", lambda secret_arn, region_name: "password")
+    monkeypatch.setattr(dbbootstrap, "get_migrations_from_s3", lambda bucket, prefix, local_dir: [])
+    monkeypatch.setattr(dbbootstrap, "apply_migrations",
+                        lambda migrations, dbpass, certs_filepath, responseData: bootstraps.append(1) or responseData)
+
+    now = datetime.now(timezone.utc)
+    for i in range(3):
+        event = create_sns_event(now + timedelta(seconds=(DUPLICATE_EVENT_WINDOW + 1) * i), records=2)
+        response = dbbootstrap.handler(event, None)
+        # the instances of one cluster start together, the first record bootstraps it
+        assert [record["Status"] for record in response["Records"]] == ["bootstrapped", "duplicate"]
+    assert len(bootstraps) == 3
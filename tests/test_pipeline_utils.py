@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from utils.pipeline_utils import Task, check_pipeline, get_critical_path, run_pipeline
+
+
+def test_tasks_get_the_results_of_their_dependencies():
+    tasks = [
+        Task("total", lambda results: results["a"] + results["b"], ["a", "b"]),
+        Task("a", lambda results: 1),
+        Task("b", lambda results: results["a"] * 10, ["a"]),
+    ]
+    timings = {}
+    results = run_pipeline(tasks, max_workers=4, timings=timings)
+    assert results == {"a": 1, "b": 10, "total": 11}
+    assert timings["a"][1] <= timings["b"][0]
+    assert timings["b"][1] <= timings["total"][0]
+
+
+def test_independent_tasks_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    tasks = [Task("left", lambda results: barrier.wait()), Task("right", lambda results: barrier.wait())]
+    # with a single worker at a time the barrier would time out
+    run_pipeline(tasks, max_workers=2)
+
+
+def test_failure_stops_dependents_and_is_raised():
+    started = []
+
+    def record(name):
+        def fn(results):
+            started.append(name)
+            return name
+        return fn
+
+    def fail(results):
+        raise RuntimeError("boom")
+
+    tasks = [
+        Task("ok", record("ok")),
+        Task("failing", fail, ["ok"]),
+        Task("after", record("after"), ["failing"]),
+    ]
+    with pytest.raises(RuntimeError, match="boom"):
+        run_pipeline(tasks, max_workers=2)
+    assert started == ["ok"]
+
+
+@pytest.mark.parametrize("tasks, message", [
+    ([Task("a", None), Task("a", None)], "Duplicate task names"),
+    ([Task("a", None, ["missing"])], "unknown task missing"),
+    ([Task("a", None, ["b"]), Task("b", None, ["a"])], "Dependency cycle"),
+])
+def test_invalid_pipelines_are_rejected(tasks, message):
+    with pytest.raises(ValueError, match=message):
+        check_pipeline(tasks)
+
+
+def test_critical_path_follows_the_latest_dependency():
+    tasks = {task.name: task for task in [
+        Task("sts", None), Task("bucket", None, ["sts"]), Task("docker", None, ["sts"]),
+        Task("stack", None, ["bucket", "docker"]),
+    ]}
+    timings = {"sts": (0, 1), "bucket": (1, 2), "docker": (1, 30), "stack": (30, 40)}
+    assert get_critical_path(tasks, timings) == ["sts", "docker", "stack"]
@@ -0,0 +1,66 @@
+import pytest
+
+from utils import plan_utils
+from utils.aws_call_utils import AWSCallLayer
+from utils.aws_utils import create_ecr_repository, get_caller_identity
+from utils.cloudformation_utils import get_change_set_type
+from utils.plan_utils import PLAN_ACCOUNT, PlanBackend, load_latencies
+
+
+@pytest.fixture
+def aws_config():
+    return {"max_attempts": 3, "base_delay": 0.0, "max_delay": 0.0,
+            "rate_limits": {"default": {"rate": 1000, "burst": 1000}}, "fault_injection": {}}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(plan_utils.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_plan_answers_as_a_fresh_account(aws_config, sleeps):
+    layer = AWSCallLayer(aws_config, backend=PlanBackend())
+
+    assert get_caller_identity(layer.client("sts", "us-east-1"))["Account"] == PLAN_ACCOUNT
+    assert get_change_set_type(layer.client("cloudformation", "us-east-1"), "main") is None
+    assert create_ecr_repository(layer.client("ecr", "us-east-1"), "project/lambda") == \
+        f"{PLAN_ACCOUNT}.dkr.ecr.us-east-1.amazonaws.com/project/lambda"
+    assert [(call["service"], call["operation"]) for call in layer.stats.calls] == [
+        ("sts", "GetCallerIdentity"), ("cloudformation", "DescribeStacks"),
+        ("ecr", "DescribeRepositories"), ("ecr", "CreateRepository")]
+    assert sleeps == []
+
+
+def test_replay_waits_for_the_median_recorded_latency(aws_config, sleeps, tmp_path):
+    recording = AWSCallLayer(aws_config, backend=PlanBackend())
+    for latency in (0.1, 0.3, 0.2):
+        recording.stats.record("sts", "GetCallerIdentity", latency, 0, 0.0, None, {})
+    recording.stats.record("s3", "PutObject", 0.5, 0, 0.0, None, {"Bucket": "b", "Key": "k"})
+    calls_file = str(tmp_path / "calls.json")
+    recording.stats.save(calls_file)
+
+    latencies = load_latencies(calls_file)
+    assert latencies == {"sts.GetCallerIdentity": pytest.approx(0.2), "s3.PutObject": pytest.approx(0.5)}
+
+    layer = AWSCallLayer(aws_config, backend=PlanBackend(latencies))
+    get_caller_identity(layer.client("sts", "us-east-1"))
+    # operations without a recorded latency answer at once
+    layer.client("s3", "us-east-1").list_objects_v2(Bucket="b")
+    assert sleeps == [pytest.approx(0.2)]
+
+
+def test_plan_docker_client_tracks_built_images(aws_config, sleeps):
+    from docker.errors import ImageNotFound
+
+    layer = AWSCallLayer(aws_config)
+    client = PlanBackend().docker_client(layer.stats)
+    with pytest.raises(ImageNotFound):
+        client.images.get("lambda:latest")
+    list(client.api.build(path=".", tag="lambda:latest"))
+    client.images.get("lambda:latest").tag("registry/lambda", "v1")
+
+    assert [call["operation"] for call in layer.stats.calls] == ["images.get", "images.build", "images.get",
+                                                                "image.tag"]
+    assert client.backend.image_names == {"lambda:latest", "registry/lambda:v1"}
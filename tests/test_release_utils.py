@@ -0,0 +1,43 @@
+import json
+import time
+
+from utils.aws_utils import list_s3_objects
+from utils.release_utils import compute_release, list_releases, load_release, prune_releases, publish_release
+
+BUNDLES = {"worker": "bundles/worker-abc.tar.gz"}
+
+
+def test_release_id_pins_files_bundles_and_image():
+    release = compute_release(["cf_templates"], BUNDLES, "abc")
+
+    assert compute_release(["cf_templates"], BUNDLES, "abc")["id"] == release["id"]
+    assert compute_release(["cf_templates"], BUNDLES, "def")["id"] != release["id"]
+    assert compute_release(["cf_templates"], {"worker": "bundles/worker-def.tar.gz"}, "abc")["id"] != release["id"]
+    assert compute_release(["cf_templates", "scripts/sql"], BUNDLES, "abc")["id"] != release["id"]
+    assert release["prefix"] == f"releases/{release['id']}"
+
+
+def test_published_release_records_what_it_deploys(s3_client, bucket_name):
+    release = compute_release(["cf_templates"], BUNDLES, "abc")
+
+    assert publish_release(s3_client, bucket_name, release, "repo:abc") == True
+    assert publish_release(s3_client, bucket_name, release, "repo:abc") == False
+    manifest = load_release(s3_client, bucket_name, release["id"])
+    assert (manifest["bundles"], manifest["image_tag"], manifest["image_uri"]) == (BUNDLES, "abc", "repo:abc")
+    assert f"{release['prefix']}/cf_templates/main.yaml" in list_s3_objects(s3_client, bucket_name, "releases/")
+    assert load_release(s3_client, bucket_name, "missing") is None
+
+
+def test_prune_keeps_the_newest_and_the_deployed_releases(s3_client, bucket_name):
+    for release_id in ("r1", "r2", "r3", "r4"):
+        s3_client.put_object(Bucket=bucket_name, Key=f"releases/{release_id}/cf_templates/main.yaml", Body=b"")
+        s3_client.put_object(Bucket=bucket_name, Key=f"releases/{release_id}/manifest.json",
+                             Body=json.dumps({"release": release_id}).encode())
+        # S3 timestamps have a one second resolution
+        time.sleep(1.01)
+
+    assert sorted(prune_releases(s3_client, bucket_name, ["r1"], 2)) == ["r2"]
+    assert [release["id"] for release in list_releases(s3_client, bucket_name)] == ["r4", "r3", "r1"]
+    assert list_s3_objects(s3_client, bucket_name, "releases/r2/") == {}
+    # at least 2 releases are kept whatever the retention
+    assert prune_releases(s3_client, bucket_name, [], 1) == ["r1"]
@@ -0,0 +1,65 @@
+import pytest
+
+
+def statements(sqlscript, script):
+    return [value for kind, value in sqlscript.split_sql_script(script)]
+
+
+def test_statements_end_at_semicolons(sqlscript):
+    assert statements(sqlscript, "SELECT 1;\nSELECT 2 ;\n\nSELECT 3") == ["SELECT 1;", "SELECT 2 ;", "SELECT 3"]
+
+
+def test_semicolons_in_quotes_and_comments_do_not_end_statements(sqlscript):
+    script = (
+        "INSERT INTO t VALUES ('a;b', 'it''s;');\n"
+        "SELECT \"odd;name\" FROM t; -- trailing; comment\n"
+        "/* block; comment */ SELECT 2;\n"
+    )
+    assert statements(sqlscript, script) == [
+        "INSERT INTO t VALUES ('a;b', 'it''s;');",
+        "SELECT \"odd;name\" FROM t;",
+        "SELECT 2;",
+    ]
+
+
+def test_dollar_quoted_bodies_are_kept_whole(sqlscript):
+    script = (
+        "DO $$\nBEGIN\nCREATE USER keycloak;\nEXCEPTION WHEN duplicate_object THEN NULL;\nEND\n$$;\n"
+        "CREATE FUNCTION f() RETURNS int AS $body$ SELECT 1; $body$ LANGUAGE sql;\n"
+        "SELECT $1;\n"
+    )
+    assert statements(sqlscript, script) == [
+        "DO $$\nBEGIN\nCREATE USER keycloak;\nEXCEPTION WHEN duplicate_object THEN NULL;\nEND\n$$;",
+        "CREATE FUNCTION f() RETURNS int AS $body$ SELECT 1; $body$ LANGUAGE sql;",
+        "SELECT $1;",
+    ]
+
+
+def test_connect_and_gexec_meta_commands(sqlscript):
+    script = (
+        "SELECT 'CREATE DATABASE kc'\nWHERE NOT EXISTS (SELECT FROM pg_database WHERE datname = 'kc')\\gexec\n"
+        "\\c kc\n"
+        "\\connect \"other\"\n"
+        "CREATE SCHEMA IF NOT EXISTS kc;\n"
+    )
+    assert sqlscript.split_sql_script(script) == [
+        (sqlscript.GEXEC, "SELECT 'CREATE DATABASE kc'\nWHERE NOT EXISTS (SELECT FROM pg_database WHERE datname = 'kc')"),
+        (sqlscript.CONNECT, "kc"),
+        (sqlscript.CONNECT, "other"),
+        (sqlscript.STATEMENT, "CREATE SCHEMA IF NOT EXISTS kc;"),
+    ]
+
+
+@pytest.mark.parametrize("script", ["\\set x 1\n", "SELECT 1 \\c kc\n", "\\gexec\n"])
+def test_unsupported_meta_commands_are_rejected(sqlscript, script):
+    with pytest.raises(ValueError, match="Unsupported psql meta command"):
+        sqlscript.split_sql_script(script)
+
+
+def test_shipped_migrations_split(sqlscript):
+    with open("scripts/sql/migrations/V0001__keycloak_init.sql") as f:
+        commands = sqlscript.split_sql_script(f.read())
+    kinds = [kind for kind, value in commands]
+    assert kinds.count(sqlscript.CONNECT) == 1
+    assert kinds.count(sqlscript.GEXEC) == 1
+    assert all(value.endswith(";") for kind, value in commands if kind == sqlscript.STATEMENT)
@@ -0,0 +1,71 @@
+import json
+
+from utils import state_utils
+from utils.state_utils import DeploymentState
+
+
+def new_state(tmp_path, refresh=False):
+    return DeploymentState("project", "dev", "us-east-1", refresh, str(tmp_path))
+
+
+def test_entries_survive_runs_and_miss_on_new_inputs(tmp_path):
+    state = new_state(tmp_path)
+    state.put("bucket", "my-bucket", "fingerprint")
+
+    reloaded = new_state(tmp_path)
+    assert reloaded.get("bucket", "fingerprint") == "my-bucket"
+    assert reloaded.get("bucket", "other-fingerprint") is None
+    assert reloaded.get("repository") is None
+    assert new_state(tmp_path, refresh=True).get("bucket", "fingerprint") is None
+
+
+def test_entries_expire(tmp_path, monkeypatch):
+    state = new_state(tmp_path)
+    state.put("bucket", "my-bucket", "fingerprint", ttl=60)
+    now = state_utils.time.time()
+
+    monkeypatch.setattr(state_utils.time, "time", lambda: now + 59)
+    assert state.get("bucket", "fingerprint") == "my-bucket"
+    monkeypatch.setattr(state_utils.time, "time", lambda: now + 61)
+    assert state.get("bucket", "fingerprint") is None
+
+
+def test_entries_are_scoped_to_the_account(tmp_path):
+    state = new_state(tmp_path)
+    state.bind_account("111111111111")
+    state.put("bucket", "my-bucket", "fingerprint")
+
+    other = new_state(tmp_path)
+    other.bind_account("222222222222")
+    assert other.get("bucket", "fingerprint") is None
+    assert other.cached("bucket", lambda: "other-bucket", "fingerprint") == "other-bucket"
+    other.bind_account("111111111111")
+    # the other account recorded its own entry in place of the first one
+    assert other.get("bucket", "fingerprint") is None
+
+
+def test_cached_computes_only_on_a_miss(tmp_path):
+    state = new_state(tmp_path)
+    calls = []
+
+    def create():
+        calls.append(1)
+        return "uri"
+
+    assert state.cached("repository", create, "fingerprint") == "uri"
+    assert state.cached("repository", create, "fingerprint") == "uri"
+    assert len(calls) == 1
+
+
+def test_corrupted_or_cleared_state_starts_empty(tmp_path):
+    state = new_state(tmp_path)
+    state.put("bucket", "my-bucket")
+    with open(state.path, "w") as f:
+        f.write('{"bucket": ')
+    assert new_state(tmp_path).get("bucket") is None
+
+    state.put("bucket", "my-bucket")
+    with open(state.path) as f:
+        assert json.load(f)["bucket"]["value"] == "my-bucket"
+    state.clear()
+    assert new_state(tmp_path).get("bucket") is None
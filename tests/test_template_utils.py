@@ -0,0 +1,95 @@
+from utils import template_utils
+from utils.template_utils import analyze_templates, check_root_parameters, load_template
+
+ROOT_TEMPLATE = """
+Parameters:
+  Name: {Type: String}
+  Size: {Type: Number, Default: 1}
+  Bucket: {Type: String}
+  Prefix: {Type: String}
+Resources:
+  Child:
+    Type: AWS::CloudFormation::Stack
+    Properties:
+      TemplateURL: !Sub https://s3.amazonaws.com/${Bucket}/${Prefix}/child.yaml
+      Parameters:
+        Name: !Ref Name
+        Extra: !Ref Size
+  Queue:
+    Type: AWS::SQS::Queue
+    DependsOn: Missing
+    Properties:
+      QueueName: !GetAtt Child.Outputs.QueueName
+Outputs:
+  Arn:
+    Value: !GetAtt Queue.Arn
+  Unknown:
+    Value: !Sub ${Child.Outputs.Nope}-${Undeclared}
+"""
+
+CHILD_TEMPLATE = """
+Parameters:
+  Name: {Type: String}
+  Required: {Type: String}
+Outputs:
+  QueueName:
+    Value: !Ref Name
+"""
+
+
+def write_templates(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(template_utils, "TEMPLATES_CACHE_DIR", str(tmp_path / "cache"))
+    (tmp_path / "main.yaml").write_text(ROOT_TEMPLATE)
+    (tmp_path / "child.yaml").write_text(CHILD_TEMPLATE)
+
+
+def test_nested_stack_graph_errors_are_reported(tmp_path, monkeypatch):
+    write_templates(tmp_path, monkeypatch)
+
+    assert sorted(analyze_templates("main.yaml")) == [
+        "main.yaml: Outputs.Unknown references unknown output Nope of child.yaml",
+        "main.yaml: Outputs.Unknown references unknown parameter or resource Undeclared",
+        "main.yaml: Resources.Child does not pass required parameter Required",
+        "main.yaml: Resources.Child passes undeclared parameter Extra",
+        "main.yaml: Resources.Queue depends on unknown resource Missing"]
+
+
+def test_short_form_intrinsics_are_loaded_in_long_form(tmp_path, monkeypatch):
+    write_templates(tmp_path, monkeypatch)
+    template = load_template("main.yaml")
+
+    assert template["Resources"]["Queue"]["Properties"]["QueueName"] == {"Fn::GetAtt": ["Child", "Outputs.QueueName"]}
+    assert template["Resources"]["Child"]["Properties"]["Parameters"]["Name"] == {"Ref": "Name"}
+    # cached parse
+    assert load_template("main.yaml") == template
+
+
+def test_root_parameters_are_checked_against_the_root_template(tmp_path, monkeypatch):
+    write_templates(tmp_path, monkeypatch)
+    parameters = [{"ParameterKey": "Other", "ParameterValue": "x"}]
+
+    assert check_root_parameters(parameters, "main.yaml") == [
+        "main.yaml: stack passes undeclared parameter Other",
+        "main.yaml: stack does not pass required parameter Name",
+        "main.yaml: stack does not pass required parameter Bucket",
+        "main.yaml: stack does not pass required parameter Prefix"]
+    parameters = [{"ParameterKey": key, "ParameterValue": "x"} for key in ("Name", "Bucket", "Prefix")]
+    assert check_root_parameters(parameters, "main.yaml") == []
+
+
+def test_shipped_templates_flag_the_undeclared_thumbprint_getter_image():
+    assert analyze_templates() == [
+        "cf_templates/irsa/stack.yaml: Resources.ThumbprintGetterLambdaFn references unknown parameter or "
+        "resource ThumbprintGetterLambdaImageUri"]
+
+
+def test_cached_templates_are_json_and_match_a_fresh_parse(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(template_utils, "TEMPLATES_CACHE_DIR", str(tmp_path / "cache"))
+    (tmp_path / "main.yaml").write_text("AWSTemplateFormatVersion: 2010-09-09\nResources: {}\n")
+
+    fresh = load_template("main.yaml")
+    [cache_file] = (tmp_path / "cache").iterdir()
+    assert cache_file.suffix == ".json"
+    assert fresh == load_template("main.yaml") == {"AWSTemplateFormatVersion": "2010-09-09", "Resources": {}}
@@ -0,0 +1,72 @@
+import json
+
+from constants import TIMELINES_S3_PREFIX
+from utils.timeline_utils import get_critical_path, load_timelines, parse_timeline, summarize_roles
+
+
+def record(instance, role, phase, kind, start, end, status="ok"):
+    return {"instance": instance, "role": role, "phase": phase, "kind": kind, "status": status,
+            "start": start * 1000, "end": end * 1000, "duration": end - start}
+
+
+def cluster_records():
+    return [
+        # first control plane, the workers wait for it
+        record("i-cp", "control-plane", "install", "install", 0, 40),
+        record("i-cp", "control-plane", "kubeadm-init", "wait", 45, 100),
+        record("i-cp", "control-plane", "ready", "ready", 100, 100),
+        # worker launched once the control plane is ready
+        record("i-w1", "worker", "install", "install", 130, 160),
+        record("i-w1", "worker", "pull", "pull", 160, 190),
+        record("i-w1", "worker", "ready", "ready", 190, 190),
+        # worker ready earlier, off the critical path
+        record("i-w2", "worker", "install", "install", 110, 150),
+        record("i-w2", "worker", "ready", "ready", 150, 150),
+        # node that never got ready
+        record("i-w3", "worker", "install", "install", 110, 120, status="failed")
+    ]
+
+
+def test_critical_path_goes_through_the_node_waited_for():
+    path = get_critical_path(cluster_records())
+
+    assert [node["instance"] for node in path["instances"]] == ["i-cp", "i-w1"]
+    assert [(phase["instance"], phase["phase"], phase["duration"]) for phase in path["phases"]] == [
+        ("i-cp", "install", 40), ("i-cp", "kubeadm-init", 55),
+        ("i-w1", "launch", 30), ("i-w1", "install", 30), ("i-w1", "pull", 30)]
+    assert path["duration"] == 190
+    # gap between the install and kubeadm-init of the control plane
+    assert path["unrecorded"] == 5
+
+
+def test_no_critical_path_without_a_ready_node():
+    records = [r for r in cluster_records() if r["kind"] != "ready"]
+    assert get_critical_path(records) is None
+
+
+def test_roles_sum_the_phase_kinds_of_ready_nodes():
+    roles = summarize_roles(cluster_records())
+
+    assert roles["worker"]["not_ready"] == 1
+    assert roles["worker"]["join"]["count"] == 2
+    assert roles["worker"]["join"]["max"] == 60
+    assert roles["worker"]["kinds"]["pull"]["p50"] == 30
+
+
+def test_truncated_records_are_skipped():
+    line = json.dumps({"instance": "i-1", "role": "worker", "phase": "install", "kind": "install",
+                       "status": "ok", "start": 1000, "end": 3500})
+    records = parse_timeline(f"{line}\n\n{line[:20]}", "i-1.jsonl")
+
+    assert len(records) == 1
+    assert records[0]["duration"] == 2.5
+
+
+def test_timelines_are_loaded_from_the_bucket(s3_client, bucket_name):
+    line = json.dumps({"instance": "i-1", "role": "worker", "phase": "ready", "kind": "ready",
+                       "status": "ok", "start": 0, "end": 0})
+    s3_client.put_object(Bucket=bucket_name, Key=f"{TIMELINES_S3_PREFIX}/i-1.jsonl", Body=line)
+    s3_client.put_object(Bucket=bucket_name, Key=f"{TIMELINES_S3_PREFIX}/i-2.jsonl", Body=f"{line}\n{line}")
+    s3_client.put_object(Bucket=bucket_name, Key=f"{TIMELINES_S3_PREFIX}/notes.txt", Body=line)
+
+    assert len(load_timelines(s3_client, bucket_name, max_workers=2)) == 3
@@ -0,0 +1,73 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.trace_utils import NOOP_SPAN, Tracer, add_metrics, record_span, start_span, submit
+
+
+def traced_run(tracer):
+    """A deploy-like run: a root span, a phase, calls on a thread pool and a failed step."""
+    with tracer.span("deploy", env="dev") as root:
+        with start_span("phase.upload") as phase:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [submit(executor, add_metrics, bytes=100, calls=1) for _ in range(3)]
+                [future.result() for future in futures]
+            record_span("cloudformation.stack", phase.start_ns, phase.start_ns + 1000, stack="Network")
+        with pytest.raises(RuntimeError):
+            with start_span("phase.stack"):
+                raise RuntimeError("rollback")
+    return root
+
+
+def test_metrics_roll_up_from_pool_threads_to_the_root():
+    tracer = Tracer()
+    root = traced_run(tracer)
+    upload = next(span for span in tracer.get_spans() if span.name == "phase.upload")
+    assert upload.metrics == {"bytes": 300, "calls": 3}
+    assert root.metrics == {"bytes": 300, "calls": 3}
+    assert [span.name for span in tracer.get_spans()][0] == "deploy"
+
+
+def test_untraced_code_runs_in_a_noop_span():
+    with start_span("phase.upload") as span:
+        span.add("bytes", 10)
+        add_metrics(calls=1)
+        record_span("cloudformation.stack", 0, 1)
+    assert span is NOOP_SPAN
+
+
+def test_chrome_trace_holds_one_complete_event_per_span():
+    tracer = Tracer()
+    traced_run(tracer)
+    trace = tracer.to_chrome_trace()
+    events = {event["name"]: event for event in trace["traceEvents"] if event["ph"] == "X"}
+    assert sorted(events) == ["cloudformation.stack", "deploy", "phase.stack", "phase.upload"]
+    assert events["deploy"]["ts"] == 0
+    assert events["cloudformation.stack"]["dur"] == 1.0
+    assert events["phase.upload"]["args"] == {"bytes": 300, "calls": 3}
+    assert events["phase.stack"]["args"]["error"] == "RuntimeError('rollback')"
+    assert [event["args"]["name"] for event in trace["traceEvents"] if event["ph"] == "M"] == ["MainThread"]
+
+
+def test_otel_spans_keep_the_tree_and_errors():
+    tracer = Tracer()
+    root = traced_run(tracer)
+    spans = {span["name"]: span for span in tracer.to_otel()["resourceSpans"][0]["scopeSpans"][0]["spans"]}
+    assert "parentSpanId" not in spans["deploy"]
+    assert spans["phase.upload"]["parentSpanId"] == root.span_id
+    assert spans["cloudformation.stack"]["parentSpanId"] == spans["phase.upload"]["spanId"]
+    assert {span["traceId"] for span in spans.values()} == {tracer.trace_id}
+    assert {"key": "metric.bytes", "value": {"intValue": "300"}} in spans["phase.upload"]["attributes"]
+    assert spans["phase.stack"]["status"] == {"code": 2, "message": "RuntimeError('rollback')"}
+    assert spans["deploy"]["status"] == {"code": 1}
+
+
+def test_export_writes_the_requested_format(tmp_path):
+    tracer = Tracer()
+    traced_run(tracer)
+    tracer.export(str(tmp_path / "traces" / "deploy.json"), "otel")
+    with open(tmp_path / "traces" / "deploy.json") as f:
+        assert "resourceSpans" in json.load(f)
+    with pytest.raises(ValueError):
+        tracer.export(str(tmp_path / "deploy.json"), "zipkin")
@@ -0,0 +1,131 @@
+from typing import Any, Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import hashlib
+import logging
+import os
+import shutil
+import urllib.parse
+import urllib.request
+import yaml
+
+from constants import ARTIFACTS_CACHE_DIR, ARTIFACTS_S3_PREFIX
+from utils.aws_utils import list_s3_objects, upload_files_to_s3
+from utils.exceptions import ArtifactException
+from utils.trace_utils import start_span, submit
+
+LOGGER = logging.getLogger()
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+def load_artifacts(artifacts_file: str) -> List[Dict[str, Any]]:
+    """Load the pinned artifact list, filling in the filename and S3 key of each artifact."""
+    with open(artifacts_file, "r") as f:
+        artifacts = (yaml.safe_load(f) or {}).get("artifacts") or []
+    for artifact in artifacts:
+        filename = artifact.get("filename") or os.path.basename(urllib.parse.urlparse(artifact["url"]).path)
+        artifact["filename"] = filename
+        artifact["key"] = f"{ARTIFACTS_S3_PREFIX}/{artifact['role']}/{filename}"
+    return artifacts
+
+
+def compute_file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def check_artifact_checksum(artifact: Dict[str, Any], file_path: str) -> bool:
+    """Check a file against the pinned sha256 of an artifact, unpinned artifacts always pass."""
+    sha256 = compute_file_sha256(file_path)
+    if(artifact.get("sha256") is None):
+        LOGGER.warning(f"Artifact {artifact['url']} is not pinned, sha256: {sha256}")
+        return True
+    return sha256 == artifact["sha256"]
+
+
+def fetch_artifact(artifact: Dict[str, Any], cache_dir: str = ARTIFACTS_CACHE_DIR, timeout: float = 60) -> str:
+    """Fetch an artifact into the local cache unless a verified copy is already cached.
+
+    :return: Path of the cached artifact.
+    :rtype: str
+    """
+    file_path = os.path.join(cache_dir, artifact["role"], artifact["filename"])
+    if(os.path.exists(file_path) and check_artifact_checksum(artifact, file_path)):
+        LOGGER.info(f"Using cached artifact {file_path}")
+        return file_path
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}"
+    LOGGER.info(f"Fetching artifact {artifact['url']}")
+    try:
+        with start_span("http.fetch", url=artifact["url"]) as span:
+            with urllib.request.urlopen(artifact["url"], timeout=timeout) as response, open(tmp_path, "wb") as f:
+                shutil.copyfileobj(response, f, DOWNLOAD_CHUNK_SIZE)
+            span.add("bytes_downloaded", os.path.getsize(tmp_path))
+    except OSError as e:
+        if(os.path.exists(tmp_path)): os.remove(tmp_path)
+        raise ArtifactException(f"Failed to fetch artifact {artifact['url']}: {e}", artifact["url"])
+
+    if(check_artifact_checksum(artifact, tmp_path) == False):
+        os.remove(tmp_path)
+        raise ArtifactException(f"Checksum mismatch for artifact {artifact['url']}", artifact["url"])
+    os.replace(tmp_path, file_path)
+    return file_path
+
+
+def fetch_artifacts(artifacts: List[Dict[str, Any]],
+                    cache_dir: str = ARTIFACTS_CACHE_DIR,
+                    max_workers: int = 8,
+                    timeout: float = 60) -> List[Tuple[str, str]]:
+    """Fetch artifacts concurrently into the local cache.
+
+    :return: List of (cached file path, object key) tuples.
+    :rtype: List[Tuple[str, str]]
+    """
+    if(len(artifacts) == 0): return []
+
+    files = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(artifacts)))) as executor:
+        futures = {submit(executor, fetch_artifact, artifact, cache_dir, timeout): artifact for artifact in artifacts}
+        for future in as_completed(futures):
+            try:
+                files.append((future.result(), futures[future]["key"]))
+            except ArtifactException as e:
+                LOGGER.error(str(e))
+                errors.append(e)
+
+    if(len(errors) > 0):
+        raise ArtifactException(f"Failed to fetch {len(errors)} of {len(artifacts)} artifacts",
+                                ", ".join(e.url for e in errors))
+    return sorted(files, key=lambda file: file[1])
+
+
+def mirror_artifacts(client,
+                     bucket_name: str,
+                     files: List[Tuple[str, str]],
+                     max_workers: int = 8,
+                     transfer_config=None) -> Dict[str, int]:
+    """Mirror the artifacts fetched by fetch_artifacts into the project bucket.
+
+    Only the artifacts missing from the bucket, or with a different size,
+    are uploaded in parallel. A single paginated listing of the artifacts
+    prefix is used to find them, so one local fetch serves every bucket.
+
+    :param files: List of (cached file path, object key) tuples.
+    :return: Mirror report with uploaded and skipped counters.
+    :rtype: Dict[str, int]
+    """
+    remote_objects = list_s3_objects(client, bucket_name, ARTIFACTS_S3_PREFIX + "/")
+    missing = [(file_path, key) for file_path, key in files
+               if(remote_objects.get(key, {}).get("Size") != os.path.getsize(file_path))]
+
+    report = {
+        "uploaded": len(missing),
+        "uploaded_bytes": upload_files_to_s3(client, bucket_name, missing, max_workers, transfer_config),
+        "skipped": len(files) - len(missing)
+    }
+    LOGGER.info(f"Mirrored {len(files)} artifacts: {report['uploaded']} uploaded, {report['skipped']} up to date")
+    return report
@@ -0,0 +1,324 @@
+from typing import Any, Dict, List
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+
+from utils.trace_utils import add_metrics
+
+LOGGER = logging.getLogger()
+
+RETRYABLE_ERROR_CODES = {
+    "Throttling",
+    "ThrottlingException",
+    "ThrottledException",
+    "RequestThrottled",
+    "RequestThrottledException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+    "ProvisionedThroughputExceededException",
+    "SlowDown",
+    "PriorRequestNotComplete",
+    "RequestTimeout",
+    "RequestTimeoutException",
+    "InternalError",
+    "InternalFailure",
+    "ServiceUnavailable"
+}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# operations accepting a client token, the same token is sent on every attempt of a call
+IDEMPOTENCY_TOKEN_PARAMETERS = {
+    "cloudformation.CreateStack": "ClientRequestToken",
+    "cloudformation.UpdateStack": "ClientRequestToken",
+    "cloudformation.DeleteStack": "ClientRequestToken",
+    "cloudformation.ExecuteChangeSet": "ClientRequestToken",
+    "cloudformation.CreateChangeSet": "ClientToken",
+    "secrets-manager.CreateSecret": "ClientRequestToken"
+}
+
+# parameters left out of the recorded calls
+REDACTED_PARAMETERS = {"SecretString", "SecretBinary", "password"}
+
+class TokenBucket:
+    """Client side rate limit shared by all clients and threads of a service."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take a token, waiting for the bucket to refill when empty.
+
+        :return: Seconds waited.
+        :rtype: float
+        """
+        waited = 0.0
+        while(True):
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if(self.tokens >= 1):
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class CallStats:
+    """Latency, retries, rate limit waits and errors of every AWS call.
+
+    Calls are recorded with their thread, start offset and parameters, so a
+    run can be saved as a structured list of operations and replayed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.calls = []
+
+    def record(self, service: str, operation: str, latency: float, retries: int,
+               throttled: float, error: str = None, params: Dict[str, Any] = None) -> None:
+        call = {
+            "service": service,
+            "operation": operation,
+            "thread": threading.current_thread().name,
+            "start": time.monotonic() - self.started - latency,
+            "latency": latency,
+            "retries": retries,
+            "throttled": throttled,
+            "error": error,
+            "params": describe_params(params or {})
+        }
+        with self.lock:
+            self.calls.append(call)
+        add_metrics(**{"calls": 1, f"calls.{service}": 1, "call_retries": retries,
+                       "call_errors": 1 if error else 0, "rate_limited_seconds": throttled})
+
+    def save(self, path: str) -> None:
+        """Save the recorded calls in start order."""
+        with self.lock:
+            calls = sorted(self.calls, key=lambda call: call["start"])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"calls": calls}, f, indent=2)
+        LOGGER.info(f"Saved {len(calls)} calls to {path}")
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Aggregate the calls by service and operation."""
+        summary = {}
+        with self.lock:
+            calls = list(self.calls)
+        for call in calls:
+            entry = summary.setdefault(f"{call['service']}.{call['operation']}", {
+                "calls": 0, "retries": 0, "errors": 0, "throttled": 0.0, "total_latency": 0.0, "max_latency": 0.0
+            })
+            entry["calls"] += 1
+            entry["retries"] += call["retries"]
+            entry["errors"] += 1 if call["error"] else 0
+            entry["throttled"] += call["throttled"]
+            entry["total_latency"] += call["latency"]
+            entry["max_latency"] = max(entry["max_latency"], call["latency"])
+        return summary
+
+    def log_summary(self) -> None:
+        summary = self.summary()
+        if(len(summary) == 0): return
+        LOGGER.info("Calls:")
+        for name, entry in sorted(summary.items(), key=lambda item: item[1]["total_latency"], reverse=True):
+            LOGGER.info(f"  {name:<45} {entry['calls']:>5} calls {entry['retries']:>4} retries "
+                        f"{entry['errors']:>3} errors {entry['total_latency']:8.2f}s total "
+                        f"{entry['total_latency'] / entry['calls']:6.3f}s avg {entry['max_latency']:6.3f}s max "
+                        f"{entry['throttled']:6.2f}s rate limited")
+
+
+def describe_params(params: Any) -> Any:
+    """Make the parameters of a call JSON serializable, secrets are redacted and streams named by type."""
+    if(isinstance(params, dict)):
+        return {key: "<redacted>" if key in REDACTED_PARAMETERS else describe_params(value)
+                for key, value in params.items()}
+    if(isinstance(params, (list, tuple))):
+        return [describe_params(value) for value in params]
+    if(params is None or isinstance(params, (str, int, float, bool))):
+        return params
+    return f"<{type(params).__name__}>"
+
+
+def get_error_code(response: Any, caught_exception: Exception) -> str:
+    """Get the error code of an attempt, None when it succeeded."""
+    if(caught_exception is not None):
+        return type(caught_exception).__name__
+    if(response is None): return None
+    http_response, parsed = response
+    code = parsed.get("Error", {}).get("Code")
+    if(code is None and http_response.status_code >= 300):
+        code = str(http_response.status_code)
+    return code
+
+
+def is_retryable(response: Any, caught_exception: Exception) -> bool:
+    """Throttling, transient server errors and connection errors are retryable."""
+    if(caught_exception is not None):
+        return isinstance(caught_exception, OSError) or \
+            type(caught_exception).__module__.startswith(("botocore.exceptions", "urllib3"))
+    if(response is None): return False
+    http_response, parsed = response
+    return parsed.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES or \
+        http_response.status_code in RETRYABLE_STATUS_CODES
+
+
+class AWSCallLayer:
+    """Shared call layer of the boto3 clients of a deployment.
+
+    Clients are created with the botocore retries disabled and hooked into
+    the botocore event system, so API calls, paginators and S3 transfers
+    all go through the same layer:
+
+    - every HTTP attempt takes a token from the token bucket of its service,
+    - retryable errors are retried with exponential backoff and full jitter,
+    - operations supporting a client token get one, reused by every attempt,
+    - every call is recorded with its latency, retries and rate limit waits.
+
+    Errors left after the last attempt are raised by boto3 as usual and
+    turned into AWSCallException by the aws_utils helpers. A backend, such
+    as the plan backend, can answer the calls in place of AWS.
+    """
+
+    def __init__(self, aws_config: Dict[str, Any], session: boto3.session.Session = None, backend=None):
+        self.session = session or boto3.session.Session()
+        self.endpoint_url = aws_config.get("endpoint_url")
+        self.backend = backend
+        self.max_attempts = aws_config["max_attempts"]
+        self.base_delay = aws_config["base_delay"]
+        self.max_delay = aws_config["max_delay"]
+        self.rate_limits = aws_config["rate_limits"]
+        self.fault_injection = aws_config.get("fault_injection") or {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.session_lock = threading.Lock()
+        self.stats = CallStats()
+
+    def get_bucket(self, service: str) -> TokenBucket:
+        with self.lock:
+            if(service not in self.buckets):
+                limit = self.rate_limits.get(service, self.rate_limits["default"])
+                self.buckets[service] = TokenBucket(limit["rate"], limit["burst"])
+            return self.buckets[service]
+
+    def client(self, service_name: str, region_name: str = None, **kwargs):
+        """Create a boto3 client going through the call layer.
+
+        Clients are thread safe, but creating them from the shared session is
+        not, so creations are serialized.
+        """
+        config = Config(retries={"max_attempts": 0, "mode": "standard"})
+        if(kwargs.get("config") is not None):
+            config = config.merge(kwargs["config"])
+        kwargs["config"] = config
+        if(kwargs.get("endpoint_url") is None):
+            kwargs["endpoint_url"] = self.endpoint_url
+        with self.session_lock:
+            client = self.session.client(service_name, region_name, **kwargs)
+
+        service = client.meta.service_model.service_id.hyphenize()
+        bucket = self.get_bucket(service)
+        events = client.meta.events
+
+        def before_parameter_build(params: Dict[str, Any], model, context: Dict[str, Any], **_) -> None:
+            context["call_layer"] = {"operation": model.name, "started": time.monotonic(),
+                                     "retries": 0, "throttled": 0.0, "params": params}
+            token_parameter = IDEMPOTENCY_TOKEN_PARAMETERS.get(f"{service}.{model.name}")
+            if(token_parameter is not None and token_parameter not in params):
+                params[token_parameter] = str(uuid.uuid4())
+
+        def request_created(request, **_) -> None:
+            # fired for every attempt, including retries
+            waited = bucket.acquire()
+            if("call_layer" in request.context):
+                request.context["call_layer"]["throttled"] += waited
+
+        def needs_retry(response, attempts: int, caught_exception: Exception, request_dict: Dict[str, Any],
+                        operation, **_) -> float:
+            if(is_retryable(response, caught_exception) == False): return None
+            error = get_error_code(response, caught_exception)
+            if(attempts >= self.max_attempts):
+                LOGGER.warning(f"{service}.{operation.name} failed with {error} after {attempts} attempts")
+                return None
+            if("call_layer" in request_dict["context"]):
+                request_dict["context"]["call_layer"]["retries"] = attempts
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempts - 1)))
+            LOGGER.debug(f"{service}.{operation.name} failed with {error}, retry {attempts} in {delay:.2f}s")
+            return delay
+
+        def after_call(http_response, parsed: Dict[str, Any], context: Dict[str, Any], **_) -> None:
+            error = parsed.get("Error", {}).get("Code") if http_response.status_code >= 300 else None
+            self.record(service, context, error)
+
+        def after_call_error(exception: Exception, context: Dict[str, Any], **_) -> None:
+            self.record(service, context, type(exception).__name__)
+
+        events.register(f"before-parameter-build.{service}", before_parameter_build)
+        events.register(f"request-created.{service}", request_created)
+        events.register_first(f"needs-retry.{service}", needs_retry)
+        events.register(f"after-call.{service}", after_call)
+        events.register(f"after-call-error.{service}", after_call_error)
+        if(self.fault_injection.get("rate", 0) > 0):
+            inject_faults(client, self.fault_injection["rate"], self.fault_injection.get("code", "Throttling"))
+        if(self.backend is not None):
+            self.backend.attach(client)
+        return client
+
+    def record(self, service: str, context: Dict[str, Any], error: str) -> None:
+        call = context.get("call_layer")
+        if(call is None): return
+        self.stats.record(service, call["operation"], time.monotonic() - call["started"], call["retries"],
+                          call["throttled"], error, call["params"])
+
+
+class FaultResponse:
+    """Raw body of an injected fault, read by AWSResponse."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def stream(self, **_) -> List[bytes]:
+        return [self.body]
+
+
+def inject_faults(client, rate: float, code: str = "Throttling") -> None:
+    """Make a share of the HTTP attempts of a client fail locally with an error code.
+
+    The fault is answered in place of the request, in the wire format of the
+    service protocol, so botocore parses it like a real error and the retry
+    and error handling of the call layer can be exercised without AWS.
+    """
+    service = client.meta.service_model.service_id.hyphenize()
+    protocol = client.meta.service_model.protocol
+
+    def before_send(request, **_) -> AWSResponse:
+        if(random.random() >= rate): return None
+        message = "Injected fault"
+        if(protocol in ("json", "rest-json")):
+            headers = {"x-amzn-ErrorType": code, "Content-Type": "application/x-amz-json-1.1"}
+            body = f'{{"__type": "{code}", "message": "{message}"}}'
+        elif(protocol == "rest-xml"):
+            headers = {"Content-Type": "application/xml"}
+            body = f"<Error><Code>{code}</Code><Message>{message}</Message></Error>"
+        else:
+            headers = {"Content-Type": "text/xml"}
+            body = f"<ErrorResponse><Error><Type>Sender</Type><Code>{code}</Code>" \
+                   f"<Message>{message}</Message></Error></ErrorResponse>"
+        return AWSResponse(request.url, 400, headers, FaultResponse(body.encode()))
+
+    client.meta.events.register(f"before-send.{service}", before_send)
@@ -1,21 +1,49 @@
-from ctypes import Union
-from http import client
-import re
-from typing import Dict
+from typing import Any, Callable, Dict, List, Tuple, TYPE_CHECKING
 import os
-from typing import Dict
-from requests import get
-from utils.config_utils import get_logger
-from constants import CLOUDFORMATION_CAPABILITIES
-from docker import DockerClient
-from utils.docker_utils import build_docker_image
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from constants import (
+    CLOUDFORMATION_CAPABILITIES,
+    S3_MULTIPART_CHUNKSIZE,
+    S3_DELETE_BATCH_SIZE,
+    S3_UPLOAD_MAX_WORKERS,
+    ECR_AUTH_CACHE_DIR,
+    ECR_AUTH_MIN_VALIDITY
+)
+from utils.docker_utils import build_docker_image, compute_build_context_hash, push_docker_image
 import json
 import base64
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+from boto3.s3.transfer import TransferConfig
+from utils.exceptions import S3UploadException, AWSCallException, DockerException
+from utils.trace_utils import start_span, submit, add_metrics
 import logging
-import subprocess
+import threading
+import time
+
+if TYPE_CHECKING:
+    from docker import DockerClient
+
+LOGGER = logging.getLogger()
+
+# ECR tokens by registry, shared by the environments of a run
+ECR_AUTH_CACHE = {}
+ECR_AUTH_LOCK = threading.Lock()
+
+def to_aws_call_exception(e: Exception, action: str) -> AWSCallException:
+    """Turn the error of an AWS call, left after the retries of the call layer, into a typed error.
+
+    Client errors keep their operation and error code, botocore errors raised
+    before or without a response, e.g. NoCredentialsError or
+    EndpointConnectionError, get their class name as code.
+    """
+    if(isinstance(e, ClientError)):
+        operation, code = e.operation_name, e.response["Error"]["Code"]
+    else:
+        operation, code = None, type(e).__name__
+    LOGGER.error(f"Failed to {action}: {e}")
+    return AWSCallException(f"Failed to {action}: {e}", operation, code)
 
-LOGGER = logging.getLogger() #get_logger()
 
 def create_s3_bucket(client, bucket_name: str, region: str) -> None:
     """Create S3 bucket."""
@@ -26,56 +54,274 @@ def create_s3_bucket(client, bucket_name: str, region: str) -> None:
             client.create_bucket(Bucket=bucket_name, 
                                 CreateBucketConfiguration={'LocationConstraint': region})
         LOGGER.info(f"Created S3 Bucket with name: {bucket_name}")
-    except Exception as e:
-        LOGGER.error(f"An error occurred: {e}")
-        exit(1)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'BucketAlreadyOwnedByYou':
+            LOGGER.info(f"S3 Bucket with name {bucket_name} already exists.")
+            return
+        raise to_aws_call_exception(e, f"create S3 Bucket {bucket_name}")
+    except BotoCoreError as e:
+        raise to_aws_call_exception(e, f"create S3 Bucket {bucket_name}")
+
+
+def get_transfer_config(s3_config: Dict[str, Any]) -> TransferConfig:
+    """Build the S3 TransferConfig shared by all uploads."""
+    return TransferConfig(
+        multipart_threshold=s3_config.get("multipart_threshold", S3_MULTIPART_CHUNKSIZE),
+        multipart_chunksize=s3_config.get("multipart_chunksize", S3_MULTIPART_CHUNKSIZE),
+        max_concurrency=s3_config.get("multipart_concurrency", 4),
+        use_threads=True
+    )
+
+
+def upload_file_in_span(client, bucket_name: str, file_path: str, file_key: str,
+                        transfer_config: TransferConfig = None) -> int:
+    """Upload a file to S3 bucket in its own span.
+
+    :return: Number of bytes uploaded.
+    :rtype: int
+    """
+    size = os.path.getsize(file_path)
+    with start_span("s3.upload", bucket=bucket_name, key=file_key) as span:
+        client.upload_file(file_path, bucket_name, file_key, Config=transfer_config)
+        span.add("bytes_uploaded", size)
+    return size
+
+
+def upload_files_to_s3(client,
+                       bucket_name: str,
+                       files: List[Tuple[str, str]],
+                       max_workers: int = S3_UPLOAD_MAX_WORKERS,
+                       transfer_config: TransferConfig = None) -> int:
+    """Upload files to S3 bucket concurrently.
+
+    Files are uploaded by a bounded thread pool sharing one client and one
+    TransferConfig, so large artifacts go through multipart uploads. Failures
+    are collected and raised together once every upload has completed.
+
+    :param files: List of (file path, object key) tuples.
+    :return: Number of bytes uploaded.
+    :rtype: int
+    """
+    if(len(files) == 0): return 0
+
+    errors = {}
+    uploaded_bytes = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(files)))) as executor:
+        futures = {
+            submit(executor, upload_file_in_span, client, bucket_name, file_path, file_key, transfer_config):
+                (file_path, file_key)
+            for file_path, file_key in files
+        }
+        for future in as_completed(futures):
+            file_path, file_key = futures[future]
+            try:
+                uploaded_bytes += future.result()
+                LOGGER.info(f"Uploaded file to S3 Bucket ({bucket_name}) with key: {file_key}")
+            except Exception as e:
+                LOGGER.error(f"Failed to upload {file_path} to S3 Bucket ({bucket_name}): {e}")
+                errors[file_key] = e
+
+    if(len(errors) > 0):
+        raise S3UploadException(
+            f"Failed to upload {len(errors)} of {len(files)} files to S3 Bucket ({bucket_name})", errors)
+    return uploaded_bytes
+
+
+def empty_s3_bucket(client, bucket_name: str, max_workers: int = S3_UPLOAD_MAX_WORKERS) -> int:
+    """Delete every object version and delete marker of S3 bucket.
+
+    Versions are listed page by page and deleted with one DeleteObjects call
+    per batch of S3_DELETE_BATCH_SIZE keys, batches are deleted concurrently
+    while the listing goes on.
+
+    :return: Number of deleted versions, 0 if the bucket does not exist.
+    :rtype: int
+    """
+    def delete_batch(batch: List[Dict[str, str]]) -> int:
+        response = client.delete_objects(Bucket=bucket_name, Delete={"Objects": batch, "Quiet": True})
+        errors = response.get("Errors", [])
+        if(len(errors) > 0):
+            raise AWSCallException(f"Failed to delete {len(errors)} objects from S3 Bucket {bucket_name}: "
+                                   f"{errors[0].get('Message')}", "DeleteObjects", errors[0].get("Code"))
+        return len(batch)
+
+    futures = []
+    batch = []
+    paginator = client.get_paginator("list_object_versions")
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for page in paginator.paginate(Bucket=bucket_name,
+                                           PaginationConfig={"PageSize": S3_DELETE_BATCH_SIZE}):
+                for version in page.get("Versions", []) + page.get("DeleteMarkers", []):
+                    batch.append({"Key": version["Key"], "VersionId": version["VersionId"]})
+                    if(len(batch) == S3_DELETE_BATCH_SIZE):
+                        futures.append(submit(executor, delete_batch, batch))
+                        batch = []
+            if(len(batch) > 0):
+                futures.append(submit(executor, delete_batch, batch))
+            deleted = sum(future.result() for future in futures)
+    except ClientError as e:
+        if(e.response["Error"]["Code"] == "NoSuchBucket"): return 0
+        raise to_aws_call_exception(e, f"empty S3 Bucket {bucket_name}")
+    except BotoCoreError as e:
+        raise to_aws_call_exception(e, f"empty S3 Bucket {bucket_name}")
+    add_metrics(objects_deleted=deleted)
+    return deleted
 
 
-def upload_file_to_s3(client, bucket_name: str, file_path: str, file_key: str) -> None:
-    """Upload file to S3 bucket."""
+def delete_s3_bucket(client, bucket_name: str, max_workers: int = S3_UPLOAD_MAX_WORKERS) -> None:
+    """Empty and delete S3 bucket, missing buckets are skipped."""
+    deleted = empty_s3_bucket(client, bucket_name, max_workers)
     try:
-        client.upload_file(file_path, bucket_name, file_key)
-        LOGGER.info(f"Uploaded file to S3 Bucket ({bucket_name}) with key: {file_key}")
-    except Exception as e:
-        LOGGER.error(f"An error occurred: {e}")
-        exit(1)
-
-
-def upload_dir_to_s3(client, bucket_name: str, base_dir: str) -> None:
-    """Upload directory to S3 bucket recursively."""
-    for elem in os.listdir(base_dir):
-        if(os.path.isdir(os.path.join(base_dir, elem)) == False):
-            file_path = os.path.join(base_dir, elem)
-            upload_file_to_s3(client, bucket_name, file_path, file_path)
+        client.delete_bucket(Bucket=bucket_name)
+        LOGGER.info(f"Deleted S3 Bucket {bucket_name} and its {deleted} object versions")
+    except ClientError as e:
+        if(e.response["Error"]["Code"] == "NoSuchBucket"):
+            LOGGER.info(f"S3 Bucket with name {bucket_name} does not exist.")
+            return
+        raise to_aws_call_exception(e, f"delete S3 Bucket {bucket_name}")
+    except BotoCoreError as e:
+        raise to_aws_call_exception(e, f"delete S3 Bucket {bucket_name}")
+
+
+def compute_file_etag(file_path: str, multipart: bool = False,
+                      chunk_size: int = S3_MULTIPART_CHUNKSIZE) -> str:
+    """Compute the S3 ETag of a local file.
+
+    Single part uploads get the plain MD5 of the content, multipart uploads
+    get the MD5 of the concatenated part digests suffixed with the part count.
+    """
+    content_md5 = hashlib.md5()
+    part_digests = []
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            content_md5.update(chunk)
+            part_digests.append(hashlib.md5(chunk).digest())
+
+    if(multipart == False or len(part_digests) <= 1):
+        return content_md5.hexdigest()
+    return f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+
+def list_s3_objects(client, bucket_name: str, prefix: str) -> Dict[str, Dict[str, Any]]:
+    """List S3 objects under prefix, keyed by object key."""
+    objects = {}
+    paginator = client.get_paginator("list_objects_v2")
+    try:
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                objects[obj["Key"]] = {
+                    "ETag": obj["ETag"].strip('"'),
+                    "Size": obj["Size"],
+                    "LastModified": obj.get("LastModified")
+                }
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"list S3 Bucket {bucket_name} under prefix {prefix}")
+    return objects
+
+
+def list_local_files(base_dir: str) -> List[str]:
+    """List files under base_dir recursively, their paths are their S3 keys under an optional key prefix."""
+    files = []
+    for elem in sorted(os.listdir(base_dir)):
+        path = os.path.join(base_dir, elem)
+        if(os.path.isdir(path) == False):
+            files.append(path)
         else:
-            upload_dir_to_s3(client, bucket_name, os.path.join(base_dir, elem))
+            files.extend(list_local_files(path))
+    return files
+
+
+def delete_s3_keys(client, bucket_name: str, keys: List[str]) -> int:
+    """Delete keys from S3 bucket with one DeleteObjects call per S3_DELETE_BATCH_SIZE keys.
+
+    :return: Number of deleted keys.
+    :rtype: int
+    """
+    for i in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+        batch = keys[i:i + S3_DELETE_BATCH_SIZE]
+        try:
+            client.delete_objects(Bucket=bucket_name,
+                                  Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True})
+        except (ClientError, BotoCoreError) as e:
+            raise to_aws_call_exception(e, f"delete keys from S3 Bucket {bucket_name}")
+    return len(keys)
+
+
+def sync_dirs_to_s3(client,
+                    bucket_name: str,
+                    base_dirs: List[str],
+                    max_workers: int = S3_UPLOAD_MAX_WORKERS,
+                    transfer_config: TransferConfig = None,
+                    key_prefix: str = "") -> Dict[str, int]:
+    """Upload only new or changed files of directories to S3 bucket.
+
+    Local files are compared against the ETags returned by a single paginated
+    ListObjectsV2 call per directory prefix. Changed files of all directories
+    are uploaded together by upload_files_to_s3. Remote keys are never
+    deleted, releases are pruned as a whole by release_utils.
+
+    :param key_prefix: Prefix of the keys, prepended to the local paths.
+
+    :return: Sync report with uploaded and skipped counters.
+    :rtype: Dict[str, int]
+    """
+    chunk_size = transfer_config.multipart_chunksize if transfer_config else S3_MULTIPART_CHUNKSIZE
+    report = {
+        "uploaded": 0,
+        "uploaded_bytes": 0,
+        "skipped": 0,
+        "skipped_bytes": 0
+    }
+    changed_files = []
+
+    for base_dir in base_dirs:
+        remote_objects = list_s3_objects(client, bucket_name, key_prefix + base_dir.rstrip("/") + "/")
+        for file_path in list_local_files(base_dir):
+            key = key_prefix + file_path
+            size = os.path.getsize(file_path)
+            remote = remote_objects.get(key)
+            if(remote is not None and remote["Size"] == size and
+               remote["ETag"] == compute_file_etag(file_path, "-" in remote["ETag"], chunk_size)):
+                report["skipped"] += 1
+                report["skipped_bytes"] += size
+            else:
+                changed_files.append((file_path, key))
+
+    report["uploaded_bytes"] = upload_files_to_s3(
+        client, bucket_name, changed_files, max_workers, transfer_config)
+    report["uploaded"] = len(changed_files)
+
+    add_metrics(files_skipped=report["skipped"], bytes_skipped=report["skipped_bytes"])
+    LOGGER.info(f"Synced {', '.join(base_dirs)} to S3 Bucket ({bucket_name}/{key_prefix}): "
+                f"uploaded {report['uploaded']} files ({report['uploaded_bytes']} bytes), "
+                f"skipped {report['skipped']} unchanged files ({report['skipped_bytes']} bytes)")
+    return report
 
 
 def get_caller_identity(client) -> Dict[str, str]:
     """Get caller identity."""
     try:
-        response = client.get_caller_identity()
-        if(response is None):
-            LOGGER.error("Response from aws sts caller identity is None.")
-            raise Exception("Response is None.")
-        return response
-    except Exception as e:
-        LOGGER.error(f"An error occurred: {e}")
-        raise Exception(f"An error occurred: {e}")
+        return client.get_caller_identity()
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, "get caller identity")
     
 
-def create_stack(client, config) -> None:
-    """Start CloudFormation."""
+def create_stack(client, config) -> str:
+    """Start CloudFormation.
+
+    :return: Stack id.
+    :rtype: str
+    """
     check_cloudformation_capabilities(config["Capabilities"])
     try:
-        client.create_stack(**config)
+        response = client.create_stack(**config)
         LOGGER.info(f"Started CloudFormation with: \
                      \n -stack name: {config['StackName']} \
                      \n -from template URL: {config['TemplateURL']}")
-    except Exception as e:
-        
-        LOGGER.error(f"An error occurred: {e}")
-        exit(1)
+        return response["StackId"]
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"create stack {config['StackName']}")
 
 
 def check_cloudformation_capabilities(capabilities) -> bool:
@@ -88,21 +334,62 @@ def check_cloudformation_capabilities(capabilities) -> bool:
     return True
 
 
-def ecr_login(ecr_client) -> Dict[str, str]:
-    # Authenticate the Docker client with AWS credentials
+def get_ecr_auth_path(registry: str) -> str:
+    return os.path.join(ECR_AUTH_CACHE_DIR, hashlib.sha256(registry.encode("utf-8")).hexdigest() + ".json")
 
-    auth_response = ecr_client.get_authorization_token()
-    token = auth_response['authorizationData'][0]['authorizationToken']
-    username, password = base64.b64decode(token).decode('utf-8').split(':')
 
-    ecr_login_command = f'docker login -u {username} -p {password} \
-        {auth_response["authorizationData"][0]["proxyEndpoint"]}'
-    
-    subprocess.call(ecr_login_command, shell=True)
+def load_ecr_auth(registry: str) -> Dict[str, Any]:
+    """Load the cached ECR token of a registry, None when missing or unreadable."""
+    try:
+        with open(get_ecr_auth_path(registry), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
 
+def save_ecr_auth(registry: str, auth: Dict[str, Any]) -> None:
+    """Save the ECR token of a registry, readable by the current user only."""
+    os.makedirs(ECR_AUTH_CACHE_DIR, mode=0o700, exist_ok=True)
+    path = get_ecr_auth_path(registry)
+    tmp_path = f"{path}.{os.getpid()}"
+    with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as f:
+        json.dump(auth, f)
+    os.replace(tmp_path, path)
 
-def get_ecr_repository_uri(ecr_client, repository_name: str) -> Dict[str, str]:
-    """Get ECR repository."""
+
+def forget_ecr_auth(registry: str) -> None:
+    """Drop the cached ECR token of a registry, after the registry rejected it."""
+    with ECR_AUTH_LOCK:
+        ECR_AUTH_CACHE.pop(registry, None)
+        if(os.path.exists(get_ecr_auth_path(registry))):
+            os.remove(get_ecr_auth_path(registry))
+
+
+def get_ecr_auth_config(ecr_client, registry: str) -> Dict[str, str]:
+    """Get the Docker SDK auth config of an ECR registry.
+
+    The authorization token is cached in process and on disk until
+    ECR_AUTH_MIN_VALIDITY seconds before it expires, so the environments and
+    runs pushing to one registry share a token instead of logging in again.
+    """
+    with ECR_AUTH_LOCK:
+        auth = ECR_AUTH_CACHE.get(registry) or load_ecr_auth(registry)
+        if(auth is None or auth["expires_at"] - time.time() < ECR_AUTH_MIN_VALIDITY):
+            try:
+                data = ecr_client.get_authorization_token()["authorizationData"][0]
+            except (ClientError, BotoCoreError) as e:
+                raise to_aws_call_exception(e, f"get ECR authorization token for {registry}")
+            username, password = base64.b64decode(data["authorizationToken"]).decode("utf-8").split(":", 1)
+            auth = {"username": username, "password": password, "serveraddress": data["proxyEndpoint"],
+                    "expires_at": data["expiresAt"].timestamp()}
+            save_ecr_auth(registry, auth)
+            add_metrics(ecr_auth_fetched=1)
+        ECR_AUTH_CACHE[registry] = auth
+    return {key: auth[key] for key in ("username", "password", "serveraddress")}
+
+
+def get_ecr_repository_uri(ecr_client, repository_name: str) -> str:
+    """Get ECR repository URI, None if the repository does not exist."""
     try:
         response = ecr_client.describe_repositories(repositoryNames=[repository_name])
         LOGGER.info(f"Got ECR repository with name: {repository_name}")
@@ -110,64 +397,105 @@ def get_ecr_repository_uri(ecr_client, repository_name: str) -> Dict[str, str]:
     except ecr_client.exceptions.RepositoryNotFoundException:
         LOGGER.info(f"ECR repository with name {repository_name} does not exist.")
         return None
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'InvalidParameterException':
-            LOGGER.error(f"InvalidParameterException: {e}")
-            raise Exception(f"InvalidParameterException: {e}")
-        elif e.response['Error']['Code'] == 'RepositoryNotFoundException':
-            LOGGER.error(f"RepositoryNotFoundException: {e}")
-            raise Exception(f"RepositoryNotFoundException: {e}")
-        else:
-            LOGGER.error(f"An error occurred: {e}")
-            raise Exception(f"An error occurred: {e}")
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"describe ECR repository {repository_name}")
+
 
+def create_ecr_repository(ecr_client, repository_name: str) -> str:
+    """Create ECR repository if it does not exist.
 
-def create_ecr_repository(ecr_client, repository_name: str) -> None:
-    """Create ECR repository."""
+    :return: Repository URI, of the existing repository if another run created it first.
+    :rtype: str
+    """
     repository_uri = get_ecr_repository_uri(ecr_client, repository_name)
     if(repository_uri is not None): return repository_uri
     
     try:
         response = ecr_client.create_repository(repositoryName=repository_name)
         LOGGER.info(f"Created ECR repository with name: {repository_name}")
-        return response
+        return response['repository']['repositoryUri']
     except ecr_client.exceptions.RepositoryAlreadyExistsException:
         LOGGER.info(f"ECR repository with name {repository_name} already exists.")
+        return get_ecr_repository_uri(ecr_client, repository_name)
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"create ECR repository {repository_name}")
+
+
+def delete_ecr_repository(ecr_client, repository_name: str) -> None:
+    """Delete ECR repository with its images, missing repositories are skipped."""
+    try:
+        ecr_client.delete_repository(repositoryName=repository_name, force=True)
+        LOGGER.info(f"Deleted ECR repository with name: {repository_name}")
+    except ecr_client.exceptions.RepositoryNotFoundException:
+        LOGGER.info(f"ECR repository with name {repository_name} does not exist.")
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"delete ECR repository {repository_name}")
+
+
+def get_ecr_image_digest(ecr_client, repository_name: str, image_tag: str) -> str:
+    """Get the digest of an ECR image by tag, None if the tag does not exist."""
+    try:
+        response = ecr_client.describe_images(repositoryName=repository_name,
+                                              imageIds=[{'imageTag': image_tag}])
+        return response['imageDetails'][0]['imageDigest']
+    except ecr_client.exceptions.ImageNotFoundException:
+        LOGGER.info(f"ECR image {repository_name}:{image_tag} does not exist.")
         return None
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'InvalidParameterException':
-            LOGGER.error(f"InvalidParameterException: {e}")
-            raise Exception(f"InvalidParameterException: {e}")
-        elif e.response['Error']['Code'] == 'RepositoryAlreadyExistsException':
-            LOGGER.error(f"RepositoryAlreadyExistsException: {e}")
-            raise Exception(f"RepositoryAlreadyExistsException: {e}")
-        else:
-            LOGGER.error(f"An error occurred: {e}")
-            raise Exception(f"An error occurred: {e}")
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"describe ECR image {repository_name}:{image_tag}")
 
 
-def push_to_ecr(docker_client: DockerClient, 
+def push_to_ecr(docker_client: "DockerClient", 
                 ecr_client, 
                 dockerfile: str,
-                repository_name: str) -> None:
+                repository_name: str,
+                repository_uri: str = None,
+                local_image: Callable[[], str] = None) -> str:
     """Push Docker image to AWS ECR.
-    :return type: None
+
+    The image is tagged with the content hash of the build context. The build
+    is skipped when that tag exists locally and the push is skipped when ECR
+    already holds it.
+
+    :param repository_uri: Known repository URI, skips the repository lookup.
+    :param local_image: Returns the name of an image built from the same build context, tagged instead of building.
+    :return: Image URI tagged with the build context hash.
+    :rtype: str
     """
 
     # create ECR repository if it does not exist and return repository URI
-    repository_uri = create_ecr_repository(ecr_client, repository_name)
+    if(repository_uri is None):
+        repository_uri = create_ecr_repository(ecr_client, repository_name)
+    image_tag = compute_build_context_hash(dockerfile)
+    image_uri = f"{repository_uri}:{image_tag}"
+
+    image_digest = get_ecr_image_digest(ecr_client, repository_name, image_tag)
+    if(image_digest is not None):
+        LOGGER.info(f"Image {image_uri} already in AWS ECR with digest {image_digest}, skipping push.")
+        return image_uri
 
-    # login to AWS ECR
-    ecr_login(ecr_client)
+    # ECR credentials for the push, no docker login needed
+    registry = repository_uri.split("/")[0]
+    with start_span("ecr.auth", registry=registry):
+        auth_config = get_ecr_auth_config(ecr_client, registry)
 
     # build Docker image and tag directly for AWS ECR
-    image = build_docker_image(docker_client, dockerfile, repository_uri + ':latest')
+    if(local_image is not None):
+        image_name = local_image()
+        with start_span("docker.tag", image=image_name, tag=image_uri):
+            docker_client.images.get(image_name).tag(repository_uri, tag=image_tag)
+    else:
+        build_docker_image(docker_client, dockerfile, image_uri)
     
     # push image to AWS ECR
-    push_log = docker_client.images.push(repository_uri, tag='latest')
-    LOGGER.info(f"Pushed image to AWS ECR with tag: latest")
-    LOGGER.debug(f"Push log: {push_log}")
-    return repository_uri + ':latest'
+    try:
+        push_docker_image(docker_client, repository_uri, image_tag, auth_config)
+    except DockerException:
+        # a revoked or rejected token is fetched again by the next push
+        forget_ecr_auth(registry)
+        raise
+    LOGGER.info(f"Pushed image to AWS ECR with tag: {image_tag}")
+    return image_uri
 
 
 def read_aws_credentials(filename: str='.aws_credentials.json') -> Dict[str, str]:
@@ -220,11 +548,27 @@ def upload_to_secret_manager(client, secret_name: str, secret_value: str) -> Non
         if e.response['Error']['Code'] == 'ResourceExistsException':
             LOGGER.info(f"Secret with name {secret_name} already exists.")
             return None
-        else:
-            LOGGER.error(f"An error occurred: {e}")
-            exit(1)
-    except Exception as e:
-        LOGGER.error(f"An error occurred: {e}")
-        exit(1)
+        raise to_aws_call_exception(e, f"create secret {secret_name}")
+    except BotoCoreError as e:
+        raise to_aws_call_exception(e, f"create secret {secret_name}")
 
 
+def delete_secret(client, secret_name: str, force: bool = True) -> None:
+    """Delete secret from AWS Secret Manager, missing secrets are skipped.
+
+    :param force: Delete right away instead of scheduling the deletion, so
+        that a secret with the same name can be created again.
+    """
+    try:
+        if(force):
+            client.delete_secret(SecretId=secret_name, ForceDeleteWithoutRecovery=True)
+        else:
+            client.delete_secret(SecretId=secret_name)
+        LOGGER.info(f"Deleted secret from AWS Secret Manager with name: {secret_name}")
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            LOGGER.info(f"Secret with name {secret_name} does not exist.")
+            return
+        raise to_aws_call_exception(e, f"delete secret {secret_name}")
+    except BotoCoreError as e:
+        raise to_aws_call_exception(e, f"delete secret {secret_name}")
@@ -0,0 +1,85 @@
+from typing import Any, Dict, List
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tarfile
+
+from constants import SCRIPTS_DIR, BUNDLES_DIR, BUNDLE_ROLES
+
+LOGGER = logging.getLogger()
+
+BUNDLE_MANIFEST_DIR = "manifests"
+
+def compute_bundle_manifest(role: str, source_dirs: List[str], base_dir: str = SCRIPTS_DIR) -> Dict[str, Any]:
+    """Describe the files of a bundle with their path inside the bundle, size, mode and sha256."""
+    files = []
+    for source_dir in source_dirs:
+        for root, _, names in os.walk(source_dir):
+            for name in names:
+                file_path = os.path.join(root, name)
+                with open(file_path, "rb") as f:
+                    content = f.read()
+                files.append({
+                    "path": os.path.relpath(file_path, base_dir).replace(os.sep, "/"),
+                    "size": len(content),
+                    "mode": 0o755 if name.endswith(".sh") else 0o644,
+                    "sha256": hashlib.sha256(content).hexdigest()
+                })
+    files.sort(key=lambda file: file["path"])
+    return {"role": role, "files": files}
+
+
+def add_bundle_member(tar: tarfile.TarFile, name: str, content: bytes, mode: int) -> None:
+    # Fixed metadata so that the same content always produces the same archive
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    info.mode = mode
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = "root"
+    tar.addfile(info, io.BytesIO(content))
+
+
+def build_bundle(role: str, source_dirs: List[str], output_dir: str = BUNDLES_DIR,
+                 base_dir: str = SCRIPTS_DIR) -> str:
+    """Build a deterministic, content-hashed tar.gz bundle of the scripts of a role.
+
+    The bundle contains the files of source_dirs relative to base_dir and a
+    manifests/<role>.json manifest. Its name holds the hash of the manifest,
+    so an unchanged bundle is not rebuilt and keeps the same S3 key.
+
+    :return: Path of the bundle.
+    :rtype: str
+    """
+    manifest = compute_bundle_manifest(role, source_dirs, base_dir)
+    manifest_content = json.dumps(manifest, indent=2, sort_keys=True).encode()
+    bundle_hash = hashlib.sha256(manifest_content).hexdigest()[:12]
+    bundle_path = os.path.join(output_dir, f"{role}-{bundle_hash}.tar.gz")
+    if(os.path.exists(bundle_path)):
+        LOGGER.info(f"Bundle {bundle_path} is up to date")
+        return bundle_path
+
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = f"{bundle_path}.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0) as gz:
+            with tarfile.open(fileobj=gz, mode="w", format=tarfile.PAX_FORMAT) as tar:
+                add_bundle_member(tar, f"{BUNDLE_MANIFEST_DIR}/{role}.json", manifest_content, 0o644)
+                for file in manifest["files"]:
+                    with open(os.path.join(base_dir, file["path"]), "rb") as source:
+                        add_bundle_member(tar, file["path"], source.read(), file["mode"])
+    os.replace(tmp_path, bundle_path)
+    LOGGER.info(f"Built bundle {bundle_path} with {len(manifest['files'])} files")
+    return bundle_path
+
+
+def build_bundles(roles: Dict[str, List[str]] = BUNDLE_ROLES, output_dir: str = BUNDLES_DIR) -> Dict[str, str]:
+    """Build the bundle of every role.
+
+    :return: Bundle path by role.
+    :rtype: Dict[str, str]
+    """
+    return {role: build_bundle(role, source_dirs, output_dir) for role, source_dirs in roles.items()}
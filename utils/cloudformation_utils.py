@@ -0,0 +1,313 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+from botocore.exceptions import BotoCoreError, ClientError
+from utils.aws_utils import to_aws_call_exception
+from utils.exceptions import StackOperationException
+from utils.trace_utils import submit, add_metrics, record_span
+import logging
+import time
+
+LOGGER = logging.getLogger()
+
+NESTED_STACK_RESOURCE_TYPE = "AWS::CloudFormation::Stack"
+THROTTLING_ERROR_CODES = {"Throttling", "ThrottlingException", "RequestLimitExceeded", "TooManyRequestsException"}
+SUCCESS_STACK_STATUSES = {"CREATE_COMPLETE", "UPDATE_COMPLETE", "DELETE_COMPLETE", "IMPORT_COMPLETE"}
+# statuses of a stack whose creation or deletion failed, it can only be deleted
+DELETE_ONLY_STACK_STATUSES = {"ROLLBACK_COMPLETE", "ROLLBACK_FAILED", "DELETE_FAILED"}
+
+
+def is_terminal_status(status: str) -> bool:
+    """Check if a stack status is terminal."""
+    return status is not None and status.endswith("_IN_PROGRESS") == False
+
+
+def new_stack_state(stack_id: str, name: str) -> Dict[str, Any]:
+    """Create the polling state of a stack."""
+    return {
+        "stack_id": stack_id,
+        "name": name,
+        "seen_event_ids": set(),
+        "status": None,
+        "started_at": None,
+        "finished_at": None,
+        "delay": None,
+        "next_poll": 0.0
+    }
+
+
+def get_new_stack_events(client, state: Dict[str, Any], since: datetime) -> List[Dict[str, Any]]:
+    """Get the events of a stack not seen before, newest first.
+
+    Pagination stops at the first already seen event or at the first event
+    older than since, so a poll usually costs a single API call.
+    """
+    events = []
+    paginator = client.get_paginator("describe_stack_events")
+    for page in paginator.paginate(StackName=state["stack_id"]):
+        for event in page["StackEvents"]:
+            if(event["EventId"] in state["seen_event_ids"] or event["Timestamp"] < since):
+                return events
+            state["seen_event_ids"].add(event["EventId"])
+            events.append(event)
+    return events
+
+
+def poll_stack(client, state: Dict[str, Any], since: datetime, min_delay: float, max_delay: float) -> List[Dict[str, Any]]:
+    """Poll a stack once and adapt its polling delay.
+
+    The delay resets to min_delay when new events show up, grows by half
+    when nothing changed and doubles when the API throttles.
+    """
+    try:
+        events = get_new_stack_events(client, state, since)
+    except ClientError as e:
+        if(e.response["Error"]["Code"] not in THROTTLING_ERROR_CODES): raise
+        state["delay"] = min(max_delay, (state["delay"] or min_delay) * 2)
+        LOGGER.debug(f"Throttled while polling {state['name']}, next poll in {state['delay']:.1f}s")
+        events = []
+    else:
+        if(len(events) > 0):
+            state["delay"] = min_delay
+        else:
+            state["delay"] = min(max_delay, (state["delay"] or min_delay) * 1.5)
+    state["next_poll"] = time.monotonic() + state["delay"]
+    return events
+
+
+def log_stack_event(event: Dict[str, Any], stack_name: str) -> None:
+    """Log a stack event as one timeline line."""
+    reason = event.get("ResourceStatusReason")
+    LOGGER.info(f"{event['Timestamp']:%H:%M:%S} [{stack_name}] {event['LogicalResourceId']} "
+                f"({event['ResourceType']}) {event['ResourceStatus']}" + (f": {reason}" if reason else ""))
+
+
+def wait_for_stack(client,
+                   stack_id: str,
+                   min_delay: float = 5.0,
+                   max_delay: float = 30.0,
+                   timeout: float = 5400.0) -> Dict[str, Dict[str, Any]]:
+    """Wait for a stack operation and stream the events of the stack and its nested stacks.
+
+    Nested stacks are discovered from the AWS::CloudFormation::Stack events
+    of their parents and polled concurrently. Events are deduplicated by
+    EventId and logged as one timeline ordered by timestamp.
+
+    :return: Status and duration in seconds of each stack, keyed by stack name.
+    :rtype: Dict[str, Dict[str, Any]]
+    """
+    since = datetime.now(timezone.utc) - timedelta(seconds=5)
+    root = new_stack_state(stack_id, stack_id.split("/")[1] if stack_id.startswith("arn:") else stack_id)
+    stacks = {stack_id: root}
+    deadline = time.monotonic() + timeout
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        while(is_terminal_status(root["status"]) == False):
+            if(time.monotonic() > deadline):
+                raise StackOperationException(f"Timed out waiting for stack {root['name']}", root["status"])
+
+            now = time.monotonic()
+            due = [state for state in stacks.values()
+                   if state["next_poll"] <= now and state["finished_at"] is None]
+            polls = [(state, submit(executor, poll_stack, client, state, since, min_delay, max_delay))
+                     for state in due]
+
+            timeline = []
+            for state, future in polls:
+                for event in future.result():
+                    timeline.append((event, state))
+            add_metrics(stack_polls=len(polls), stack_events=len(timeline))
+
+            for event, state in sorted(timeline, key=lambda item: item[0]["Timestamp"]):
+                log_stack_event(event, state["name"])
+                physical_id = event.get("PhysicalResourceId")
+                if(event["ResourceType"] == NESTED_STACK_RESOURCE_TYPE and physical_id == event["StackId"]):
+                    state["started_at"] = state["started_at"] or event["Timestamp"]
+                    state["status"] = event["ResourceStatus"]
+                    if(is_terminal_status(state["status"])):
+                        state["finished_at"] = event["Timestamp"]
+                elif(event["ResourceType"] == NESTED_STACK_RESOURCE_TYPE and
+                     physical_id and physical_id.startswith("arn:") and physical_id not in stacks):
+                    stacks[physical_id] = new_stack_state(physical_id, event["LogicalResourceId"])
+                    LOGGER.info(f"Discovered nested stack {event['LogicalResourceId']}")
+
+            pending = [state["next_poll"] for state in stacks.values() if state["finished_at"] is None]
+            if(is_terminal_status(root["status"]) == False and len(pending) > 0):
+                time.sleep(max(0.0, min(pending) - time.monotonic()))
+
+    report = {}
+    for state in stacks.values():
+        duration = None
+        if(state["started_at"] is not None and state["finished_at"] is not None):
+            duration = (state["finished_at"] - state["started_at"]).total_seconds()
+            record_span("cloudformation.stack", int(state["started_at"].timestamp() * 1e9),
+                        int(state["finished_at"].timestamp() * 1e9), stack=state["name"], status=state["status"])
+        report[state["name"]] = {"status": state["status"], "duration": duration}
+
+    LOGGER.info(f"Stack {root['name']} finished with status {root['status']}. Durations:")
+    for name, result in sorted(report.items(), key=lambda item: -(item[1]["duration"] or 0)):
+        duration = f"{result['duration']:.0f}s" if result["duration"] is not None else "n/a"
+        LOGGER.info(f" -{name}: {duration} ({result['status']})")
+
+    if(root["status"] not in SUCCESS_STACK_STATUSES):
+        raise StackOperationException(f"Stack {root['name']} finished with status {root['status']}", root["status"])
+    return report
+
+
+def get_change_set_type(client, stack_name: str) -> str:
+    """Get the type of the change set deploying a stack.
+
+    A stack in REVIEW_IN_PROGRESS was created by a CREATE change set that
+    was never executed, it exists but is deployed by another CREATE one.
+
+    :return: UPDATE for a stack that can be updated, CREATE for a stack under review, None if it has to be created.
+    :rtype: str
+    :raises StackOperationException: If the stack exists but can be neither updated nor created.
+    """
+    try:
+        response = client.describe_stacks(StackName=stack_name)
+    except ClientError as e:
+        if(e.response["Error"]["Code"] == "ValidationError" and "does not exist" in str(e)):
+            return None
+        raise to_aws_call_exception(e, f"describe stack {stack_name}")
+    except BotoCoreError as e:
+        raise to_aws_call_exception(e, f"describe stack {stack_name}")
+    status = response["Stacks"][0]["StackStatus"]
+    if(status == "DELETE_COMPLETE"):
+        return None
+    if(status == "REVIEW_IN_PROGRESS"):
+        LOGGER.info(f"Stack {stack_name} is under review, it is created through a new change set")
+        return "CREATE"
+    if(status in DELETE_ONLY_STACK_STATUSES):
+        raise StackOperationException(f"Stack {stack_name} is in status {status} and cannot be updated, "
+                                      f"delete the stack and deploy again", status)
+    if(status == "UPDATE_ROLLBACK_FAILED"):
+        raise StackOperationException(f"Stack {stack_name} is in status {status}, continue its rollback "
+                                      f"(aws cloudformation continue-update-rollback) and deploy again", status)
+    if(is_terminal_status(status) == False):
+        raise StackOperationException(f"Stack {stack_name} has an operation in progress ({status}), "
+                                      f"wait for it to finish and deploy again", status)
+    return "UPDATE"
+
+
+def delete_stack(client, stack_name: str) -> str:
+    """Start the deletion of a stack.
+
+    :return: Stack id to wait on, None if the stack does not exist.
+    :rtype: str
+    """
+    try:
+        response = client.describe_stacks(StackName=stack_name)
+    except ClientError as e:
+        if(e.response["Error"]["Code"] == "ValidationError" and "does not exist" in str(e)):
+            LOGGER.info(f"Stack {stack_name} does not exist.")
+            return None
+        raise to_aws_call_exception(e, f"describe stack {stack_name}")
+    except BotoCoreError as e:
+        raise to_aws_call_exception(e, f"describe stack {stack_name}")
+    stack = response["Stacks"][0]
+    if(stack["StackStatus"] == "DELETE_COMPLETE"): return None
+    client.delete_stack(StackName=stack["StackId"])
+    LOGGER.info(f"Deleting stack {stack_name}")
+    return stack["StackId"]
+
+
+def create_change_set(client, config: Dict[str, Any], change_set_type: str = "UPDATE") -> str:
+    """Create a change set, including nested stacks, from the stack config.
+
+    :return: Change set id.
+    :rtype: str
+    """
+    change_set_name = f"{config['StackName']}-{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+    response = client.create_change_set(
+        ChangeSetName=change_set_name,
+        ChangeSetType=change_set_type,
+        IncludeNestedStacks=True,
+        **config
+    )
+    LOGGER.info(f"Created change set {change_set_name} for stack {config['StackName']}")
+    return response["Id"]
+
+
+def wait_for_change_set(client, change_set_id: str, delay: float = 5.0, timeout: float = 600.0) -> bool:
+    """Wait for a change set to be computed.
+
+    Empty change sets are deleted right away.
+
+    :return: True if the change set contains changes, False if it is empty.
+    :rtype: bool
+    """
+    deadline = time.monotonic() + timeout
+    while(True):
+        response = client.describe_change_set(ChangeSetName=change_set_id)
+        status = response["Status"]
+        if(status == "CREATE_COMPLETE"):
+            return True
+        if(status == "FAILED"):
+            reason = response.get("StatusReason", "")
+            if("didn't contain changes" in reason or "No updates are to be performed" in reason):
+                client.delete_change_set(ChangeSetName=change_set_id)
+                return False
+            raise StackOperationException(f"Change set {change_set_id} failed: {reason}", status)
+        if(time.monotonic() > deadline):
+            raise StackOperationException(f"Timed out waiting for change set {change_set_id}", status)
+        time.sleep(delay)
+
+
+def get_change_set_plan(client, change_set_id: str, stack_path: str = "") -> List[Dict[str, Any]]:
+    """Get the resource changes of a change set, following nested stack change sets."""
+    plan = []
+    kwargs = {"ChangeSetName": change_set_id}
+    while(True):
+        response = client.describe_change_set(**kwargs)
+        path = f"{stack_path}/{response['StackName']}" if stack_path else response["StackName"]
+        for change in response["Changes"]:
+            resource_change = change["ResourceChange"]
+            plan.append({
+                "Stack": path,
+                "Action": resource_change["Action"],
+                "LogicalResourceId": resource_change["LogicalResourceId"],
+                "ResourceType": resource_change["ResourceType"],
+                "Replacement": resource_change.get("Replacement", "")
+            })
+            if(resource_change.get("ChangeSetId")):
+                plan.extend(get_change_set_plan(client, resource_change["ChangeSetId"], path))
+        if(response.get("NextToken") is None): break
+        kwargs["NextToken"] = response["NextToken"]
+    return plan
+
+
+def log_change_set_plan(plan: List[Dict[str, Any]]) -> None:
+    """Log the change set plan, one resource change per line."""
+    LOGGER.info(f"Change set plan ({len(plan)} resource changes):")
+    for change in plan:
+        replacement = " (Replace)" if change["Replacement"] == "True" else \
+            (" (Conditional replace)" if change["Replacement"] == "Conditional" else "")
+        LOGGER.info(f" -{change['Action']}{replacement} {change['Stack']}/{change['LogicalResourceId']} "
+                    f"({change['ResourceType']})")
+
+
+def update_stack(client, config: Dict[str, Any], execute: bool = False, change_set_type: str = "UPDATE") -> str:
+    """Update a stack through a change set.
+
+    The change set is computed and its plan logged. Empty change sets end
+    the update right away, non-empty ones are executed only on request.
+    A stack under review is deployed the same way with a CREATE change set.
+
+    :return: Stack id if the change set was executed, None otherwise.
+    :rtype: str
+    """
+    change_set_id = create_change_set(client, config, change_set_type)
+    if(wait_for_change_set(client, change_set_id) == False):
+        LOGGER.info(f"No changes to stack {config['StackName']}, nothing to update.")
+        return None
+
+    log_change_set_plan(get_change_set_plan(client, change_set_id))
+    if(execute == False):
+        LOGGER.info(f"Change set {change_set_id} was not executed, run with --execute-change-set to apply it.")
+        return None
+
+    response = client.describe_change_set(ChangeSetName=change_set_id)
+    client.execute_change_set(ChangeSetName=change_set_id)
+    LOGGER.info(f"Executing change set {change_set_id} on stack {config['StackName']}")
+    return response["StackId"]
@@ -1,51 +1,147 @@
 from argparse import ArgumentParser
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
+import hashlib
+import json
 import logging
-import logging.config
-import yaml
 import os
 
-from constants import DEFAULT_CONFIG, TEMPLATES_DIR, KEYCLOAK_ADMIN_PWD_SECRET_ID
+from utils.exceptions import ConfigException
+from utils.trace_utils import TRACE_FORMATS
+from constants import DEFAULT_CONFIG, TEMPLATES_DIR, KEYCLOAK_ADMIN_PWD_SECRET_ID, BUNDLE_PARAMETERS, CONFIG_CACHE_DIR
 
-def parse_args() -> Dict[str, str]:
-    """Parse command line arguments."""
+def parse_args(argv: List[str] = None) -> Dict[str, str]:
+    """Parse command line arguments, those of the program when argv is None."""
     parser = ArgumentParser(
         description="High Availability AWS self-managed Kubernetes cluster deployment helper", 
         add_help=True) 
-    parser.add_argument("-c", "--config", help="Path to config file", default="config/default.yaml")
-    args = parser.parse_args()
+    parser.add_argument("-c", "--config", nargs="+", default=[DEFAULT_CONFIG],
+                        help="Path to config files, one deployment per config or per entry of its matrix")
+    parser.add_argument("--execute-change-set", action="store_true", 
+                        help="Execute the change set computed for an existing stack")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignore the local deployment state and revalidate every step against AWS")
+    parser.add_argument("--validate", action="store_true",
+                        help="Only analyze the CloudFormation templates and exit")
+    parser.add_argument("--destroy", action="store_true",
+                        help="Delete the stack, buckets, ECR repository and secret of each environment")
+    parser.add_argument("--timelines", action="store_true",
+                        help="Collect the boot phase records of the nodes of each environment and report the phase "
+                             "latencies and the critical path to a ready cluster")
+    parser.add_argument("--release", metavar="RELEASE_ID",
+                        help="Deploy a release already published to the bucket, e.g. to roll back, "
+                             "instead of publishing the local templates and scripts")
+    parser.add_argument("--plan", action="store_true",
+                        help="Record the AWS and Docker calls of the deployment against a local stand-in "
+                             "instead of executing them")
+    parser.add_argument("--replay", metavar="CALLS_FILE",
+                        help="Plan with the latencies of the calls recorded by a previous run")
+    parser.add_argument("--record", metavar="CALLS_FILE",
+                        help="Save the calls of the run, with their parameters and latencies")
+    parser.add_argument("--trace", metavar="TRACE_FILE",
+                        help="Save the spans and metrics of every step of the run")
+    parser.add_argument("--trace-format", choices=TRACE_FORMATS, default="chrome",
+                        help="Chrome trace event format, for chrome://tracing or Perfetto, or OTLP JSON")
+    args = parser.parse_args(argv)
     return vars(args)
 
 
+# expected type of each config key: a type, a tuple of accepted types, [type] for a list of that type or a
+# dict for a section whose keys are all checked, None is accepted in place of a missing optional key
+SCALAR_TYPES = (str, int, float, bool)
+CONFIG_SCHEMA = {
+    "project": {
+        "name": str,
+        "environment": {
+            "name": str,
+            "region": str
+        }
+    },
+    "logging": dict,
+    "cloudformation": {
+        "StackName": str,
+        "TemplateURL": (str, type(None)),
+        "Capabilities": [str],
+        "Parameters": (dict, type(None))
+    }
+}
+
+
+class FrozenDict(dict):
+    """Read only dict of a compiled config, still a dict for boto3, json and logging."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Compiled configs are read only, derive a new config with merge_configs")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+
+def freeze(value: Any) -> Any:
+    """Turn dicts and lists into read only FrozenDicts and tuples, recursively."""
+    if(isinstance(value, dict)):
+        return FrozenDict({key: freeze(item) for key, item in value.items()})
+    if(isinstance(value, (list, tuple))):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value: Any) -> Any:
+    """Mutable copy of a frozen value, for APIs that modify what they are given."""
+    if(isinstance(value, dict)):
+        return {key: thaw(item) for key, item in value.items()}
+    if(isinstance(value, (list, tuple))):
+        return [thaw(item) for item in value]
+    return value
+
+
+def validate_config(config: Dict[str, Any], schema: Dict[str, Any] = CONFIG_SCHEMA, path: str = "") -> List[str]:
+    """Check a config against the schema, unknown keys are rejected in every section but the root."""
+    errors = []
+    if(path != ""):
+        for key in config:
+            if(key not in schema):
+                errors.append(f"{path}{key}: unknown key, expected one of {', '.join(schema)}")
+    for key, expected in schema.items():
+        value = config.get(key)
+        if(isinstance(expected, dict)):
+            if(isinstance(value, dict)):
+                errors.extend(validate_config(value, expected, f"{path}{key}."))
+            else:
+                errors.append(f"{path}{key}: expected a section, got {type(value).__name__}")
+        elif(isinstance(expected, list)):
+            if(isinstance(value, (list, tuple)) == False or
+               any(isinstance(item, expected[0]) == False for item in value)):
+                errors.append(f"{path}{key}: expected a list of {expected[0].__name__}, got {value!r}")
+        elif(isinstance(value, expected) == False):
+            names = " or ".join(t.__name__ for t in (expected if isinstance(expected, tuple) else (expected,)))
+            errors.append(f"{path}{key}: expected {names}, got {type(value).__name__}")
+    return errors
+
+
+def validate_cloudformation_parameters(parameters: Dict[str, Any]) -> List[str]:
+    """Check that every stack parameter is a scalar or a list, as CloudFormation only takes strings."""
+    return [f"cloudformation.Parameters.{key}: expected a scalar or a list, got {type(value).__name__}"
+            for key, value in (parameters or {}).items() if isinstance(value, SCALAR_TYPES + (list,)) == False]
+
+
 def parse_cloudformation_config(cloudformation_config: Dict[str, Any]) -> Dict[str, Any]:
-    config_dict = {}
-
-    for key,value in cloudformation_config.items():
-        if(key == "StackName"):
-            config_dict[key] = value
-        elif(key == "TemplateURL"):
-            config_dict[key] = value
-        elif(key == "Parameters"):
-            config_dict[key] = parse_cloudformation_parameters(value)
-        elif(key == "Capabilities"):
-            config_dict[key] = value
-        else:
-            print(Warning("Invalid cloudformation config key: {}".format(key)))
-    
+    """Turn the cloudformation section into CreateStack arguments."""
+    config_dict = {key: value for key, value in cloudformation_config.items() if value is not None}
+    config_dict["Parameters"] = parse_cloudformation_parameters(cloudformation_config.get("Parameters"))
     return config_dict
 
 
-def parse_cloudformation_parameters(cloudformation_parameters: Dict[str, Any]) -> Dict[str, Any]:
-    cf_params = []
-    i = 0
-    if(cloudformation_parameters is None): return cf_params
-    for key,value in cloudformation_parameters.items():
-        cf_params[i] = {
-            "ParameterKey": key,
-            "ParameterValue": value
-        }
-        i += 1
-    return cf_params
+def parse_cloudformation_parameters(cloudformation_parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Turn a mapping of parameters into the parameter list of CreateStack, lists become comma delimited."""
+    if(cloudformation_parameters is None): return []
+    return [generate_cloudformation_parameters(key, to_parameter_value(value))
+            for key, value in cloudformation_parameters.items()]
+
+
+def to_parameter_value(value: Any) -> str:
+    if(isinstance(value, bool)): return str(value).lower()
+    if(isinstance(value, (list, tuple))): return ",".join(to_parameter_value(item) for item in value)
+    return str(value)
 
 
 def generate_cloudformation_parameters(key: str, value: str) -> Dict[str, Any]:
@@ -55,61 +151,65 @@ def generate_cloudformation_parameters(key: str, value: str) -> Dict[str, Any]:
     }
 
 
-def auto_configure_cloudformation(config: Dict[str, Any], bucket_name: str, kc_cache_bucket_name: str, image_uri: str) -> None:
-    """Auto configure cloudformation."""
-
-    config["cloudformation"]["TemplateURL"] = \
-        f"https://s3.amazonaws.com/{bucket_name}/{TEMPLATES_DIR}/main.yaml"
+def get_keycloak_admin_secret_id(config: Dict[str, Any]) -> str:
+    """Get the Keycloak admin password secret id, one secret per environment of a region."""
+    return f"{config['project']['name']}/{config['project']['environment']['name']}/{KEYCLOAK_ADMIN_PWD_SECRET_ID}"
 
-    config["cloudformation"]["Parameters"].append(
-        generate_cloudformation_parameters("EnvironmentName", 
-                                           config["project"]["environment"]["name"]))
 
-    config["cloudformation"]["Parameters"].append(
-        generate_cloudformation_parameters("ProjectName", config["project"]["name"]))
-    
-    config["cloudformation"]["Parameters"].append(
-        generate_cloudformation_parameters("S3BucketName", bucket_name))
+def auto_configure_cloudformation(config: Dict[str, Any], bucket_name: str, kc_cache_bucket_name: str, image_uri: str,
+                                  bundle_keys: Dict[str, str], release_prefix: str) -> Dict[str, Any]:
+    """Auto configure cloudformation.
 
-    config["cloudformation"]["Parameters"].append(generate_cloudformation_parameters(
-        "StackName", f"{config['project']['name']}-{config['project']['environment']['name']}"))
+    :return: CreateStack arguments of the deployment, the configured parameters followed by the generated ones.
+    :rtype: Dict[str, Any]
+    """
+    project_name = config["project"]["name"]
+    environment_name = config["project"]["environment"]["name"]
+    generated = {
+        "EnvironmentName": environment_name,
+        "ProjectName": project_name,
+        "S3BucketName": bucket_name,
+        "StackName": f"{project_name}-{environment_name}",
+        "AuroraDBBootStrapLambdaRepositoryName": f"{project_name}/{environment_name}/lambda/dbbootstrap",
+        "AuroraDBBootStrapLambdaImageUri": image_uri,
+        "KeycloakAdminPasswordSecretId": get_keycloak_admin_secret_id(config),
+        "KeycloakCacheS3BucketName": kc_cache_bucket_name,
+        "ReleasePrefix": release_prefix,
+        **{BUNDLE_PARAMETERS[role]: key for role, key in bundle_keys.items()}
+    }
+    stack_config = thaw(config["cloudformation"])
+    stack_config["TemplateURL"] = f"https://s3.amazonaws.com/{bucket_name}/{release_prefix}/{TEMPLATES_DIR}/main.yaml"
+    stack_config["Parameters"] = stack_config.get("Parameters", []) + \
+        [generate_cloudformation_parameters(key, value) for key, value in generated.items()]
+    return stack_config
 
-    config["cloudformation"]["Parameters"].append(generate_cloudformation_parameters(
-        "AuroraDBBootStrapLambdaRepositoryName", 
-        f"{config['project']['name']}/{config['project']['environment']['name']}/lambda/dbbootstrap"))
-    
-    config["cloudformation"]["Parameters"].append(generate_cloudformation_parameters(
-        "AuroraDBBootStrapLambdaImageUri", image_uri))
-    
-    config["cloudformation"]["Parameters"].append(generate_cloudformation_parameters(
-        "KeycloakAdminPasswordSecretId", KEYCLOAK_ADMIN_PWD_SECRET_ID))
 
-    config["cloudformation"]["Parameters"].append(generate_cloudformation_parameters(
-        "KeycloakCacheS3BucketName", kc_cache_bucket_name))
+def load_yaml(path: str) -> Dict[str, Any]:
+    """Load a YAML file with the C loader of libyaml when available."""
+    import yaml
+    with open(path, "r") as f:
+        return yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)) or {}
 
 
 def parse_default_config() -> Dict[str, Any]:
     """Parse config file."""
-    with open(DEFAULT_CONFIG, "r") as f:
-        default_config = yaml.load(f, Loader=yaml.FullLoader)
-    return default_config
+    return load_yaml(DEFAULT_CONFIG)
 
 
 def parse_user_config(filePath: str) -> Dict[str, Any]:
     """Parse user config file."""
-    with open(filePath, "r") as f:
-        user_config = yaml.load(f, Loader=yaml.FullLoader)
-    return user_config
+    return load_yaml(filePath)
 
 
 def merge_configs(default_config: Dict[str, Any], user_config: Dict[str, Any]) -> Dict[str, Any]:
-    """Merge default and user configs."""
+    """Merge user config over default config into a new config, neither of them is modified."""
+    config = dict(default_config)
     for key,value in user_config.items():
-        if(isinstance(value, dict)):
-            default_config[key] = merge_configs(default_config.get(key, {}), value)
+        if(isinstance(value, dict) and isinstance(config.get(key), dict)):
+            config[key] = merge_configs(config[key], value)
         else:
-            default_config[key] = value
-    return default_config
+            config[key] = value
+    return config
 
 
 def parse_config(config_path: str) -> Dict[str, Any]:
@@ -127,13 +227,81 @@ def parse_config(config_path: str) -> Dict[str, Any]:
     return config
 
 
-def configure():
-    """Configure the program."""
-    args = parse_args()
-    config = parse_config(args["config"])
-    logging.config.dictConfig(config["logging"])
-    config["cloudformation"] = parse_cloudformation_config(config["cloudformation"])
-    return config
+def expand_matrix(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Expand the matrix of a config into one config per entry, each entry merged over the config."""
+    matrix = config.get("matrix")
+    config = {key: value for key, value in config.items() if key != "matrix"}
+    if(not matrix): return [config]
+    return [merge_configs(config, entry) for entry in matrix]
+
+
+def get_config_cache_key(config_paths: List[str]) -> str:
+    """Hash the config files, the default config and this module, so any edit compiles the configs again."""
+    digest = hashlib.sha256()
+    for path in [__file__, DEFAULT_CONFIG] + list(config_paths):
+        digest.update(path.encode("utf-8") + b"\0")
+        if(os.path.exists(path)):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def compile_configs(config_paths: List[str]) -> Tuple[FrozenDict, ...]:
+    """Load, merge, expand, validate and freeze the configs, caching the result on disk.
+
+    The cache is keyed by the content of the input files, so unchanged
+    configs are loaded without parsing YAML at all. It is stored as JSON,
+    loading it runs no code, and fresh results go through the same JSON
+    encoding so a cache hit returns the same values.
+
+    :return: One frozen config per deployment.
+    :rtype: Tuple[FrozenDict, ...]
+    """
+    cache_path = os.path.join(CONFIG_CACHE_DIR, get_config_cache_key(config_paths) + ".json")
+    if(os.path.exists(cache_path)):
+        with open(cache_path, "r") as f:
+            return tuple(freeze(config) for config in json.load(f))
+
+    configs = []
+    errors = []
+    for config_path in config_paths:
+        for i, config in enumerate(expand_matrix(parse_config(config_path))):
+            config_errors = validate_config(config)
+            if(len(config_errors) == 0):
+                config_errors = validate_cloudformation_parameters(config["cloudformation"]["Parameters"])
+            errors.extend(f"{config_path} (deployment {i}): {error}" for error in config_errors)
+            if(len(config_errors) == 0):
+                config["cloudformation"] = parse_cloudformation_config(config["cloudformation"])
+                configs.append(config)
+    if(len(errors) > 0):
+        raise ConfigException(f"Invalid config:\n" + "\n".join(errors), errors)
+
+    content = json.dumps(configs, default=str)
+    os.makedirs(CONFIG_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, cache_path)
+    return tuple(freeze(config) for config in json.loads(content))
+
+
+def configure(argv: List[str] = None) -> List[Dict[str, Any]]:
+    """Configure the program.
+
+    :return: One read only config per deployment, the logging config of the first one is applied.
+    :rtype: List[Dict[str, Any]]
+    """
+    args = parse_args(argv)
+    if(args["replay"] is not None):
+        args["plan"] = True
+    compiled = compile_configs(args["config"])
+    import logging.config
+    logging.config.dictConfig(thaw(compiled[0]["logging"]))
+    overrides = {"args": args}
+    if(args["execute_change_set"]):
+        overrides["deployment"] = {"stack": {"execute_change_set": True}}
+    return [freeze(merge_configs(config, overrides)) for config in compiled]
 
 def get_logger():
     logger = logging.getLogger("root")
@@ -1,12 +1,23 @@
-from docker import DockerClient 
-from utils.config_utils import get_logger
-from typing import Any
-from docker.errors import ImageNotFound
+from typing import Any, Dict, Iterable, TYPE_CHECKING
+from utils.exceptions import DockerException
+from utils.trace_utils import start_span
+import hashlib
+import logging
+import os
+import time
 
-LOGGER = get_logger()
+if TYPE_CHECKING:
+    from docker import DockerClient
 
-def get_docker_image(client: DockerClient, image_name: str) -> Any:
+LOGGER = logging.getLogger()
+
+# seconds between two progress lines of a build or push
+PROGRESS_LOG_INTERVAL = 5.0
+LAYER_DONE_STATUSES = {"Pushed", "Layer already exists", "Pull complete", "Already exists"}
+
+def get_docker_image(client: "DockerClient", image_name: str) -> Any:
     """Get docker image."""
+    from docker.errors import ImageNotFound
     try:
         image = client.images.get(image_name)
         LOGGER.info(f"Image with name {image_name} already exists.")
@@ -18,20 +29,154 @@ def get_docker_image(client: DockerClient, image_name: str) -> Any:
         LOGGER.error(f"An error occurred: {e}")
         exit(1)
 
-def build_docker_image(client: DockerClient, filepath: str, image_name: str) -> Any:
-    """Build docker image."""
+def compute_build_context_hash(filepath: str, length: int = 12) -> str:
+    """Compute a content hash of the docker build context.
+
+    Relative paths and file contents are hashed in sorted order, so the hash
+    only changes when a file in the build context is added, removed or edited.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(filepath):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            digest.update(os.path.relpath(path, filepath).replace(os.sep, "/").encode("utf-8"))
+            digest.update(b"\0")
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()[:length]
+
+
+def new_stream_state(operation: str, image: str) -> Dict[str, Any]:
+    """Create the state of a Docker build or push stream.
+
+    Only the last status and byte counts of each layer are kept, so memory
+    grows with the number of layers, not with the length of the log.
+    """
+    now = time.monotonic()
+    return {
+        "operation": operation,
+        "image": image,
+        "layers": {},
+        "layer_bytes": {},
+        "steps": 0,
+        "image_id": None,
+        "started": now,
+        "last_log": now
+    }
+
+
+def get_stream_bytes(state: Dict[str, Any]) -> int:
+    return sum(current for current, _ in state["layer_bytes"].values())
+
+
+def log_stream_progress(state: Dict[str, Any]) -> None:
+    """Log the layers done, bytes transferred and throughput of a stream."""
+    elapsed = max(time.monotonic() - state["started"], 1e-6)
+    done = sum(1 for status in state["layers"].values() if is_layer_done(status))
+    megabytes = get_stream_bytes(state) / 1024 / 1024
+    LOGGER.info(f"{state['operation'].capitalize()} {state['image']}: {done}/{len(state['layers'])} layers done, "
+                f"{megabytes:.1f} MB at {megabytes / elapsed:.1f} MB/s")
+    state["last_log"] = time.monotonic()
+
+
+def is_layer_done(status: str) -> bool:
+    return status in LAYER_DONE_STATUSES or status.startswith("Mounted from")
+
+
+def update_stream_state(state: Dict[str, Any], message: Dict[str, Any]) -> None:
+    """Apply one decoded message of a Docker stream, failures in the stream raise DockerException."""
+    if(message.get("error") or message.get("errorDetail")):
+        error = message.get("error") or message["errorDetail"].get("message")
+        raise DockerException(f"Docker {state['operation']} of {state['image']} failed: {error}", state["image"])
+
+    line = (message.get("stream") or "").strip()
+    if(line.startswith("Step ")):
+        state["steps"] += 1
+        LOGGER.info(f"Build {state['image']}: {line}")
+    elif(line):
+        LOGGER.debug(f"Build log: {line}")
+    if(isinstance(message.get("aux"), dict) and message["aux"].get("ID")):
+        state["image_id"] = message["aux"]["ID"]
+
+    layer, status = message.get("id"), message.get("status")
+    if(layer is None or status is None or "progressDetail" not in message): return
+    detail = message.get("progressDetail") or {}
+    if("current" in detail):
+        state["layer_bytes"][layer] = (detail["current"], detail.get("total") or 0)
+    previous = state["layers"].get(layer)
+    state["layers"][layer] = status
+    if(status != previous and is_layer_done(status)):
+        current, _ = state["layer_bytes"].get(layer, (0, 0))
+        LOGGER.info(f"{state['operation'].capitalize()} {state['image']}: layer {layer} {status}"
+                    + (f" ({current / 1024 / 1024:.1f} MB)" if current else ""))
+
+
+def follow_docker_stream(stream: Iterable[Dict[str, Any]], operation: str, image: str,
+                         interval: float = PROGRESS_LOG_INTERVAL) -> Dict[str, Any]:
+    """Consume a decoded Docker stream message by message, logging progress every interval seconds.
+
+    :return: Final stream state, with the last status of each layer.
+    :rtype: Dict[str, Any]
+    """
+    state = new_stream_state(operation, image)
+    for message in stream:
+        update_stream_state(state, message)
+        if(time.monotonic() - state["last_log"] >= interval and len(state["layers"]) > 0):
+            log_stream_progress(state)
+    state["duration"] = time.monotonic() - state["started"]
+    state["bytes"] = get_stream_bytes(state)
+    return state
+
+
+def build_docker_image(client: "DockerClient", filepath: str, image_name: str) -> Any:
+    """Build docker image unless an image with the exact same tag exists locally.
+
+    Callers tag images with compute_build_context_hash, so an existing image
+    always matches the current build context. The build output is consumed
+    as a decoded stream through the low level API, the high level one keeps
+    the whole log in memory.
+    """
 
     image = get_docker_image(client, image_name)
     if(image is not None): return image
 
-    LOGGER.info(f"Image with name {image_name} does not exist.")
     LOGGER.info(f"Building image with name {image_name}.")
         
     try:
-        image, build_log = client.images.build(path=filepath, tag=image_name)
-        LOGGER.info(f"Build image: {image}")
-        LOGGER.debug(f"Build log: {build_log}")
+        with start_span("docker.build", image=image_name) as span:
+            stream = client.api.build(path=filepath, tag=image_name, rm=True, decode=True)
+            state = follow_docker_stream(stream, "build", image_name)
+            span.add("build_steps", state["steps"])
+        image = client.images.get(image_name)
+        LOGGER.info(f"Build image: {image_name} ({state['image_id']}) in {state['duration']:.1f}s")
         return image
     except Exception as e:
         LOGGER.error(f"An error occurred: {e}")
-        exit(1)
\ No newline at end of file
+        exit(1)
+
+
+def push_docker_image(client: "DockerClient", repository: str, tag: str,
+                      auth_config: Dict[str, str] = None) -> Dict[str, Any]:
+    """Push an image tag, following the push stream layer by layer.
+
+    Works with any registry, e.g. a registry:2 container on localhost:5000.
+
+    :param auth_config: Registry credentials passed to the Docker SDK, no docker login needed.
+    :return: Final stream state, with the last status of each layer and the bytes pushed.
+    :rtype: Dict[str, Any]
+    """
+    image = f"{repository}:{tag}"
+    with start_span("docker.push", image=image) as span:
+        stream = client.images.push(repository, tag=tag, stream=True, decode=True, auth_config=auth_config)
+        state = follow_docker_stream(stream, "push", image)
+        pushed = sum(1 for status in state["layers"].values() if status == "Pushed")
+        span.add("layers_pushed", pushed)
+        span.add("layers_existing", len(state["layers"]) - pushed)
+        span.add("bytes_pushed", state["bytes"])
+    megabytes = state["bytes"] / 1024 / 1024
+    LOGGER.info(f"Pushed {image}: {pushed} layers pushed, {len(state['layers']) - pushed} already present, "
+                f"{megabytes:.1f} MB at {megabytes / max(state['duration'], 1e-6):.1f} MB/s")
+    return state
@@ -0,0 +1,36 @@
+from typing import Dict, List
+
+
+class BaseSpecificException(Exception):
+    pass
+
+class S3UploadException(BaseSpecificException):
+    def __init__(self, message: str, errors: Dict[str, Exception]):
+        super().__init__(message)
+        self.errors = errors
+
+class StackOperationException(BaseSpecificException):
+    def __init__(self, message: str, status: str):
+        super().__init__(message)
+        self.status = status
+
+class AWSCallException(BaseSpecificException):
+    def __init__(self, message: str, operation: str, code: str):
+        super().__init__(message)
+        self.operation = operation
+        self.code = code
+
+class ArtifactException(BaseSpecificException):
+    def __init__(self, message: str, url: str):
+        super().__init__(message)
+        self.url = url
+
+class ConfigException(BaseSpecificException):
+    def __init__(self, message: str, errors: List[str]):
+        super().__init__(message)
+        self.errors = errors
+
+class DockerException(BaseSpecificException):
+    def __init__(self, message: str, image: str):
+        super().__init__(message)
+        self.image = image
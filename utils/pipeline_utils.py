@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List
+import logging
+import time
+
+from utils.trace_utils import start_span, submit
+
+LOGGER = logging.getLogger()
+
+class Task:
+    """A named pipeline step with the names of the steps it depends on.
+
+    The callable receives a dictionary with the results of its dependencies.
+    """
+    def __init__(self, name: str, fn: Callable[[Dict[str, Any]], Any], deps: List[str] = None):
+        self.name = name
+        self.fn = fn
+        self.deps = deps or []
+
+
+def check_pipeline(tasks: List[Task]) -> None:
+    """Check that task names are unique, dependencies exist and there are no cycles."""
+    names = [task.name for task in tasks]
+    if(len(names) != len(set(names))):
+        raise ValueError(f"Duplicate task names in pipeline: {names}")
+
+    deps = {task.name: task.deps for task in tasks}
+    for name, task_deps in deps.items():
+        for dep in task_deps:
+            if(dep not in deps):
+                raise ValueError(f"Task {name} depends on unknown task {dep}")
+
+    visited, visiting = set(), set()
+    def visit(name: str) -> None:
+        if(name in visited): return
+        if(name in visiting):
+            raise ValueError(f"Dependency cycle in pipeline at task {name}")
+        visiting.add(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.remove(name)
+        visited.add(name)
+
+    for name in names:
+        visit(name)
+
+
+def run_pipeline(tasks: List[Task], max_workers: int = 8, pipeline_name: str = "pipeline",
+                 timings: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Run tasks concurrently as soon as their dependencies have completed.
+
+    On the first failure no further task is started, queued tasks are
+    cancelled, running tasks are awaited and the exception is re-raised.
+    The worker threads are named after the pipeline, so that the log lines
+    of concurrent pipelines can be told apart. Each task runs in its own
+    span and the (start, end) monotonic times of the tasks are collected
+    into timings when given.
+
+    :return: Results keyed by task name.
+    :rtype: Dict[str, Any]
+    """
+    check_pipeline(tasks)
+    by_name = {task.name: task for task in tasks}
+    results = {}
+    timings = timings if timings is not None else {}
+    pending = set(by_name)
+    running = {}
+
+    def run_task(task: Task) -> Any:
+        start = time.monotonic()
+        try:
+            with start_span(task.name, pipeline=pipeline_name):
+                return task.fn({dep: results[dep] for dep in task.deps})
+        finally:
+            timings[task.name] = (start, time.monotonic())
+
+    pipeline_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=pipeline_name) as executor:
+        while(len(pending) > 0 or len(running) > 0):
+            ready = [name for name in sorted(pending)
+                     if all(dep in results for dep in by_name[name].deps)]
+            for name in ready:
+                pending.remove(name)
+                running[submit(executor, run_task, by_name[name])] = name
+                LOGGER.info(f"Scheduled task: {name}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    LOGGER.info(f"Completed task: {name} in {timings[name][1] - timings[name][0]:.2f}s")
+                except BaseException as e:
+                    LOGGER.error(f"Task {name} failed: {e!r}")
+                    for other in running:
+                        other.cancel()
+                    wait(running)
+                    log_timing_summary(by_name, timings, pipeline_start)
+                    raise
+
+    log_timing_summary(by_name, timings, pipeline_start)
+    return results
+
+
+def get_critical_path(tasks: Dict[str, Task], timings: Dict[str, Any]) -> List[str]:
+    """Walk back from the last finished task through its latest finished dependency."""
+    finished = [name for name in timings if name in tasks]
+    if(len(finished) == 0): return []
+
+    path = [max(finished, key=lambda name: timings[name][1])]
+    while(True):
+        deps = [dep for dep in tasks[path[-1]].deps if dep in timings]
+        if(len(deps) == 0): break
+        path.append(max(deps, key=lambda dep: timings[dep][1]))
+    return list(reversed(path))
+
+
+def reverse_dependencies(deps: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """Invert a dependency graph, each node then depends on the nodes that depended on it."""
+    reversed_deps = {name: [] for name in deps}
+    for name, node_deps in deps.items():
+        for dep in node_deps:
+            reversed_deps[dep].append(name)
+    return reversed_deps
+
+
+def log_timing_summary(tasks: Dict[str, Task], timings: Dict[str, Any], pipeline_start: float) -> None:
+    """Log per task timings and the critical path of the pipeline."""
+    total = time.monotonic() - pipeline_start
+    LOGGER.info(f"Pipeline timing summary (total {total:.2f}s):")
+    for name, (start, end) in sorted(timings.items(), key=lambda item: item[1][0]):
+        LOGGER.info(f" -{name}: start +{start - pipeline_start:.2f}s, duration {end - start:.2f}s")
+
+    critical_path = get_critical_path(tasks, timings)
+    critical_time = sum(timings[name][1] - timings[name][0] for name in critical_path)
+    LOGGER.info(f"Critical path ({critical_time:.2f}s): {' -> '.join(critical_path)}")
@@ -0,0 +1,297 @@
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+import base64
+import json
+import logging
+import os
+import statistics
+import time
+from botocore.awsrequest import AWSResponse
+
+from utils.aws_call_utils import CallStats, FaultResponse
+
+LOGGER = logging.getLogger()
+
+PLAN_ACCOUNT = "000000000000"
+
+def plan_caller_identity(params: Dict[str, Any], region: str) -> Tuple[int, Dict[str, Any]]:
+    return 200, {"Account": PLAN_ACCOUNT, "UserId": "PLAN", "Arn": f"arn:aws:iam::{PLAN_ACCOUNT}:user/plan"}
+
+
+def plan_create_repository(params: Dict[str, Any], region: str) -> Tuple[int, Dict[str, Any]]:
+    name = params["repositoryName"]
+    return 200, {"repository": {
+        "repositoryName": name,
+        "repositoryUri": f"{PLAN_ACCOUNT}.dkr.ecr.{region}.amazonaws.com/{name}"
+    }}
+
+
+def plan_authorization_token(params: Dict[str, Any], region: str) -> Tuple[int, Dict[str, Any]]:
+    return 200, {"authorizationData": [{
+        "authorizationToken": base64.b64encode(b"AWS:plan").decode(),
+        "proxyEndpoint": f"https://{PLAN_ACCOUNT}.dkr.ecr.{region}.amazonaws.com",
+        "expiresAt": datetime.now(timezone.utc) + timedelta(hours=12)
+    }]}
+
+
+def plan_create_stack(params: Dict[str, Any], region: str) -> Tuple[int, Dict[str, Any]]:
+    return 200, {"StackId": f"arn:aws:cloudformation:{region}:{PLAN_ACCOUNT}:stack/{params['StackName']}/plan"}
+
+
+def plan_stack_events(params: Dict[str, Any], region: str) -> Tuple[int, Dict[str, Any]]:
+    # a single terminal event of the root stack ends wait_for_stack on the first poll
+    stack_id = params["StackName"]
+    name = stack_id.split("/")[1] if stack_id.startswith("arn:") else stack_id
+    return 200, {"StackEvents": [{
+        "EventId": f"{name}-plan",
+        "StackId": stack_id,
+        "StackName": name,
+        "LogicalResourceId": name,
+        "PhysicalResourceId": stack_id,
+        "ResourceType": "AWS::CloudFormation::Stack",
+        "ResourceStatus": "CREATE_COMPLETE",
+        "Timestamp": datetime.now(timezone.utc)
+    }]}
+
+
+def plan_error(code: str, message: str) -> Callable[[Dict[str, Any], str], Tuple[int, Dict[str, Any]]]:
+    return lambda params, region: (400, {"Error": {"Code": code, "Message": message.format(**params)}})
+
+
+# responses of a fresh account, where nothing was deployed yet, other operations answer an empty response
+PLAN_RESPONSES = {
+    "sts.GetCallerIdentity": plan_caller_identity,
+    "s3.ListObjectsV2": lambda params, region: (200, {"Contents": [], "KeyCount": 0, "IsTruncated": False}),
+    "s3.PutObject": lambda params, region: (200, {"ETag": '"plan"'}),
+    "s3.CreateMultipartUpload": lambda params, region: (200, {"UploadId": "plan"}),
+    "s3.UploadPart": lambda params, region: (200, {"ETag": '"plan"'}),
+    "ecr.DescribeRepositories": plan_error("RepositoryNotFoundException",
+                                           "The repository with name '{repositoryNames[0]}' does not exist"),
+    "ecr.CreateRepository": plan_create_repository,
+    "ecr.DescribeImages": plan_error("ImageNotFoundException", "The image does not exist"),
+    "ecr.GetAuthorizationToken": plan_authorization_token,
+    "secrets-manager.CreateSecret": lambda params, region: (200, {"Name": params["Name"], "ARN": params["Name"]}),
+    "cloudformation.DescribeStacks": plan_error("ValidationError", "Stack with id {StackName} does not exist"),
+    "cloudformation.CreateStack": plan_create_stack,
+    "cloudformation.DescribeStackEvents": plan_stack_events
+}
+
+def load_latencies(path: str) -> Dict[str, float]:
+    """Load the median latency of each operation from the calls recorded by a previous run."""
+    with open(path, "r") as f:
+        calls = json.load(f)["calls"]
+    latencies = {}
+    for call in calls:
+        latencies.setdefault(f"{call['service']}.{call['operation']}", []).append(call["latency"])
+    return {name: statistics.median(values) for name, values in latencies.items()}
+
+
+class PlanBackend:
+    """In process stand-in for AWS, Docker and the artifact downloads.
+
+    AWS calls are answered with the responses of a fresh account and Docker
+    calls by a fake client, nothing leaves the process. Each call waits for
+    the latency recorded for its operation by a previous run, none when no
+    recording is given, so the orchestration can be timed deterministically.
+    With answer_aws disabled the AWS calls go to the configured endpoint,
+    such as a moto server, and only Docker and the downloads are faked.
+    """
+
+    def __init__(self, latencies: Dict[str, float] = None, answer_aws: bool = True):
+        self.latencies = latencies or {}
+        self.answer_aws = answer_aws
+        # images of the fake Docker daemon, shared by the fake clients
+        self.image_names = set()
+
+    def wait(self, service: str, operation: str) -> None:
+        latency = self.latencies.get(f"{service}.{operation}", 0.0)
+        if(latency > 0): time.sleep(latency)
+
+    def attach(self, client) -> None:
+        """Answer the calls of a boto3 client created by the call layer."""
+        if(self.answer_aws == False): return
+        service = client.meta.service_model.service_id.hyphenize()
+        region = client.meta.region_name
+
+        def before_call(model, context: Dict[str, Any], **_) -> Tuple[AWSResponse, Dict[str, Any]]:
+            params = context.get("call_layer", {}).get("params") or {}
+            self.wait(service, model.name)
+            response = PLAN_RESPONSES.get(f"{service}.{model.name}")
+            status_code, parsed = response(params, region) if response else (200, {})
+            parsed["ResponseMetadata"] = {"HTTPStatusCode": status_code, "RequestId": "plan"}
+            return AWSResponse(f"https://{service}.{region}.amazonaws.com/", status_code, {},
+                               FaultResponse(b"")), parsed
+
+        # registered last, botocore's own before-call handlers keep running first
+        client.meta.events.register_last(f"before-call.{service}", before_call)
+
+    def call(self, stats: CallStats, service: str, operation: str, params: Dict[str, Any],
+             fn: Callable[[], Any] = None) -> Any:
+        """Record a faked call in the call stats, after waiting for its latency."""
+        start = time.monotonic()
+        self.wait(service, operation)
+        stats.record(service, operation, time.monotonic() - start, 0, 0.0, None, params)
+        return fn() if fn else None
+
+    def docker_client(self, stats: CallStats) -> "PlanDockerClient":
+        return PlanDockerClient(self, stats)
+
+    def fetch_artifacts(self, stats: CallStats, artifacts: List[Dict[str, Any]],
+                        cache_dir: str) -> List[Tuple[str, str]]:
+        """Record the download of the artifacts missing from the cache, only cached artifacts are mirrored."""
+        files = []
+        for artifact in artifacts:
+            file_path = os.path.join(cache_dir, artifact["role"], artifact["filename"])
+            if(os.path.exists(file_path)):
+                files.append((file_path, artifact["key"]))
+            else:
+                self.call(stats, "http", "GET", {"url": artifact["url"]})
+        return sorted(files, key=lambda file: file[1])
+
+
+def create_plan_backend(args: Dict[str, Any], aws_config: Dict[str, Any]) -> PlanBackend:
+    """Create the plan backend of the command line arguments, None when not planning."""
+    if(args["plan"] == False): return None
+    latencies = load_latencies(args["replay"]) if args["replay"] is not None else None
+    return PlanBackend(latencies, aws_config.get("endpoint_url") is None)
+
+
+def log_plan(stats: CallStats) -> None:
+    """Log the recorded calls in start order, one operation per line."""
+    with stats.lock:
+        calls = sorted(stats.calls, key=lambda call: call["start"])
+    LOGGER.info(f"Plan ({len(calls)} calls):")
+    for call in calls:
+        error = f" -> {call['error']}" if call["error"] else ""
+        LOGGER.info(f" -[{call['thread']}] {call['service']}.{call['operation']} "
+                    f"{json.dumps(call['params'], sort_keys=True)}{error}")
+
+
+class PlanImage:
+    def __init__(self, client: "PlanDockerClient", name: str):
+        self.client = client
+        self.tags = [name]
+
+    def tag(self, repository: str, tag: str = None, **_) -> bool:
+        name = f"{repository}:{tag}" if tag else repository
+        self.client.call("image.tag", {"image": self.tags[0], "name": name},
+                         lambda: self.client.backend.image_names.add(name))
+        return True
+
+
+class PlanImages:
+    def __init__(self, client: "PlanDockerClient"):
+        self.client = client
+
+    def get(self, name: str) -> PlanImage:
+        from docker.errors import ImageNotFound
+        self.client.call("images.get", {"name": name})
+        if(name not in self.client.backend.image_names):
+            raise ImageNotFound(f"No such image: {name}")
+        return PlanImage(self.client, name)
+
+    def push(self, repository: str, tag: str = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        self.client.call("images.push", {"repository": repository, "tag": tag})
+        return iter([
+            {"status": f"The push refers to repository [{repository}]"},
+            {"status": "Pushed", "progressDetail": {}, "id": "plan"},
+            {"status": f"{tag}: digest: sha256:plan size: 0"}
+        ])
+
+
+class PlanAPIClient:
+    """Low level API of the fake Docker client, builds stream their output like the real one."""
+
+    def __init__(self, client: "PlanDockerClient"):
+        self.client = client
+
+    def build(self, path: str, tag: str, **kwargs) -> Iterator[Dict[str, Any]]:
+        self.client.call("images.build", {"path": path, "tag": tag},
+                         lambda: self.client.backend.image_names.add(tag))
+        return iter([{"stream": "Step 1/1 : FROM plan\n"}, {"aux": {"ID": "sha256:plan"}}])
+
+
+class PlanDockerClient:
+    """Fake Docker client recording the image builds, tags, pushes and logins."""
+
+    def __init__(self, backend: PlanBackend, stats: CallStats):
+        self.backend = backend
+        self.stats = stats
+        self.images = PlanImages(self)
+        self.api = PlanAPIClient(self)
+
+    def call(self, operation: str, params: Dict[str, Any], fn: Callable[[], Any] = None) -> Any:
+        return self.backend.call(self.stats, "docker", operation, params, fn)
+
+    def login(self, username: str, password: str, registry: str = None, **kwargs) -> Dict[str, str]:
+        self.call("login", {"username": username, "registry": registry})
+        return {"Status": "Login Succeeded"}
+
+
+class RecordedProxy:
+    """Proxy of a part of a Docker client recording some of its calls in the call stats."""
+
+    def __init__(self, target, stats: CallStats):
+        self.target = target
+        self.stats = stats
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.target, name)
+
+    def record(self, operation: str, params: Dict[str, Any], fn: Callable[[], Any]) -> Any:
+        start = time.monotonic()
+        error = None
+        try:
+            return fn()
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.stats.record("docker", operation, time.monotonic() - start, 0, 0.0, error, params)
+
+    def record_stream(self, operation: str, params: Dict[str, Any],
+                      fn: Callable[[], Iterator[Any]]) -> Iterator[Any]:
+        """Record a streamed call once its stream is consumed, the stream is passed through as it comes."""
+        start = time.monotonic()
+        error = None
+        try:
+            yield from fn()
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.stats.record("docker", operation, time.monotonic() - start, 0, 0.0, error, params)
+
+
+class RecordedImages(RecordedProxy):
+    """Proxy of the images of a Docker client recording get and push."""
+
+    def get(self, name: str) -> Any:
+        return self.record("images.get", {"name": name}, lambda: self.target.get(name))
+
+    def push(self, repository: str, tag: str = None, **kwargs) -> Any:
+        params = {"repository": repository, "tag": tag}
+        if(kwargs.get("stream")):
+            return self.record_stream("images.push", params,
+                                      lambda: self.target.push(repository, tag=tag, **kwargs))
+        return self.record("images.push", params, lambda: self.target.push(repository, tag=tag, **kwargs))
+
+
+class RecordedAPIClient(RecordedProxy):
+    """Proxy of the low level API of a Docker client recording the streamed builds."""
+
+    def build(self, **kwargs) -> Iterator[Dict[str, Any]]:
+        params = {"path": kwargs.get("path"), "tag": kwargs.get("tag")}
+        return self.record_stream("images.build", params, lambda: self.target.build(**kwargs))
+
+
+class RecordedDockerClient:
+    """Proxy of a Docker client recording the image calls in the call stats, so they can be replayed."""
+
+    def __init__(self, client, stats: CallStats):
+        self.client = client
+        self.images = RecordedImages(client.images, stats)
+        self.api = RecordedAPIClient(client.api, stats)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
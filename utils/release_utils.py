@@ -0,0 +1,171 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+import hashlib
+import json
+import logging
+import os
+
+from botocore.exceptions import BotoCoreError, ClientError
+from boto3.s3.transfer import TransferConfig
+from constants import RELEASES_S3_PREFIX, RELEASE_DIRS, RELEASES_CACHE_DIR, S3_UPLOAD_MAX_WORKERS, TEMPLATES_DIR
+from utils.aws_utils import (
+    list_s3_objects,
+    list_local_files,
+    sync_dirs_to_s3,
+    delete_s3_keys,
+    to_aws_call_exception
+)
+from utils.trace_utils import add_metrics
+
+LOGGER = logging.getLogger()
+
+RELEASE_MANIFEST = "manifest.json"
+# releases kept whatever the retention, the deployed one and the one a failed update rolls back to
+MIN_RETAINED_RELEASES = 2
+
+def get_release_prefix(release_id: str) -> str:
+    return f"{RELEASES_S3_PREFIX}/{release_id}"
+
+
+def compute_release(source_dirs: List[str] = RELEASE_DIRS, bundles: Dict[str, str] = None,
+                    image_tag: str = None) -> Dict[str, Any]:
+    """Describe the templates and scripts published together as one release.
+
+    The release id is the hash of the manifest listing the path, size and
+    sha256 of every file, the node script bundle keys and the Lambda image
+    tag, so the same deployment always maps to the same prefix and a
+    release pins everything the stack is deployed with.
+
+    :param bundles: S3 key of the bundle of each role.
+    :param image_tag: Tag of the dbbootstrap Lambda image.
+    :return: Release id, S3 prefix, source directories and manifest.
+    :rtype: Dict[str, Any]
+    """
+    files = []
+    for source_dir in source_dirs:
+        for file_path in list_local_files(source_dir):
+            with open(file_path, "rb") as f:
+                content = f.read()
+            files.append({
+                "path": file_path.replace(os.sep, "/"),
+                "size": len(content),
+                "sha256": hashlib.sha256(content).hexdigest()
+            })
+    files.sort(key=lambda file: file["path"])
+    content = {"files": files, "bundles": bundles or {}, "image_tag": image_tag}
+    release_id = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:16]
+    return {
+        "id": release_id,
+        "prefix": get_release_prefix(release_id),
+        "dirs": list(source_dirs),
+        "manifest": {"release": release_id, **content}
+    }
+
+
+def release_exists(client, bucket_name: str, release_id: str) -> bool:
+    """Check if a release is published, that is if its manifest exists."""
+    manifest_key = f"{get_release_prefix(release_id)}/{RELEASE_MANIFEST}"
+    return manifest_key in list_s3_objects(client, bucket_name, manifest_key)
+
+
+def load_release(client, bucket_name: str, release_id: str) -> Dict[str, Any]:
+    """Load the manifest of a published release, None if it is not published."""
+    if(release_exists(client, bucket_name, release_id) == False): return None
+    manifest_key = f"{get_release_prefix(release_id)}/{RELEASE_MANIFEST}"
+    try:
+        return json.loads(client.get_object(Bucket=bucket_name, Key=manifest_key)["Body"].read())
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"load manifest of release {release_id}")
+
+
+def fetch_release_template(client, bucket_name: str, release_id: str) -> str:
+    """Download the root template of a published release, to check the stack parameters against it.
+
+    :return: Path of the downloaded template.
+    :rtype: str
+    """
+    template_path = os.path.join(RELEASES_CACHE_DIR, release_id, TEMPLATES_DIR, "main.yaml")
+    os.makedirs(os.path.dirname(template_path), exist_ok=True)
+    try:
+        client.download_file(bucket_name, f"{get_release_prefix(release_id)}/{TEMPLATES_DIR}/main.yaml",
+                             template_path)
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"download root template of release {release_id}")
+    return template_path
+
+
+def publish_release(client,
+                    bucket_name: str,
+                    release: Dict[str, Any],
+                    image_uri: str,
+                    max_workers: int = S3_UPLOAD_MAX_WORKERS,
+                    transfer_config: TransferConfig = None) -> bool:
+    """Upload a release under its prefix unless it is already published.
+
+    The files go first and the manifest last, so a prefix with a manifest is
+    always complete and an interrupted publish resumes with the missing files.
+    Published prefixes are never written again. The manifest records the
+    image URI of the environment bucket, so the release can be deployed
+    again with --release.
+
+    :return: True if the release was uploaded, False if it was already published.
+    :rtype: bool
+    """
+    if(release_exists(client, bucket_name, release["id"])):
+        LOGGER.info(f"Release {release['id']} is already published in S3 Bucket {bucket_name}")
+        add_metrics(releases_reused=1)
+        return False
+
+    sync_dirs_to_s3(client, bucket_name, release["dirs"], max_workers, transfer_config, release["prefix"] + "/")
+    manifest = {**release["manifest"], "image_uri": image_uri, "published": datetime.now(timezone.utc).isoformat()}
+    try:
+        client.put_object(Bucket=bucket_name, Key=f"{release['prefix']}/{RELEASE_MANIFEST}",
+                          Body=json.dumps(manifest, indent=2, sort_keys=True).encode(),
+                          ContentType="application/json")
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"publish manifest of release {release['id']}")
+    LOGGER.info(f"Published release {release['id']} with {len(release['manifest']['files'])} files "
+                f"under s3://{bucket_name}/{release['prefix']}/")
+    return True
+
+
+def get_releases(objects: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Get the published releases among the objects under the releases prefix, newest first."""
+    releases = []
+    for key, obj in objects.items():
+        parts = key.split("/")
+        if(len(parts) == 3 and parts[2] == RELEASE_MANIFEST):
+            releases.append({"id": parts[1], "published": obj["LastModified"]})
+    return sorted(releases, key=lambda release: release["published"], reverse=True)
+
+
+def list_releases(client, bucket_name: str) -> List[Dict[str, Any]]:
+    """List the published releases of a bucket, newest first."""
+    return get_releases(list_s3_objects(client, bucket_name, RELEASES_S3_PREFIX + "/"))
+
+
+def prune_releases(client, bucket_name: str, keep: List[str], retain: int) -> List[str]:
+    """Delete the releases older than the retain newest ones, the releases in keep are never deleted.
+
+    Manifests are deleted before the files, so a partly deleted release is
+    not taken as published and is uploaded again if it is deployed later.
+
+    :param retain: Number of releases kept, at least MIN_RETAINED_RELEASES, None or 0 keeps every release.
+    :return: Ids of the deleted releases.
+    :rtype: List[str]
+    """
+    if(not retain): return []
+    objects = list_s3_objects(client, bucket_name, RELEASES_S3_PREFIX + "/")
+    releases = get_releases(objects)
+    stale = [release["id"] for release in releases[max(retain, MIN_RETAINED_RELEASES):]
+             if release["id"] not in keep]
+    if(len(stale) == 0): return []
+
+    manifests = [f"{get_release_prefix(release_id)}/{RELEASE_MANIFEST}" for release_id in stale]
+    delete_s3_keys(client, bucket_name, manifests)
+    files = [key for key in objects for release_id in stale
+             if key.startswith(get_release_prefix(release_id) + "/") and key not in manifests]
+    delete_s3_keys(client, bucket_name, sorted(files))
+    add_metrics(releases_pruned=len(stale))
+    LOGGER.info(f"Pruned {len(stale)} releases from S3 Bucket {bucket_name}: {', '.join(stale)}")
+    return stale
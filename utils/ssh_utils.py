@@ -1,15 +1,21 @@
 import subprocess
-from utils.config_utils import get_logger
+import logging
 import os
 
-LOGGER = get_logger()
+LOGGER = logging.getLogger()
 
 def generate_key(key_path: str) -> str:
-    """Generate SSH key."""
+    """Generate SSH key unless the key pair already exists."""
+    if(os.path.exists(key_path) and os.path.exists(key_path + ".pub")):
+        LOGGER.info(f"SSH key with path {key_path} already exists.")
+        return key_path
+
+    os.makedirs(os.path.dirname(os.path.abspath(key_path)), mode=0o700, exist_ok=True)
     try:
         subprocess.run(
             ["ssh-keygen", "-t", "rsa", "-b", "2048", "-f", key_path, "-N", ""], check=True)
         LOGGER.info(f"Generated SSH key with path: {key_path}")
+        return key_path
     except subprocess.CalledProcessError as e:
         LOGGER.error(f"An error occurred while generating SSH key: {e}")
         exit(1)
\ No newline at end of file
@@ -0,0 +1,91 @@
+from typing import Any, Dict
+import json
+import logging
+import os
+import threading
+import time
+
+from constants import CACHE_DIR, PLAN_DIR
+
+LOGGER = logging.getLogger()
+
+STATE_DIR = os.path.join(CACHE_DIR, "state")
+PLAN_STATE_DIR = os.path.join(PLAN_DIR, "state")
+
+class DeploymentState:
+    """Local record of the resources created by previous runs of a deployment.
+
+    Each entry holds a value, the fingerprint of the inputs it was created
+    from and an optional TTL. Lookups miss when the entry expired, when the
+    fingerprint changed or when refresh is enabled, so the step revalidates
+    against AWS and records the entry again. Entries are saved on every put,
+    since the deployment steps record them concurrently. Planned runs keep
+    their state apart, under PLAN_STATE_DIR.
+
+    Once bound to the AWS account of the caller, entries recorded for
+    another account miss, so the same config run against another account
+    never reuses its resources.
+    """
+    def __init__(self, project: str, environment: str, region: str, refresh: bool = False,
+                 state_dir: str = STATE_DIR):
+        self.state_dir = state_dir
+        self.path = os.path.join(state_dir, f"{project}-{environment}-{region}.json")
+        self.refresh = refresh
+        self.account = None
+        self.lock = threading.Lock()
+        self.entries = {}
+        if(os.path.exists(self.path)):
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)
+            except ValueError as e:
+                LOGGER.warning(f"Ignoring corrupted deployment state {self.path}: {e}")
+
+    def get(self, name: str, fingerprint: str = None) -> Any:
+        """Get the value of an entry, None if missing, expired, stale or refreshing."""
+        if(self.refresh): return None
+        with self.lock:
+            entry = self.entries.get(name)
+        if(entry is None): return None
+        if(entry["ttl"] is not None and time.time() > entry["recorded_at"] + entry["ttl"]):
+            return None
+        if(entry["fingerprint"] != fingerprint or entry.get("account") != self.account):
+            return None
+        LOGGER.info(f"Using cached deployment state for {name}")
+        return entry["value"]
+
+    def put(self, name: str, value: Any, fingerprint: str = None, ttl: float = None) -> None:
+        """Record an entry and save the state file."""
+        with self.lock:
+            self.entries[name] = {
+                "value": value,
+                "fingerprint": fingerprint,
+                "recorded_at": time.time(),
+                "ttl": ttl,
+                "account": self.account
+            }
+            os.makedirs(self.state_dir, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+    def bind_account(self, account: str) -> None:
+        """Scope the next lookups and records to the AWS account of the caller."""
+        with self.lock:
+            self.account = account
+
+    def clear(self) -> None:
+        """Forget every entry, once the resources they record are deleted."""
+        with self.lock:
+            self.entries = {}
+            if(os.path.exists(self.path)):
+                os.remove(self.path)
+
+    def cached(self, name: str, fn, fingerprint: str = None, ttl: float = None) -> Any:
+        """Return the cached value of an entry or compute and record it with fn."""
+        value = self.get(name, fingerprint)
+        if(value is None):
+            value = fn()
+            self.put(name, value, fingerprint, ttl)
+        return value
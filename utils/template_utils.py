@@ -0,0 +1,207 @@
+from typing import Any, Dict, List, Tuple
+import hashlib
+import json
+import logging
+import os
+import re
+import yaml
+
+from constants import TEMPLATES_DIR, CACHE_DIR
+
+LOGGER = logging.getLogger()
+
+NESTED_STACK_RESOURCE_TYPE = "AWS::CloudFormation::Stack"
+# nested templates are published under the bucket and the release prefix, both substituted
+TEMPLATE_URL_REGEX = re.compile(r"^https://s3[.\w-]*\.amazonaws\.com/\$\{[^}]+\}/(?:\$\{[^}]+\}/)?(?P<key>.+)$")
+SUB_VARIABLE_REGEX = re.compile(r"\$\{(?!!)([^}]+)\}")
+TEMPLATES_CACHE_DIR = os.path.join(CACHE_DIR, "templates")
+
+BaseLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+class CloudFormationLoader(BaseLoader):
+    """YAML loader turning CloudFormation short form intrinsics into their long form."""
+    pass
+
+
+def construct_intrinsic(loader: yaml.Loader, tag_suffix: str, node: yaml.Node) -> Dict[str, Any]:
+    if(isinstance(node, yaml.ScalarNode)):
+        value = loader.construct_scalar(node)
+    elif(isinstance(node, yaml.SequenceNode)):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+
+    if(tag_suffix == "Ref"):
+        return {"Ref": value}
+    if(tag_suffix == "GetAtt" and isinstance(value, str)):
+        value = value.split(".", 1)
+    return {f"Fn::{tag_suffix}": value}
+
+
+CloudFormationLoader.add_multi_constructor("!", construct_intrinsic)
+
+
+def load_template(template_path: str) -> Dict[str, Any]:
+    """Load a CloudFormation template, caching the parsed template on disk as JSON by content hash.
+
+    Values YAML loads as other types than JSON ones, as unquoted dates, are
+    kept as strings, as CloudFormation reads them, on a cache miss too.
+    """
+    with open(template_path, "rb") as f:
+        content = f.read()
+
+    cache_path = os.path.join(TEMPLATES_CACHE_DIR, hashlib.sha256(content).hexdigest() + ".json")
+    if(os.path.exists(cache_path)):
+        with open(cache_path, "r") as f:
+            return json.load(f)
+
+    parsed = json.dumps(yaml.load(content, Loader=CloudFormationLoader) or {}, default=str)
+    os.makedirs(TEMPLATES_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        f.write(parsed)
+    os.replace(tmp_path, cache_path)
+    return json.loads(parsed)
+
+
+def resolve_template_url(template_url: Any) -> str:
+    """Resolve a nested stack TemplateURL to a path relative to the repository root."""
+    if(isinstance(template_url, dict) and "Fn::Sub" in template_url):
+        template_url = template_url["Fn::Sub"]
+        if(isinstance(template_url, list)): template_url = template_url[0]
+    if(isinstance(template_url, str) == False): return None
+    match = TEMPLATE_URL_REGEX.match(template_url)
+    return match.group("key") if match else None
+
+
+def find_references(node: Any) -> List[Tuple[str, str]]:
+    """Find Ref, GetAtt and Sub references in a template node.
+
+    :return: List of (logical name, attribute) tuples, attribute is None for Ref.
+    """
+    references = []
+    if(isinstance(node, list)):
+        for item in node:
+            references.extend(find_references(item))
+    elif(isinstance(node, dict)):
+        for key, value in node.items():
+            if(key == "Ref" and isinstance(value, str)):
+                references.append((value, None))
+            elif(key == "Fn::GetAtt" and isinstance(value, list) and len(value) == 2):
+                references.append((value[0], value[1]))
+            elif(key == "Fn::Sub"):
+                text, variables = (value[0], value[1]) if isinstance(value, list) else (value, {})
+                for name in SUB_VARIABLE_REGEX.findall(text):
+                    if(name in variables): continue
+                    logical_name, _, attribute = name.partition(".")
+                    references.append((logical_name, attribute or None))
+                references.extend(find_references(variables))
+            else:
+                references.extend(find_references(value))
+    return references
+
+
+def check_references(template_path: str, template: Dict[str, Any],
+                     templates: Dict[str, Dict[str, Any]], nested: Dict[str, str]) -> List[str]:
+    """Check that Ref, GetAtt and Sub targets exist, including nested stack outputs."""
+    errors = []
+    parameters = template.get("Parameters") or {}
+    resources = template.get("Resources") or {}
+
+    sections = [("Resources", resources), ("Outputs", template.get("Outputs") or {}),
+                ("Conditions", template.get("Conditions") or {})]
+    for section, items in sections:
+        for name, item in items.items():
+            for logical_name, attribute in find_references(item):
+                where = f"{template_path}: {section}.{name}"
+                if(logical_name.startswith("AWS::")): continue
+                if(attribute is None):
+                    if(logical_name not in parameters and logical_name not in resources):
+                        errors.append(f"{where} references unknown parameter or resource {logical_name}")
+                elif(logical_name not in resources):
+                    errors.append(f"{where} references attribute of unknown resource {logical_name}")
+                elif(logical_name in nested and attribute.startswith("Outputs.")):
+                    child = templates.get(nested[logical_name])
+                    output = attribute.split(".", 1)[1]
+                    if(child is not None and output not in (child.get("Outputs") or {})):
+                        errors.append(f"{where} references unknown output {output} of {nested[logical_name]}")
+
+            depends_on = item.get("DependsOn", []) if isinstance(item, dict) else []
+            for dependency in [depends_on] if isinstance(depends_on, str) else depends_on:
+                if(dependency not in resources):
+                    errors.append(f"{template_path}: {section}.{name} depends on unknown resource {dependency}")
+    return errors
+
+
+def check_stack_parameters(where: str, declared: Dict[str, Any], passed: Dict[str, Any]) -> List[str]:
+    """Check passed parameters against the Parameters declared by a template."""
+    errors = []
+    for name in passed:
+        if(name not in declared):
+            errors.append(f"{where} passes undeclared parameter {name}")
+    for name, parameter in declared.items():
+        if(name not in passed and "Default" not in (parameter or {})):
+            errors.append(f"{where} does not pass required parameter {name}")
+    return errors
+
+
+def analyze_templates(root_template: str = f"{TEMPLATES_DIR}/main.yaml") -> List[str]:
+    """Analyze the nested stack graph starting from the root template.
+
+    Checks that nested TemplateURLs point to local templates, that the
+    parameters passed to each nested stack match its declared Parameters and
+    that Ref, GetAtt and Sub references resolve across the graph.
+
+    :return: List of errors, empty if the templates are valid.
+    :rtype: List[str]
+    """
+    errors = []
+    templates = {}
+    queue = [root_template]
+    while(len(queue) > 0):
+        template_path = queue.pop()
+        if(template_path in templates): continue
+        try:
+            templates[template_path] = template = load_template(template_path)
+        except yaml.YAMLError as e:
+            errors.append(f"{template_path}: invalid YAML: {e}")
+            continue
+
+        for name, resource in (template.get("Resources") or {}).items():
+            if(resource.get("Type") != NESTED_STACK_RESOURCE_TYPE): continue
+            child_path = resolve_template_url(resource.get("Properties", {}).get("TemplateURL"))
+            if(child_path is None):
+                errors.append(f"{template_path}: Resources.{name} has an unresolvable TemplateURL")
+            elif(os.path.isfile(child_path) == False):
+                errors.append(f"{template_path}: Resources.{name} TemplateURL points to missing file {child_path}")
+            else:
+                queue.append(child_path)
+
+    for template_path, template in templates.items():
+        nested = {}
+        for name, resource in (template.get("Resources") or {}).items():
+            if(resource.get("Type") != NESTED_STACK_RESOURCE_TYPE): continue
+            child_path = resolve_template_url(resource.get("Properties", {}).get("TemplateURL"))
+            if(child_path not in templates): continue
+            nested[name] = child_path
+            errors.extend(check_stack_parameters(
+                f"{template_path}: Resources.{name}",
+                templates[child_path].get("Parameters") or {},
+                resource.get("Properties", {}).get("Parameters") or {}))
+        errors.extend(check_references(template_path, template, templates, nested))
+
+    LOGGER.info(f"Analyzed {len(templates)} templates, found {len(errors)} errors.")
+    for error in errors:
+        LOGGER.error(error)
+    return errors
+
+
+def check_root_parameters(parameters: List[Dict[str, Any]],
+                          root_template: str = f"{TEMPLATES_DIR}/main.yaml") -> List[str]:
+    """Check the stack parameters of the deployment against the root template."""
+    declared = load_template(root_template).get("Parameters") or {}
+    passed = {parameter["ParameterKey"]: parameter["ParameterValue"] for parameter in parameters}
+    errors = check_stack_parameters(f"{root_template}: stack", declared, passed)
+    for error in errors:
+        LOGGER.error(error)
+    return errors
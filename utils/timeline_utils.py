@@ -0,0 +1,198 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+import json
+import logging
+import math
+
+from botocore.exceptions import BotoCoreError, ClientError
+from constants import TIMELINES_S3_PREFIX, S3_UPLOAD_MAX_WORKERS
+from utils.aws_utils import list_s3_objects, to_aws_call_exception
+from utils.trace_utils import submit, add_metrics
+
+LOGGER = logging.getLogger()
+
+READY_KIND = "ready"
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest rank percentile, None without values."""
+    if(len(values) == 0): return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    return {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+            "max": max(values, default=None)}
+
+
+def parse_timeline(content: str, key: str) -> List[Dict[str, Any]]:
+    """Parse the JSON lines of a node timeline, a line cut by an interrupted upload is skipped."""
+    records = []
+    for line in content.splitlines():
+        if(line.strip() == ""): continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            LOGGER.warning(f"Skipping invalid timeline record of {key}: {line!r}")
+            continue
+        record["duration"] = (record["end"] - record["start"]) / 1000
+        records.append(record)
+    return records
+
+
+def load_timeline(client, bucket_name: str, key: str) -> List[Dict[str, Any]]:
+    try:
+        content = client.get_object(Bucket=bucket_name, Key=key)["Body"].read().decode("utf-8", "replace")
+    except (ClientError, BotoCoreError) as e:
+        raise to_aws_call_exception(e, f"download timeline {key} from S3 Bucket {bucket_name}")
+    return parse_timeline(content, key)
+
+
+def load_timelines(client, bucket_name: str, max_workers: int = S3_UPLOAD_MAX_WORKERS) -> List[Dict[str, Any]]:
+    """Download the boot phase records of every node of the bucket, see scripts/common/timeline.sh."""
+    keys = sorted(key for key in list_s3_objects(client, bucket_name, TIMELINES_S3_PREFIX + "/")
+                  if key.endswith(".jsonl"))
+    records = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for future in [submit(executor, load_timeline, client, bucket_name, key) for key in keys]:
+            records.extend(future.result())
+    add_metrics(timelines=len(keys), timeline_records=len(records))
+    LOGGER.info(f"Loaded {len(records)} records of {len(keys)} nodes from S3 Bucket {bucket_name}")
+    return records
+
+
+def group_by_instance(records: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    instances = {}
+    for record in records:
+        instances.setdefault(record["instance"], []).append(record)
+    for instance_records in instances.values():
+        instance_records.sort(key=lambda record: (record["start"], record["end"]))
+    return instances
+
+
+def get_ready_time(instance_records: List[Dict[str, Any]]) -> int:
+    """Get when a node serves its role, the last ready record, None if it never got there."""
+    ready = [record["end"] for record in instance_records if record["kind"] == READY_KIND and record["status"] == "ok"]
+    return max(ready, default=None)
+
+
+def summarize_phases(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Get the duration distribution in seconds of each phase of each role, failed phases apart."""
+    phases = {}
+    for record in records:
+        if(record["kind"] == READY_KIND): continue
+        entry = phases.setdefault((record["role"], record["phase"]),
+                                  {"role": record["role"], "phase": record["phase"], "kind": record["kind"],
+                                   "durations": [], "failed": 0})
+        if(record["status"] == "ok"):
+            entry["durations"].append(record["duration"])
+        else:
+            entry["failed"] += 1
+    return [{**{key: value for key, value in entry.items() if key != "durations"}, **summarize(entry["durations"])}
+            for entry in sorted(phases.values(), key=lambda entry: (entry["role"], -sum(entry["durations"])))]
+
+
+def summarize_roles(records: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Get the join latency distribution of each role, from the node boot to the node serving its role.
+
+    The time of each kind of phase is summed per node, so the medians tell
+    whether installs, image pulls or waits dominate the join of a role.
+    """
+    roles = {}
+    for instance_records in group_by_instance(records).values():
+        role = roles.setdefault(instance_records[0]["role"], {"join": [], "kinds": {}, "not_ready": 0})
+        ready = get_ready_time(instance_records)
+        if(ready is None):
+            role["not_ready"] += 1
+            continue
+        role["join"].append((ready - instance_records[0]["start"]) / 1000)
+        kinds = {}
+        for record in instance_records:
+            if(record["kind"] == READY_KIND or record["end"] > ready): continue
+            kinds[record["kind"]] = kinds.get(record["kind"], 0) + record["duration"]
+        for kind, duration in kinds.items():
+            role["kinds"].setdefault(kind, []).append(duration)
+    return {name: {"join": summarize(role["join"]), "not_ready": role["not_ready"],
+                   "kinds": {kind: summarize(durations) for kind, durations in role["kinds"].items()}}
+            for name, role in sorted(roles.items())}
+
+
+def get_critical_path(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Get the critical path to a ready cluster, ending with the phases of the node ready last.
+
+    The node scripts run their phases one after the other, so the path of a
+    node is its own timeline. A node booting after another one was ready,
+    as the workers after the first control plane, was waiting for it: the
+    path goes through the phases of that node first, then a launch phase
+    covering the scaling of the Auto Scaling group up to the boot.
+
+    :return: Nodes of the path, total duration in seconds and phases, None if no node is ready.
+    :rtype: Dict[str, Any]
+    """
+    instances = group_by_instance(records)
+    ready = {instance: get_ready_time(instance_records) for instance, instance_records in instances.items()}
+    ready = {instance: time for instance, time in ready.items() if time is not None}
+    if(len(ready) == 0): return None
+
+    cluster_start = min(instance_records[0]["start"] for instance_records in instances.values())
+    chain = [max(ready, key=ready.get)]
+    while(True):
+        boot = instances[chain[0]][0]["start"]
+        previous = [instance for instance, time in ready.items() if time <= boot and instance not in chain]
+        if(len(previous) == 0): break
+        chain.insert(0, max(previous, key=ready.get))
+
+    path = []
+    launched = cluster_start
+    for instance in chain:
+        boot = instances[instance][0]["start"]
+        if(boot > launched):
+            path.append({"phase": "launch", "kind": "launch", "instance": instance, "start": launched, "end": boot,
+                         "duration": (boot - launched) / 1000})
+        path.extend(record for record in instances[instance]
+                    if record["kind"] != READY_KIND and record["end"] <= ready[instance])
+        launched = ready[instance]
+    total = (ready[chain[-1]] - cluster_start) / 1000
+    return {
+        "instances": [{"instance": instance, "role": instances[instance][0]["role"]} for instance in chain],
+        "duration": total,
+        # steps of the scripts outside any phase
+        "unrecorded": total - sum(record["duration"] for record in path),
+        "phases": [{key: record[key] for key in ("instance", "phase", "kind", "duration")} for record in path]
+    }
+
+
+def build_timeline_report(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        "nodes": len(group_by_instance(records)),
+        "roles": summarize_roles(records),
+        "phases": summarize_phases(records),
+        "critical_path": get_critical_path(records)
+    }
+
+
+def log_timeline_report(name: str, report: Dict[str, Any]) -> None:
+    def seconds(value: float) -> str:
+        return f"{value:.0f}s" if value is not None else "n/a"
+
+    LOGGER.info(f"Boot timeline of {name} ({report['nodes']} nodes):")
+    for role, entry in report["roles"].items():
+        LOGGER.info(f"  {role}: join p50 {seconds(entry['join']['p50'])}, p95 {seconds(entry['join']['p95'])} "
+                    f"({entry['join']['count']} ready, {entry['not_ready']} not ready)")
+        for kind, durations in sorted(entry["kinds"].items(), key=lambda item: -(item[1]["p50"] or 0)):
+            LOGGER.info(f"    {kind:<10} p50 {seconds(durations['p50'])}, p95 {seconds(durations['p95'])}")
+    LOGGER.info("Phases:")
+    for phase in report["phases"]:
+        LOGGER.info(f"  {phase['role'] + '/' + phase['phase']:<50} {phase['kind']:<8} p50 {seconds(phase['p50']):>6} "
+                    f"p95 {seconds(phase['p95']):>6} max {seconds(phase['max']):>6} ({phase['count']} ok, "
+                    f"{phase['failed']} failed)")
+    path = report["critical_path"]
+    if(path is None):
+        LOGGER.info("No node is ready yet, no critical path.")
+        return
+    LOGGER.info(f"Critical path to a ready cluster: {seconds(path['duration'])}, through "
+                + " -> ".join(f"{node['role']} {node['instance']}" for node in path["instances"]) + ":")
+    for phase in path["phases"]:
+        LOGGER.info(f"  -{phase['instance']}/{phase['phase']} ({phase['kind']}): {seconds(phase['duration'])} "
+                    f"({phase['duration'] / max(path['duration'], 1e-6):.0%})")
+    LOGGER.info(f"  -unrecorded: {seconds(path['unrecorded'])}")
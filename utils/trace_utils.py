@@ -0,0 +1,190 @@
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+LOGGER = logging.getLogger()
+
+TRACE_FORMATS = ("chrome", "otel")
+OTEL_SERVICE_NAME = "k8s-deployer"
+OTEL_STATUS_OK = 1
+OTEL_STATUS_ERROR = 2
+OTEL_SPAN_KIND_INTERNAL = 1
+
+class Span:
+    """A timed operation with attributes and metrics.
+
+    Metrics are counters, such as bytes or calls, added to the span and to
+    all of its ancestors, so each span holds the totals of its subtree.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, parent: "Span" = None, attributes: Dict[str, Any] = None):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = dict(attributes or {})
+        self.metrics = {}
+        self.error = None
+        self.thread = threading.current_thread().name
+        self.thread_id = threading.get_ident()
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add(self, metric: str, value: float = 1) -> None:
+        with self.tracer.lock:
+            span = self
+            while(span is not None):
+                span.metrics[metric] = span.metrics.get(metric, 0) + value
+                span = span.parent
+
+
+class NoopSpan:
+    """Span used when no trace is recorded."""
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def add(self, metric: str, value: float = 1) -> None:
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+class Tracer:
+    """Collects the spans of a run and exports them as a Chrome trace or OTLP JSON."""
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.spans = []
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Run a block in a new span, child of the current span of the context."""
+        span = Span(self, name, CURRENT_SPAN.get(), attributes)
+        token = CURRENT_SPAN.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            CURRENT_SPAN.reset(token)
+            with self.lock:
+                self.spans.append(span)
+
+    def get_spans(self) -> List[Span]:
+        with self.lock:
+            return sorted(self.spans, key=lambda span: span.start_ns)
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Complete events of the Trace Event Format, one row per thread, metrics as args."""
+        spans = self.get_spans()
+        origin = spans[0].start_ns if spans else 0
+        events = []
+        threads = {}
+        for span in spans:
+            threads.setdefault(span.thread_id, span.thread)
+            args = {**span.attributes, **span.metrics}
+            if(span.error): args["error"] = span.error
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".")[0],
+                "ph": "X",
+                "ts": (span.start_ns - origin) / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": os.getpid(),
+                "tid": span.thread_id,
+                "args": args
+            })
+        for thread_id, thread_name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id,
+                           "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_otel(self) -> Dict[str, Any]:
+        """Spans in the OTLP JSON encoding, as accepted by OpenTelemetry collectors."""
+        spans = []
+        for span in self.get_spans():
+            attributes = {**span.attributes, **{f"metric.{key}": value for key, value in span.metrics.items()},
+                          "thread.name": span.thread}
+            otel_span = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": OTEL_SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": to_otel_value(value)} for key, value in attributes.items()],
+                "status": {"code": OTEL_STATUS_ERROR, "message": span.error} if span.error
+                    else {"code": OTEL_STATUS_OK}
+            }
+            if(span.parent is not None):
+                otel_span["parentSpanId"] = span.parent.span_id
+            spans.append(otel_span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": OTEL_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}]
+        }]}
+
+    def export(self, path: str, trace_format: str = "chrome") -> None:
+        """Save the trace, load Chrome traces in chrome://tracing or ui.perfetto.dev."""
+        if(trace_format not in TRACE_FORMATS):
+            raise ValueError(f"Unknown trace format {trace_format}, expected one of {TRACE_FORMATS}")
+        trace = self.to_chrome_trace() if trace_format == "chrome" else self.to_otel()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(trace, f)
+        LOGGER.info(f"Saved trace of {len(self.spans)} spans to {path}")
+
+
+def to_otel_value(value: Any) -> Dict[str, Any]:
+    if(isinstance(value, bool)): return {"boolValue": value}
+    if(isinstance(value, int)): return {"intValue": str(value)}
+    if(isinstance(value, float)): return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+@contextmanager
+def start_span(name: str, **attributes) -> Iterator[Span]:
+    """Run a block in a child span of the current span, or in a no-op span when nothing is traced."""
+    parent = CURRENT_SPAN.get()
+    if(parent is None):
+        yield NOOP_SPAN
+        return
+    with parent.tracer.span(name, **attributes) as span:
+        yield span
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attributes) -> None:
+    """Record an operation timed elsewhere, such as a nested stack, as a child of the current span."""
+    parent = CURRENT_SPAN.get()
+    if(parent is None): return
+    span = Span(parent.tracer, name, parent, attributes)
+    span.start_ns, span.end_ns = start_ns, end_ns
+    with parent.tracer.lock:
+        parent.tracer.spans.append(span)
+
+
+def add_metrics(**metrics) -> None:
+    """Add metrics to the current span, if any."""
+    span = CURRENT_SPAN.get()
+    if(span is None): return
+    for metric, value in metrics.items():
+        if(value): span.add(metric, value)
+
+
+def submit(executor, fn: Callable, *args, **kwargs):
+    """Submit fn to a thread pool in a copy of the current context, so it runs in the current span."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)